@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils import timezone
 from core.models import StoredFile
+from core.retention import alive_files
 
 
 class StoredFileAdmin(admin.ModelAdmin):
@@ -26,6 +27,7 @@ class StoredFileAdmin(admin.ModelAdmin):
         Custom action to perform a soft delete on the selected records.
         """
         queryset.update(deleted_at=timezone.now())
+        alive_files.invalidate()
         self.message_user(request, f"{queryset.count()} records marked as deleted.")
 
     def restore(self, request, queryset):
@@ -33,6 +35,7 @@ class StoredFileAdmin(admin.ModelAdmin):
         Custom action to restore soft-deleted records.
         """
         queryset.update(deleted_at=None)
+        alive_files.invalidate()
         self.message_user(request, f"{queryset.count()} records restored.")
 
     def hard_delete(self, request, queryset):
@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+
+# Runs in a fresh interpreter: boots Django and serves one list-files request.
+_CHILD_SCRIPT = """
+import json
+import django
+django.setup()
+from django.test import Client
+response = Client().get('/api/list-files/')
+print(json.dumps({'status': response.status_code}), flush=True)
+"""
+
+
+def measure_cold_start(env=None, timeout=60):
+    """
+    Measures the time a fresh worker process takes to answer its first
+    successful `list-files` request, interpreter startup included.
+
+    Args:
+        env (dict, optional): Extra environment variables for the worker process.
+        timeout (float): Seconds after which the measurement is aborted.
+
+    Returns:
+        dict: A dictionary containing:
+            - status (int): HTTP status of the first response.
+            - seconds (float): Time from process start to the response.
+    """
+    child_env = dict(os.environ)
+    child_env.setdefault('DJANGO_SETTINGS_MODULE', 'django_project.settings')
+    child_env.update(env or {})
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', _CHILD_SCRIPT], cwd=settings.BASE_DIR, env=child_env,
+                            capture_output=True, text=True, timeout=timeout)
+    elapsed = time.perf_counter() - start
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold start benchmark failed: {result.stderr.strip()}")
+
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    return {"status": data["status"], "seconds": elapsed}
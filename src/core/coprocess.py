@@ -0,0 +1,184 @@
+import atexit
+import os
+import queue
+import select
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+
+class CoprocessCrashed(Exception):
+    """
+    Raised when a resident worker dies before answering a request.
+    """
+
+
+class CoprocessWorker:
+    """
+    A resident bash process that runs scripts on request (see coprocess-worker.sh).
+
+    Requests and responses are framed over the worker pipes; the script output
+    is written to per-worker files, so outputs of any size never go through
+    the response pipe. The files are emptied once read.
+    """
+    def __init__(self, scripts_dir):
+        self.tmp_dir = tempfile.mkdtemp(prefix='coprocess-')
+        self.out_path = os.path.join(self.tmp_dir, 'stdout')
+        self.err_path = os.path.join(self.tmp_dir, 'stderr')
+        self.process = subprocess.Popen(
+            ['bash', os.path.join(scripts_dir, 'coprocess-worker.sh')],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            start_new_session=True,
+        )
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def run(self, script_name, args, timeout=None):
+        """
+        Runs a script in the worker.
+
+        Returns:
+            tuple: (returncode, stdout, stderr)
+
+        Raises:
+            subprocess.TimeoutExpired: If the script does not finish in `timeout` seconds.
+            CoprocessCrashed: If the worker dies before answering.
+        """
+        fields = [script_name, self.out_path, self.err_path] + [str(arg) for arg in args]
+        request = '\0'.join([str(len(fields))] + fields) + '\0'
+        try:
+            self.process.stdin.write(request.encode())
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise CoprocessCrashed(str(e))
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        stdout = self.process.stdout
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(script_name, timeout)
+            ready, _, _ = select.select([stdout], [], [], remaining)
+            if ready:
+                break
+
+        line = stdout.readline()
+        if not line:
+            raise CoprocessCrashed(f"Worker exited with code {self.process.poll()}")
+
+        with open(self.out_path, 'r+') as out_file, open(self.err_path, 'r+') as err_file:
+            result = int(line), out_file.read(), err_file.read()
+            # The output can be a whole file: it is not kept on disk until the next request.
+            out_file.truncate(0)
+            err_file.truncate(0)
+        return result
+
+    def kill(self):
+        """
+        Kills the worker and any script it is still running.
+        """
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class CoprocessPool:
+    """
+    A fixed-size pool of resident workers. Workers are started lazily, and
+    replaced when they crash or when a request times out.
+    """
+    def __init__(self, scripts_dir, size):
+        self.scripts_dir = scripts_dir
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(size)
+
+    def run(self, script_name, args, timeout=None):
+        """
+        Runs a script in an idle worker, waiting for one if all are busy.
+        A request that finds its worker dead is retried once on a new worker.
+
+        Returns:
+            tuple: (returncode, stdout, stderr)
+        """
+        with self._slots:
+            for attempt in range(2):
+                worker = self._acquire()
+                try:
+                    result = worker.run(script_name, args, timeout=timeout)
+                except CoprocessCrashed:
+                    worker.kill()
+                    if attempt:
+                        raise
+                    continue
+                except BaseException:
+                    # The worker may still be running the script: never reuse it.
+                    worker.kill()
+                    raise
+                self._idle.put(worker)
+                return result
+
+    def _acquire(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return CoprocessWorker(self.scripts_dir)
+            if worker.is_alive():
+                return worker
+            worker.kill()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@atexit.register
+def _close_pool():
+    """
+    Stops the idle workers of the current process and removes their files.
+    """
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+
+
+def get_pool(scripts_dir):
+    """
+    Returns the pool of resident workers of the current process, or None if
+    SCRIPT_COPROCESS_POOL_SIZE is 0. A pool inherited through fork (e.g. a
+    preloading server) is discarded, since its workers belong to the parent.
+    """
+    global _pool
+    if settings.SCRIPT_COPROCESS_POOL_SIZE <= 0:
+        return None
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid() and _pool.scripts_dir != scripts_dir:
+            _pool.close()
+            _pool = None
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = CoprocessPool(scripts_dir, settings.SCRIPT_COPROCESS_POOL_SIZE)
+        return _pool
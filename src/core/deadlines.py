@@ -0,0 +1,67 @@
+import base64
+import json
+import time
+
+from core.singleflight import file_version
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a query does not finish before its deadline.
+    """
+
+
+class Deadline:
+    """
+    Point in time by which a query must finish.
+
+    It is kept as a wall-clock timestamp (`expires_at`), so it can be handed
+    to the scan worker processes, which stop on their own once it passes.
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.time() + seconds
+
+    def remaining(self):
+        """
+        Returns the seconds left before the deadline (0 once it has passed).
+        """
+        return max(self.expires_at - time.time(), 0.0)
+
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def check(self):
+        """
+        Raises:
+            DeadlineExceeded: If the deadline has passed.
+        """
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.seconds}s exceeded")
+
+
+def encode_cursor(file_path, offset):
+    """
+    Returns an opaque continuation cursor to resume a scan at `offset`.
+    The cursor is tied to the current version of the file.
+    """
+    payload = json.dumps([offset, file_version(file_path)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, file_path):
+    """
+    Returns the byte offset of a cursor made by `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed or the file changed since it was issued.
+    """
+    try:
+        offset, version = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        offset = int(offset)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Malformed cursor")
+    version = tuple(version) if version is not None else None
+    if offset < 0 or version != file_version(file_path):
+        raise ValueError("The file changed since the cursor was issued")
+    return offset
@@ -0,0 +1,221 @@
+import os
+
+from core.deadlines import DeadlineExceeded
+
+
+# Joins look at the clock once every this many rows.
+_DEADLINE_CHECK_ROWS = 4096
+
+HASH_JOIN = 'hash'
+MERGE_JOIN = 'merge'
+
+
+def read_rows(file_path, deadline=None):
+    """
+    Streams the parseable rows of a stored file.
+
+    Yields:
+        tuple: (username, folder, numberMessages, size), username and folder as bytes.
+
+    Raises:
+        DeadlineExceeded: If `deadline` passes while reading.
+    """
+    with open(file_path, 'rb') as f:
+        for count, raw in enumerate(f):
+            if deadline is not None and count % _DEADLINE_CHECK_ROWS == 0 and deadline.expired():
+                raise DeadlineExceeded(file_path)
+            parts = raw.split()
+            try:
+                yield parts[0], parts[1], int(parts[2]), int(parts[4])
+            except (ValueError, IndexError):
+                continue
+
+
+def _row(username, folder, values):
+    return {
+        "username": username.decode('utf-8', errors='replace'),
+        "folder": folder.decode('utf-8', errors='replace'),
+        "numberMessages": values[0],
+        "size": values[1],
+    }
+
+
+class _DiffCollector:
+    """
+    Accumulates the added, removed and changed (username, folder) keys.
+    """
+    def __init__(self, min_messages_change, min_size_change):
+        self.min_messages_change = min_messages_change
+        self.min_size_change = min_size_change
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.unchanged = 0
+
+    def add(self, key, values):
+        self.added.append((key, values))
+
+    def remove(self, key, values):
+        self.removed.append((key, values))
+
+    def compare(self, key, before, after):
+        delta_messages = after[0] - before[0]
+        delta_size = after[1] - before[1]
+        if ((delta_messages and abs(delta_messages) >= self.min_messages_change)
+                or (delta_size and abs(delta_size) >= self.min_size_change)):
+            self.changed.append((key, before, after))
+        else:
+            self.unchanged += 1
+
+    def result(self, strategy):
+        changed = []
+        for (username, folder), before, after in sorted(self.changed):
+            changed.append({
+                "username": username.decode('utf-8', errors='replace'),
+                "folder": folder.decode('utf-8', errors='replace'),
+                "before": {"numberMessages": before[0], "size": before[1]},
+                "after": {"numberMessages": after[0], "size": after[1]},
+                "deltaMessages": after[0] - before[0],
+                "deltaSize": after[1] - before[1],
+            })
+        return {
+            "strategy": strategy,
+            "summary": {
+                "added": len(self.added),
+                "removed": len(self.removed),
+                "changed": len(changed),
+                "unchanged": self.unchanged,
+            },
+            "added": [_row(*key, values) for key, values in sorted(self.added)],
+            "removed": [_row(*key, values) for key, values in sorted(self.removed)],
+            "changed": changed,
+        }
+
+
+def hash_join_diff(old_path, new_path, collector, deadline=None):
+    """
+    Diffs two files with a hash join: the smaller file is loaded in a hash
+    table keyed by (username, folder) and the larger one is streamed against
+    it, so memory is bounded by the smaller file.
+
+    Keys are expected to be unique in each file; in the hashed file the first
+    occurrence of a key wins.
+    """
+    build_old = os.path.getsize(old_path) <= os.path.getsize(new_path)
+    build_path, probe_path = (old_path, new_path) if build_old else (new_path, old_path)
+
+    table = {}
+    for username, folder, messages, size in read_rows(build_path, deadline):
+        table.setdefault((username, folder), (messages, size))
+
+    for username, folder, messages, size in read_rows(probe_path, deadline):
+        key = (username, folder)
+        values = (messages, size)
+        other = table.pop(key, None)
+        if other is None:
+            if build_old:
+                collector.add(key, values)
+            else:
+                collector.remove(key, values)
+        elif build_old:
+            collector.compare(key, other, values)
+        else:
+            collector.compare(key, values, other)
+
+    for key, values in table.items():
+        if build_old:
+            collector.remove(key, values)
+        else:
+            collector.add(key, values)
+
+
+def _groups(rows):
+    """
+    Groups consecutive rows by username, the first occurrence of each folder winning.
+    """
+    username, folders = None, {}
+    for row_username, folder, messages, size in rows:
+        if row_username != username:
+            if username is not None:
+                yield username, folders
+            username, folders = row_username, {}
+        folders.setdefault(folder, (messages, size))
+    if username is not None:
+        yield username, folders
+
+
+def merge_join_diff(old_path, new_path, collector, deadline=None):
+    """
+    Diffs two files already ordered by username with a merge join, streaming
+    both at once: memory is bounded by the rows of a single username.
+
+    Raises:
+        ValueError: If a file turns out not to be ordered by username.
+    """
+    old_groups = _groups(read_rows(old_path, deadline))
+    new_groups = _groups(read_rows(new_path, deadline))
+    old = next(old_groups, None)
+    new = next(new_groups, None)
+    last_old = last_new = None
+
+    while old is not None or new is not None:
+        if old is not None and last_old is not None and old[0] < last_old:
+            raise ValueError(f"{old_path} is not ordered by username")
+        if new is not None and last_new is not None and new[0] < last_new:
+            raise ValueError(f"{new_path} is not ordered by username")
+
+        if new is None or (old is not None and old[0] < new[0]):
+            for folder, values in old[1].items():
+                collector.remove((old[0], folder), values)
+            last_old, old = old[0], next(old_groups, None)
+        elif old is None or new[0] < old[0]:
+            for folder, values in new[1].items():
+                collector.add((new[0], folder), values)
+            last_new, new = new[0], next(new_groups, None)
+        else:
+            old_folders, new_folders = old[1], new[1]
+            for folder, values in new_folders.items():
+                before = old_folders.pop(folder, None)
+                if before is None:
+                    collector.add((new[0], folder), values)
+                else:
+                    collector.compare((new[0], folder), before, values)
+            for folder, values in old_folders.items():
+                collector.remove((old[0], folder), values)
+            last_old, old = old[0], next(old_groups, None)
+            last_new, new = new[0], next(new_groups, None)
+
+
+def diff_files(old_path, new_path, min_messages_change=1, min_size_change=1, sorted_inputs=False, deadline=None):
+    """
+    Computes the users added, removed and changed between two stored files,
+    keyed by (username, folder).
+
+    Args:
+        old_path (str): Path of the older snapshot.
+        new_path (str): Path of the newer snapshot.
+        min_messages_change (int): Minimum absolute change of numberMessages reported.
+        min_size_change (int): Minimum absolute change of size reported.
+        sorted_inputs (bool): Both files are known to be ordered by username,
+            so they are merge-joined instead of hash-joined.
+        deadline (Deadline, optional): Checked while the files are read.
+
+    Returns:
+        dict: The strategy used, a summary with the counts, and the added,
+        removed and changed rows ordered by (username, folder).
+
+    Raises:
+        DeadlineExceeded: If the diff does not finish before `deadline`.
+    """
+    if sorted_inputs:
+        collector = _DiffCollector(min_messages_change, min_size_change)
+        try:
+            merge_join_diff(old_path, new_path, collector, deadline)
+            return collector.result(MERGE_JOIN)
+        except ValueError:
+            # The files changed since they were known to be ordered.
+            pass
+
+    collector = _DiffCollector(min_messages_change, min_size_change)
+    hash_join_diff(old_path, new_path, collector, deadline)
+    return collector.result(HASH_JOIN)
@@ -0,0 +1,143 @@
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFileWrapper:
+    """
+    File-like object exposing only `length` bytes of a file, starting at its
+    current position. It keeps `fileno`, so WSGI servers that implement
+    `wsgi.file_wrapper` with `os.sendfile` still send it without copying
+    through Python, bounded by the Content-Length header.
+    """
+    def __init__(self, filelike, length, block_size=64 * 1024):
+        self.filelike = filelike
+        self.remaining = length
+        self.block_size = block_size
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.filelike.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.filelike.fileno()
+
+    def close(self):
+        self.filelike.close()
+
+
+def file_etag(stat):
+    """
+    Returns a strong ETag derived from the file modification time and size.
+    """
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Parses a single-range `Range` header.
+
+    Args:
+        header (str): Value of the Range header.
+        size (int): Size of the file, in bytes.
+
+    Returns:
+        tuple: The (start, end) inclusive byte positions, or None if the header
+        should be ignored (malformed or multiple ranges).
+
+    Raises:
+        ValueError: If the range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        if size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def _etag_matches(header, etag):
+    return header.strip() == '*' or etag in [value.strip() for value in header.split(',')]
+
+
+def build_download_response(request, file_path, filename):
+    """
+    Builds the response to download a stored file, honouring conditional and
+    Range requests. Depending on DOWNLOAD_SENDFILE_HEADER the body is either
+    streamed by Django or delegated to the front-end web server.
+    """
+    stat = os.stat(file_path)
+    etag = file_etag(stat)
+    size = stat.st_size
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and _etag_matches(if_none_match, etag):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    sendfile_header = settings.DOWNLOAD_SENDFILE_HEADER
+    if sendfile_header:
+        # The web server serves the file (including Range requests) itself,
+        # so the worker is released as soon as the headers are sent.
+        response = HttpResponse(content_type='application/octet-stream')
+        if sendfile_header == 'X-Accel-Redirect':
+            response[sendfile_header] = settings.DOWNLOAD_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + filename
+        else:
+            response[sendfile_header] = file_path
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            response['ETag'] = etag
+            return response
+
+    f = open(file_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(f, as_attachment=True, filename=filename)
+    else:
+        start, end = byte_range
+        f.seek(start)
+        response = FileResponse(RangeFileWrapper(f, end - start + 1), as_attachment=True,
+                                filename=filename, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,129 @@
+import heapq
+import os
+import tempfile
+
+from django.conf import settings
+
+
+def username_key(line):
+    """
+    Sort key of a raw line: its first field (the username), then the whole
+    line, compared bytewise. This is the order of `sort -k1,1`, which breaks
+    the ties of its key on the whole line, in the same direction.
+    """
+    fields = line.split(None, 1)
+    return fields[0] if fields else b'', line.rstrip(b'\n')
+
+
+def _write_run(lines, tmp_dir):
+    fd, path = tempfile.mkstemp(prefix='sort-run-', dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.writelines(lines)
+    except BaseException:
+        _remove([path])
+        raise
+    return path
+
+
+def _read_run(path):
+    with open(path, 'rb') as f:
+        yield from f
+
+
+def _merge(paths, desc):
+    return heapq.merge(*[_read_run(path) for path in paths], key=username_key, reverse=desc)
+
+
+def _split_runs(file_path, desc, run_bytes, tmp_dir, deadline):
+    """
+    Sorts the file in runs of at most `run_bytes` and spills each run to a temp file.
+    """
+    paths = []
+    run, run_size = [], 0
+    try:
+        with open(file_path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    raw += b'\n'
+                run.append(raw)
+                run_size += len(raw)
+                if run_size >= run_bytes:
+                    if deadline is not None:
+                        deadline.check()
+                    paths.append(_write_run(sorted(run, key=username_key, reverse=desc), tmp_dir))
+                    run, run_size = [], 0
+        if run:
+            paths.append(_write_run(sorted(run, key=username_key, reverse=desc), tmp_dir))
+    except BaseException:
+        _remove(paths)
+        raise
+    return paths
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def external_sort(file_path, desc=False, run_bytes=None, tmp_dir=None, max_merge=None, deadline=None):
+    """
+    Sorts the lines of a file by username with bounded memory.
+
+    The file is cut into runs of `run_bytes`, each run is sorted in memory and
+    spilled to a temp file, and the runs are k-way merged lazily. When there
+    are more than `max_merge` runs, they are first merged in intermediate
+    passes, so the number of open files stays bounded too. Lines with the same
+    username are ordered by their whole line, in the same direction, like in
+    order-by-username.sh.
+
+    Args:
+        file_path (str): Path of the file to sort.
+        desc (bool): Sort in descending order.
+        run_bytes (int, optional): Size of each in-memory run (EXTERNAL_SORT_RUN_BYTES).
+        tmp_dir (str, optional): Where runs are spilled (EXTERNAL_SORT_TMP_DIR).
+        max_merge (int, optional): Maximum runs merged at once (EXTERNAL_SORT_MAX_MERGE).
+        deadline (Deadline, optional): Checked between runs and merge passes,
+            until the first line is yielded.
+
+    Yields:
+        bytes: The sorted lines, newline-terminated.
+
+    Raises:
+        DeadlineExceeded: If the runs are not ready before `deadline`.
+    """
+    run_bytes = run_bytes or settings.EXTERNAL_SORT_RUN_BYTES
+    tmp_dir = tmp_dir or settings.EXTERNAL_SORT_TMP_DIR or None
+    max_merge = max(max_merge or settings.EXTERNAL_SORT_MAX_MERGE, 2)
+
+    paths = _split_runs(file_path, desc, run_bytes, tmp_dir, deadline)
+    try:
+        while len(paths) > max_merge:
+            merged = []
+            try:
+                for i in range(0, len(paths), max_merge):
+                    if deadline is not None:
+                        deadline.check()
+                    group = paths[i:i + max_merge]
+                    merged.append(_write_run(_merge(group, desc), tmp_dir))
+                    _remove(group)
+            except BaseException:
+                _remove(merged)
+                raise
+            paths = merged
+        yield from _merge(paths, desc)
+    finally:
+        _remove(paths)
+
+
+def should_sort_externally(file_path):
+    """
+    Returns True if the file is too large to be ordered in memory.
+    """
+    try:
+        return os.path.getsize(file_path) >= settings.EXTERNAL_SORT_THRESHOLD
+    except OSError:
+        return False
@@ -0,0 +1,325 @@
+import functools
+import heapq
+import re
+
+
+FIELDS = ('username', 'folder', 'numberMessages', 'size')
+
+_NUMERIC_FIELDS = frozenset(('numberMessages', 'size'))
+
+# Name of each field in the compiled predicate, which takes the parsed row.
+_VARIABLES = {'username': 'u', 'folder': 'f', 'numberMessages': 'm', 'size': 's'}
+
+_NUMERIC_OPERATORS = {'=': '==', '==': '==', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+_STRING_OPERATORS = ('=', '==', '!=', 'contains')
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<number>-?\d+)
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<operator><=|>=|!=|==|=|<|>)
+      | (?P<paren>[()])
+      | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )''', re.VERBOSE)
+
+
+class FilterError(ValueError):
+    """
+    Raised when a filter expression is invalid.
+    """
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if match is None:
+            raise FilterError(f"Unexpected character at position {position}: {expression[position]!r}")
+        kind = match.lastgroup
+        value, start = match.group(kind), match.start(kind)
+        if kind == 'number':
+            value = int(value)
+        elif kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'word' and value.upper() in ('AND', 'OR', 'CONTAINS'):
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value, start))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser of the filter grammar:
+
+        expression := conjunction ('OR' conjunction)*
+        conjunction := term ('AND' term)*
+        term := '(' expression ')' | field operator value
+    """
+    def __init__(self, expression):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None, None)
+
+    def _next(self, description):
+        kind, value, offset = self._peek()
+        if kind is None:
+            raise FilterError(f"Unexpected end of expression, expected {description}")
+        self.position += 1
+        return kind, value, offset
+
+    def parse(self):
+        node = self._expression()
+        kind, value, offset = self._peek()
+        if kind is not None:
+            raise FilterError(f"Unexpected {value!r} at position {offset}")
+        return node
+
+    def _expression(self):
+        nodes = [self._conjunction()]
+        while self._peek()[:2] == ('keyword', 'OR'):
+            self.position += 1
+            nodes.append(self._conjunction())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def _conjunction(self):
+        nodes = [self._term()]
+        while self._peek()[:2] == ('keyword', 'AND'):
+            self.position += 1
+            nodes.append(self._term())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def _term(self):
+        kind, value, offset = self._next("a field or '('")
+        if (kind, value) == ('paren', '('):
+            node = self._expression()
+            if self._next("')'")[:2] != ('paren', ')'):
+                raise FilterError(f"Expected ')' at position {self.tokens[self.position - 1][2]}")
+            return node
+        if kind != 'word' or value not in FIELDS:
+            raise FilterError(f"Unknown field {value!r} at position {offset}, expected one of {', '.join(FIELDS)}")
+        field = value
+
+        kind, operator, offset = self._next("an operator")
+        if kind == 'keyword' and operator == 'CONTAINS':
+            operator = 'contains'
+        elif kind != 'operator':
+            raise FilterError(f"Expected an operator at position {offset}")
+
+        kind, value, offset = self._next("a value")
+        if field in _NUMERIC_FIELDS:
+            if kind != 'number' or operator not in _NUMERIC_OPERATORS:
+                raise FilterError(f"{field} must be compared to an integer with =, !=, <, <=, > or >= "
+                                  f"(position {offset})")
+        elif kind != 'string' or operator not in _STRING_OPERATORS:
+            raise FilterError(f"{field} must be compared to a quoted string with =, != or contains "
+                              f"(position {offset})")
+        return ('cmp', field, operator, value)
+
+
+def _source(node):
+    if node[0] in ('and', 'or'):
+        return '(' + f' {node[0]} '.join(_source(child) for child in node[1]) + ')'
+
+    _, field, operator, value = node
+    variable = _VARIABLES[field]
+    if field in _NUMERIC_FIELDS:
+        return f"({variable} {_NUMERIC_OPERATORS[operator]} {value!r})"
+    literal = repr(value.encode('utf-8'))
+    if operator == 'contains':
+        return f"({literal} in {variable})"
+    return f"({variable} {'!=' if operator == '!=' else '=='} {literal})"
+
+
+def _fields(node):
+    if node[0] in ('and', 'or'):
+        return frozenset().union(*(_fields(child) for child in node[1]))
+    return frozenset((node[1],))
+
+
+def _usernames(node):
+    """
+    Usernames a matching row must have, or None if any username can match.
+    """
+    if node[0] == 'cmp':
+        return frozenset((node[3],)) if node[1] == 'username' and node[2] in ('=', '==') else None
+    sets = [_usernames(child) for child in node[1]]
+    if node[0] == 'or':
+        return None if None in sets else frozenset().union(*sets)
+    sets = [usernames for usernames in sets if usernames is not None]
+    return frozenset.intersection(*sets) if sets else None
+
+
+def _messages_bounds(node):
+    """
+    (low, high) bounds a matching row has on numberMessages, or None if unbounded.
+    """
+    if node[0] == 'cmp':
+        _, field, operator, value = node
+        if field != 'numberMessages':
+            return None
+        return {
+            '=': (value, value), '==': (value, value),
+            '<': (None, value - 1), '<=': (None, value),
+            '>': (value + 1, None), '>=': (value, None),
+        }.get(operator)
+
+    bounds = [_messages_bounds(child) for child in node[1]]
+    if node[0] == 'or':
+        if None in bounds:
+            return None
+        lows = [low for low, _ in bounds]
+        highs = [high for _, high in bounds]
+        return (None if None in lows else min(lows), None if None in highs else max(highs))
+
+    low = high = None
+    for bound in bounds:
+        if bound is None:
+            continue
+        if bound[0] is not None:
+            low = bound[0] if low is None else max(low, bound[0])
+        if bound[1] is not None:
+            high = bound[1] if high is None else min(high, bound[1])
+    return None if low is None and high is None else (low, high)
+
+
+class Filter:
+    """
+    A compiled filter expression, e.g.:
+
+        size > 1000 AND (username = "user1" OR folder contains "sent")
+
+    The whole expression is compiled into a single Python function over the
+    fields of a row, so every row is tested in one call, without walking the
+    expression tree. The structure of the expression is also analysed, so
+    indexes can narrow the candidate rows (usernames, numberMessages range)
+    before the predicate runs.
+    """
+    def __init__(self, expression=''):
+        self.expression = expression.strip()
+        if not self.expression:
+            self.fields = frozenset()
+            self.usernames = None
+            self.messages_bounds = None
+            self.match = lambda u, f, m, s: True
+            return
+
+        tree = _Parser(self.expression).parse()
+        self.fields = _fields(tree)
+        self.usernames = _usernames(tree)
+        self.messages_bounds = _messages_bounds(tree)
+        # Only integer and bytes literals produced by the parser end up in the source.
+        code = compile(f"lambda u, f, m, s: {_source(tree)}", '<filter>', 'eval')
+        self.match = eval(code, {'__builtins__': {}})
+
+    @property
+    def is_numeric(self):
+        """
+        True if the expression only looks at numberMessages and size.
+        """
+        return self.fields <= _NUMERIC_FIELDS
+
+
+@functools.lru_cache(maxsize=64)
+def compile_filter(expression):
+    """
+    Returns the compiled Filter of an expression, cached per process.
+
+    Raises:
+        FilterError: If the expression is invalid.
+    """
+    return Filter(expression)
+
+
+def parse_row(raw):
+    """
+    Splits a raw line into (username, folder, numberMessages, size), or None
+    if it cannot be parsed.
+    """
+    parts = raw.split()
+    try:
+        return parts[0], parts[1], int(parts[2]), int(parts[4])
+    except (ValueError, IndexError):
+        return None
+
+
+def filter_lines(lines, flt, limit=None):
+    """
+    Returns the parsed rows of raw lines matching a filter, up to `limit`.
+    """
+    rows = []
+    match = flt.match
+    for raw in lines:
+        row = parse_row(raw)
+        if row is not None and match(*row):
+            rows.append(row)
+            if limit is not None and len(rows) >= limit:
+                break
+    return rows
+
+
+def parse_fields(value):
+    """
+    Parses a comma-separated projection; empty means all the fields.
+
+    Raises:
+        FilterError: If a field is unknown.
+    """
+    fields = [field.strip() for field in (value or '').split(',') if field.strip()]
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise FilterError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or list(FIELDS)
+
+
+def parse_order(value):
+    """
+    Parses an order param: a field, prefixed with '-' for descending order.
+
+    Returns:
+        tuple: (field or None, descending)
+
+    Raises:
+        FilterError: If the field is unknown.
+    """
+    if not value:
+        return None, False
+    descending = value.startswith('-')
+    field = value.lstrip('-')
+    if field not in FIELDS:
+        raise FilterError(f"Unknown order field: {field}")
+    return field, descending
+
+
+def shape_rows(rows, fields, order=None, descending=False, limit=None):
+    """
+    Orders, limits and projects parsed rows.
+
+    With a limit, only the top rows are kept (heap selection) instead of
+    sorting all of them.
+
+    Returns:
+        list: One dict per row with the requested fields.
+    """
+    if order is not None:
+        position = FIELDS.index(order)
+        key = lambda row: row[position]  # noqa: E731
+        if limit is not None:
+            rows = (heapq.nlargest if descending else heapq.nsmallest)(limit, rows, key=key)
+        else:
+            rows = sorted(rows, key=key, reverse=descending)
+    elif limit is not None:
+        rows = rows[:limit]
+
+    positions = [FIELDS.index(field) for field in fields]
+    return [
+        {
+            FIELDS[position]: row[position].decode('utf-8', errors='replace') if position < 2 else row[position]
+            for position in positions
+        }
+        for row in rows
+    ]
@@ -0,0 +1,647 @@
+import atexit
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core.filters import filter_lines
+from core.models import FileIndex, FileIngestion, StoredFile
+from core.singleflight import file_version
+from core.sql_backend import ingest_file, is_enabled as ingestion_enabled
+
+
+INDEX_VERSION = 4
+
+PACKED_MAGIC = b'BAFHIDX1'
+
+# magic, version, source size, source mtime, source digest, rows, usernames,
+# max row, min row, username pool size, crc32 of the preceding header fields
+_PACKED_HEADER = struct.Struct('=8sqqq16sqqqqqI4x')
+
+_CRC_OFFSET = _PACKED_HEADER.size - 8
+
+# Number of integer columns of `rows` entries in the packed layout.
+_ROW_COLUMNS = 7
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_build_pool = None
+_build_pool_lock = threading.Lock()
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# File versions whose rebuild was looked at, with the (monotonic) time it was.
+_rebuilds = {}
+_rebuilds_lock = threading.Lock()
+
+# Index queries look at the clock once every this many rows.
+_DEADLINE_CHECK_ROWS = 4096
+
+
+class StaleIndexError(Exception):
+    """
+    Raised when the file was replaced after its index was checked.
+    """
+
+
+class DerivedIndex:
+    """
+    Per-file derived structures used to answer queries without rescanning the file.
+
+    Rows are the parseable lines of the source file, numbered in file order.
+    The index keeps, for every row, its byte offset, numberMessages and size,
+    the row permutations ordered by username and by numberMessages, and a
+    hash table from each username to its rows.
+    """
+    def __init__(self, source_size, source_mtime_ns, source_digest, offsets, messages, sizes,
+                 by_username, by_messages, max_row, min_row, username_rows, sorted_messages=None):
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime_ns
+        self.source_digest = source_digest
+        self.offsets = offsets
+        self.messages = messages
+        self.sizes = sizes
+        self.by_username = by_username
+        self.by_messages = by_messages
+        self.max_row = max_row
+        self.min_row = min_row
+        self.username_rows = username_rows
+        if sorted_messages is None:
+            sorted_messages = array('q', (messages[row] for row in by_messages))
+        self._sorted_messages = sorted_messages
+        self._sorted_by_username = None
+
+    @classmethod
+    def build(cls, file_path):
+        """
+        Builds the index by scanning the file once.
+
+        Args:
+            file_path (str): Path of the stored file.
+
+        Returns:
+            DerivedIndex: The index built for the file.
+        """
+        # Typed columns keep 8 bytes per value instead of a Python int each.
+        offsets, messages, sizes = array('q'), array('q'), array('q')
+        sort_keys = []
+        username_rows = {}
+        max_row, max_size = None, 0
+        min_row, min_size = None, 999999999999
+        digest = hashlib.blake2b(digest_size=16)
+
+        with open(file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            offset = 0
+            for raw in f:
+                digest.update(raw)
+                parts = raw.split()
+                try:
+                    number_messages, size = int(parts[2]), int(parts[4])
+                except (ValueError, IndexError):
+                    offset += len(raw)
+                    continue
+
+                row = len(offsets)
+                offsets.append(offset)
+                messages.append(number_messages)
+                sizes.append(size)
+                # Ties on the username are broken on the whole line, as in
+                # order-by-username.sh, so the descending order is exactly the
+                # reverse of this one. One bytes object orders like the
+                # (username, line) pair, at a fraction of its memory.
+                sort_keys.append(parts[0] + b'\0' + raw.rstrip(b'\n'))
+                username_rows.setdefault(parts[0].decode('utf-8', errors='replace'), []).append(row)
+
+                # Same tie-breaking as max-min-size.sh: the first row wins.
+                if size > max_size:
+                    max_row, max_size = row, size
+                if size < min_size:
+                    min_row, min_size = row, size
+
+                offset += len(raw)
+
+        by_username = array('q', sorted(range(len(offsets)), key=sort_keys.__getitem__))
+        del sort_keys
+        by_messages = array('q', sorted(range(len(offsets)), key=messages.__getitem__))
+
+        return cls(stat.st_size, stat.st_mtime_ns, digest.digest(), offsets, messages, sizes,
+                   by_username, by_messages, max_row, min_row, username_rows)
+
+    def save(self, index_path):
+        """
+        Writes the index sidecar atomically, so readers never see a partial file.
+
+        Returns:
+            int: Size of the written index, in bytes.
+        """
+        tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                self.write_packed(f)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return os.path.getsize(index_path)
+
+    def write_packed(self, f):
+        """
+        Writes the index in the packed binary layout read by `PackedIndex`:
+        a header tied to the source file (size, mtime and content digest) and
+        protected by a checksum, fixed-width integer columns (line offsets,
+        numberMessages, size and the sorted row permutations) and a sorted
+        username pool.
+        """
+        pool = sorted((username.encode('utf-8'), rows) for username, rows in self.username_rows.items())
+        name_offsets, row_starts, name_rows = [0], [0], []
+        for name, rows in pool:
+            name_offsets.append(name_offsets[-1] + len(name))
+            name_rows.extend(rows)
+            row_starts.append(len(name_rows))
+
+        header = _PACKED_HEADER.pack(
+            PACKED_MAGIC, INDEX_VERSION, self.source_size, self.source_mtime_ns, self.source_digest,
+            len(self.offsets), len(pool),
+            -1 if self.max_row is None else self.max_row, -1 if self.min_row is None else self.min_row,
+            name_offsets[-1], 0,
+        )[:_CRC_OFFSET]
+        f.write(header + struct.pack('=I4x', zlib.crc32(header)))
+        for column in (self.offsets, self.messages, self.sizes, self.by_username, self.by_messages,
+                       self._sorted_messages, name_offsets, row_starts, name_rows):
+            f.write(array('q', column).tobytes())
+        for name, _ in pool:
+            f.write(name)
+
+    def close(self):
+        """
+        Called when the index leaves the cache of the process.
+        """
+
+    def _username_rows(self, username):
+        return self.username_rows.get(username, ())
+
+    def is_fresh(self, file_path):
+        """
+        Returns True if the index still describes the current content of the file.
+        """
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return False
+        return stat.st_size == self.source_size and stat.st_mtime_ns == self.source_mtime_ns
+
+    def iter_raw_lines(self, file_path, rows, deadline=None):
+        """
+        Lazily reads the raw source lines of the given rows, in the given order.
+
+        Raises:
+            StaleIndexError: If the opened file is not the one the index describes.
+            DeadlineExceeded: If `deadline` passes before all the lines are read.
+        """
+        with open(file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size != self.source_size or stat.st_mtime_ns != self.source_mtime_ns:
+                raise StaleIndexError(file_path)
+            for row in _checked(rows, deadline):
+                f.seek(self.offsets[row])
+                yield f.readline()
+
+    def read_lines(self, file_path, rows, deadline=None):
+        """
+        Reads the source lines of the given rows, in the given order.
+
+        Raises:
+            StaleIndexError: If the opened file is not the one the index describes.
+            DeadlineExceeded: If `deadline` passes before all the lines are read.
+        """
+        return [raw.decode('utf-8', errors='replace').rstrip('\n')
+                for raw in self.iter_raw_lines(file_path, rows, deadline)]
+
+    def max_min(self, file_path, smallest=False):
+        """
+        Returns the line with the largest size, or the smallest if `smallest` is True.
+        """
+        row = self.min_row if smallest else self.max_row
+        if row is None:
+            return ''
+        return self.read_lines(file_path, [row])[0]
+
+    def extremes(self):
+        """
+        Returns the exact ((min, max) of numberMessages, (min, max) of size),
+        with None bounds when the file has no rows.
+        """
+        if self.max_row is None:
+            return (None, None), (None, None)
+        return ((self._sorted_messages[0], self._sorted_messages[-1]),
+                (self.sizes[self.min_row], self.sizes[self.max_row]))
+
+    def ordered_by_username(self, file_path, desc=False, deadline=None):
+        """
+        Returns the lines ordered by username (asc or desc).
+        """
+        rows = reversed(self.by_username) if desc else self.by_username
+        return self.read_lines(file_path, rows, deadline)
+
+    def iter_ordered_by_username(self, file_path, desc=False):
+        """
+        Lazily reads the raw lines ordered by username (asc or desc), for streaming.
+        """
+        rows = reversed(self.by_username) if desc else self.by_username
+        return self.iter_raw_lines(file_path, rows)
+
+    def between_msgs(self, file_path, low, high, deadline=None):
+        """
+        Returns, in file order, the lines whose numberMessages is between low and high.
+        """
+        start = bisect.bisect_left(self._sorted_messages, low)
+        end = bisect.bisect_right(self._sorted_messages, high)
+        return self.read_lines(file_path, sorted(self.by_messages[start:end]), deadline)
+
+    def filter_rows(self, file_path, flt, limit=None, deadline=None):
+        """
+        Returns the parsed rows matching a filter, in file order, up to `limit`.
+
+        Candidate rows are first narrowed with the username pool or the
+        numberMessages order when the filter allows it. Filters only on
+        numberMessages and size are evaluated on the columns, so only the
+        matching lines are read from the file.
+        """
+        if flt.usernames is not None:
+            rows = sorted(row for username in flt.usernames for row in self._username_rows(username))
+        elif flt.messages_bounds is not None:
+            low, high = flt.messages_bounds
+            start = 0 if low is None else bisect.bisect_left(self._sorted_messages, low)
+            end = len(self._sorted_messages) if high is None else bisect.bisect_right(self._sorted_messages, high)
+            rows = sorted(self.by_messages[start:end])
+        else:
+            rows = range(len(self.offsets))
+
+        if flt.is_numeric:
+            match, messages, sizes = flt.match, self.messages, self.sizes
+            rows = [row for row in _checked(rows, deadline) if match(None, None, messages[row], sizes[row])]
+            if limit is not None:
+                rows = rows[:limit]
+        return filter_lines(self.iter_raw_lines(file_path, rows, deadline), flt, limit)
+
+    def is_sorted_by_username(self):
+        """
+        Returns True if the rows are already in username order in the file.
+        """
+        if self._sorted_by_username is None:
+            self._sorted_by_username = all(row == i for i, row in enumerate(self.by_username))
+        return self._sorted_by_username
+
+    def lookup_usernames(self, file_path, usernames, deadline=None):
+        """
+        Returns the lines of each username (exact match), in file order.
+
+        Returns:
+            dict: Username to list of lines; usernames without rows map to an empty list.
+        """
+        owners = {row: username for username in set(usernames) for row in self._username_rows(username)}
+        rows = sorted(owners)
+        result = {username: [] for username in usernames}
+        for row, line in zip(rows, self.read_lines(file_path, rows, deadline)):
+            result[owners[row]].append(line)
+        return result
+
+
+def _checked(rows, deadline):
+    """
+    Iterates over rows, checking the deadline every _DEADLINE_CHECK_ROWS rows.
+    """
+    if deadline is None:
+        yield from rows
+        return
+    for i, row in enumerate(rows):
+        if i % _DEADLINE_CHECK_ROWS == 0:
+            deadline.check()
+        yield row
+
+
+class PackedIndex(DerivedIndex):
+    """
+    A DerivedIndex read in place from the packed binary layout.
+
+    Columns are views over the buffer, so nothing is copied into the
+    process: when the buffer is a mapped sidecar, every worker uses the same
+    pages of the page cache. Usernames are looked up by binary search in
+    the sorted pool.
+    """
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if len(view) < _PACKED_HEADER.size:
+            raise ValueError("Truncated packed index")
+        (magic, version, source_size, source_mtime_ns, source_digest, rows, usernames,
+         max_row, min_row, pool_size, crc) = _PACKED_HEADER.unpack_from(view)
+        if magic != PACKED_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"Unsupported packed index: {magic!r} version {version}")
+        if crc != zlib.crc32(view[:_CRC_OFFSET]):
+            raise ValueError("Corrupted packed index header")
+        if len(view) != _PACKED_HEADER.size + 8 * (_ROW_COLUMNS * rows + 2 * (usernames + 1)) + pool_size:
+            raise ValueError("Truncated packed index")
+
+        position = _PACKED_HEADER.size
+        columns = []
+        for length in (rows, rows, rows, rows, rows, rows, usernames + 1, usernames + 1, rows):
+            columns.append(view[position:position + 8 * length].cast('q'))
+            position += 8 * length
+        offsets, messages, sizes, by_username, by_messages, sorted_messages, \
+            self._name_offsets, self._row_starts, self._name_rows = columns
+        self._pool = view[position:position + pool_size]
+        self._usernames = usernames
+
+        super().__init__(source_size, source_mtime_ns, source_digest, offsets, messages, sizes, by_username, by_messages,
+                         None if max_row < 0 else max_row, None if min_row < 0 else min_row,
+                         None, sorted_messages)
+
+    def _name(self, i):
+        return self._pool[self._name_offsets[i]:self._name_offsets[i + 1]].tobytes()
+
+    def _username_rows(self, username):
+        name = username.encode('utf-8')
+        lo, hi = 0, self._usernames
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._usernames and self._name(lo) == name:
+            return self._name_rows[self._row_starts[lo]:self._row_starts[lo + 1]]
+        return ()
+
+
+def index_path_for(filename):
+    """
+    Returns the path where the index of a stored file is written.
+    """
+    return os.path.join(settings.INDEX_DIR, f"{filename}.idx")
+
+
+def load_index(index_path):
+    """
+    Maps an index sidecar read-only; no parsing is needed, so it loads in
+    constant time whatever the size of the file.
+
+    Raises:
+        OSError: If the sidecar cannot be read.
+        ValueError: If the sidecar is empty, corrupted or of another version.
+    """
+    with open(index_path, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError(f"Empty index: {index_path}")
+    return PackedIndex(buffer)
+
+
+def _schedule_rebuild(filename, file_path):
+    """
+    Schedules the build of a missing or stale index, at most once every
+    INDEX_BUILD_STALE_SECONDS per version of the file.
+
+    A build pending or running for less than INDEX_BUILD_STALE_SECONDS is
+    left alone. Older ones are scheduled again: their queue may have been
+    lost with a restarted or crashed process.
+    """
+    stale_seconds = settings.INDEX_BUILD_STALE_SECONDS
+    key = (filename, file_version(file_path))
+    now = time.monotonic()
+    with _rebuilds_lock:
+        checked_at = _rebuilds.get(key)
+        if checked_at is not None and now - checked_at < stale_seconds:
+            return
+        if len(_rebuilds) >= 1024:
+            _rebuilds.clear()
+        _rebuilds[key] = now
+
+    stored_file = (StoredFile.objects.alive().filter(filename=filename)
+                   .exclude(index__state__in=[FileIndex.PENDING, FileIndex.BUILDING],
+                            index__updated_at__gt=timezone.now() - timedelta(seconds=stale_seconds))
+                   .first())
+    if stored_file is not None:
+        schedule_index_build(stored_file)
+
+
+def get_ready_index(filename, file_path):
+    """
+    Returns the index of a file if it is built and fresh, or None so the
+    caller falls back to the scan path. A missing, unreadable or stale index
+    is rebuilt in the background.
+    """
+    index_path = index_path_for(filename)
+    try:
+        stat = os.stat(index_path)
+    except FileNotFoundError:
+        _schedule_rebuild(filename, file_path)
+        return None
+
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        cached = _cache.get(index_path)
+        if cached is not None and cached[0] == key:
+            _cache.move_to_end(index_path)
+            index = cached[1]
+        else:
+            index = None
+
+    if index is None:
+        try:
+            index = load_index(index_path)
+        except (OSError, ValueError):
+            _schedule_rebuild(filename, file_path)
+            return None
+        evicted = []
+        with _cache_lock:
+            previous = _cache.get(index_path)
+            if previous is not None:
+                evicted.append(previous[1])
+            _cache[index_path] = (key, index)
+            while len(_cache) > settings.INDEX_CACHE_SIZE:
+                evicted.append(_cache.popitem(last=False)[1][1])
+        for old in evicted:
+            old.close()
+
+    if not index.is_fresh(file_path):
+        _schedule_rebuild(filename, file_path)
+        return None
+    return index
+
+
+def discard_index(filename):
+    """
+    Removes the index of a file from disk and from the cache of the process.
+    """
+    index_path = index_path_for(filename)
+    with _cache_lock:
+        cached = _cache.pop(index_path, None)
+    if cached is not None:
+        cached[1].close()
+
+    try:
+        os.remove(index_path)
+    except FileNotFoundError:
+        pass
+
+
+def query_index(filename, file_path, query, deadline=None):
+    """
+    Runs `query(index)` against the ready index of a file. Queries reading
+    many rows take the deadline too, and stop once it passes.
+
+    Returns:
+        The query result, or None when there is no usable index and the
+        caller must fall back to the scan path.
+
+    Raises:
+        DeadlineExceeded: If `deadline` passes before the query starts or while it runs.
+    """
+    index = get_ready_index(filename, file_path)
+    if index is None:
+        return None
+    if deadline is not None:
+        deadline.check()
+    try:
+        return query(index)
+    except StaleIndexError:
+        return None
+
+
+def _build_sidecar(file_path, index_path):
+    return DerivedIndex.build(file_path).save(index_path)
+
+
+def _get_build_pool():
+    global _build_pool
+    with _build_pool_lock:
+        if _build_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            import django
+
+            # Each build runs in a fresh process, so the memory of the
+            # build goes back to the system when it ends.
+            _build_pool = ProcessPoolExecutor(max_workers=settings.INDEX_BUILD_WORKERS,
+                                              mp_context=multiprocessing.get_context('spawn'),
+                                              initializer=django.setup, max_tasks_per_child=1)
+            atexit.register(_build_pool.shutdown)
+        return _build_pool
+
+
+def build_index(stored_file_id):
+    """
+    Builds and stores the index of a file, recording the build state.
+    Runs in the background workers, but can also be called directly.
+
+    Files of INDEX_BUILD_PROCESS_THRESHOLD bytes or more are parsed in a
+    separate process, so the build neither holds the GIL of the worker
+    serving requests nor grows its memory.
+    """
+    close_old_connections()
+    try:
+        try:
+            stored_file = StoredFile.objects.alive().get(pk=stored_file_id)
+        except StoredFile.DoesNotExist:
+            return
+
+        file_index, _ = FileIndex.objects.get_or_create(stored_file=stored_file)
+        file_index.state = FileIndex.BUILDING
+        file_index.error = ''
+        file_index.save(update_fields=['state', 'error', 'updated_at'])
+
+        start = time.monotonic()
+        try:
+            file_path = os.path.join(settings.UPLOAD_DIR, stored_file.filename)
+            index_path = index_path_for(stored_file.filename)
+            if os.path.getsize(file_path) >= settings.INDEX_BUILD_PROCESS_THRESHOLD:
+                size = _get_build_pool().submit(_build_sidecar, file_path, index_path).result()
+            else:
+                size = _build_sidecar(file_path, index_path)
+        except Exception as e:
+            file_index.state = FileIndex.FAILED
+            file_index.error = str(e)
+            file_index.save(update_fields=['state', 'error', 'updated_at'])
+            return
+
+        file_index.state = FileIndex.READY
+        file_index.built_at = timezone.now()
+        file_index.build_seconds = time.monotonic() - start
+        file_index.size = size
+        file_index.save(update_fields=['state', 'built_at', 'build_seconds', 'size', 'updated_at'])
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.INDEX_BUILD_WORKERS,
+                                           thread_name_prefix='index-build')
+        return _executor
+
+
+def _mark_pending(model, stored_file_ids):
+    existing = set(model.objects.filter(stored_file_id__in=stored_file_ids)
+                   .values_list('stored_file_id', flat=True))
+    if existing:
+        model.objects.filter(stored_file_id__in=existing).update(
+            state=model.PENDING, error='', updated_at=timezone.now())
+    model.objects.bulk_create([model(stored_file_id=pk) for pk in stored_file_ids if pk not in existing])
+
+
+def schedule_index_builds(stored_files):
+    """
+    Marks the index of each file as pending and enqueues their builds once the
+    current transaction commits, so uploads are acknowledged without waiting.
+    When the PostgreSQL ingestion backend is enabled, the load of the file
+    rows is enqueued too.
+
+    The status rows of all the files are written with a constant number of
+    queries, whatever the number of files.
+    """
+    stored_file_ids = [stored_file.pk for stored_file in stored_files]
+    if not stored_file_ids:
+        return
+
+    _mark_pending(FileIndex, stored_file_ids)
+    ingest = ingestion_enabled()
+    if ingest:
+        _mark_pending(FileIngestion, stored_file_ids)
+
+    def submit():
+        executor = _get_executor()
+        for pk in stored_file_ids:
+            executor.submit(build_index, pk)
+            if ingest:
+                executor.submit(ingest_file, pk)
+
+    transaction.on_commit(submit)
+
+
+def schedule_index_build(stored_file):
+    """
+    Schedules the index build of a single file (see `schedule_index_builds`).
+    """
+    schedule_index_builds([stored_file])
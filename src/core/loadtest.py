@@ -0,0 +1,357 @@
+import http.client
+import json
+import os
+import random
+import socket
+import string
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+
+from core.models import StoredFile
+from core.retention import purge_file_data
+
+
+ENDPOINTS = ('upload-file', 'list-files', 'max-min-size', 'order-by-username', 'between-msgs')
+
+DEFAULT_MIX = 'upload-file=1,list-files=4,max-min-size=4,order-by-username=2,between-msgs=4'
+
+
+def parse_mix(spec):
+    """
+    Parses a traffic mix such as "list-files=4,max-min-size=2".
+
+    Returns:
+        dict: Endpoint name to relative weight.
+
+    Raises:
+        ValueError: If an endpoint is unknown or a weight is not a positive number.
+    """
+    mix = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in traffic mix: {name}")
+        weight = float(weight) if weight else 1.0
+        if weight <= 0:
+            raise ValueError(f"Weight must be positive: {item}")
+        mix[name] = weight
+    if not mix:
+        raise ValueError("Traffic mix is empty")
+    return mix
+
+
+def generate_mailbox_lines(count, rng):
+    """
+    Generates lines in the format of the stored files:
+    "username folder numberMessages size SIZE", zero-padded like the real reports.
+    """
+    for _ in range(count):
+        name = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10)))
+        yield f"{name}@uol.com.br inbox {rng.randint(0, 20000000):09d} size {rng.randint(0, 20000000):09d}\n"
+
+
+def percentile(sorted_values, p):
+    """
+    Returns the p-th percentile (nearest rank) of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(int(-(-p * len(sorted_values) // 100)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def read_rss(pid):
+    """
+    Returns the resident set size of a process, in bytes, or None if unknown.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class DevServer:
+    """
+    Starts `manage.py runserver` on a free local port for the duration of a load test.
+    """
+    def __init__(self, host='127.0.0.1', port=None):
+        self.host = host
+        self.port = port or self._free_port()
+        self.process = None
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, 'manage.py', 'runserver', '--noreload', '--skip-checks', f'{self.host}:{self.port}'],
+            cwd=settings.BASE_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("runserver exited during startup")
+            try:
+                with socket.create_connection((self.host, self.port), timeout=0.5):
+                    return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError("runserver did not start in time")
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class LoadTest:
+    """
+    Replays a weighted traffic mix against a running API and collects
+    per-endpoint latencies, status codes and the server memory usage.
+    """
+    def __init__(self, base_url, mix, concurrency=8, duration=30.0, requests=None,
+                 files=2, lines=10000, server_pid=None, seed=0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/') + '/api'
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self.files = files
+        self.lines = lines
+        self.server_pid = server_pid
+        self.seed = seed
+
+        self._lock = threading.Lock()
+        self._latencies = {name: [] for name in mix}
+        self._errors = {name: 0 for name in mix}
+        self._issued = 0
+        self._rss_samples = []
+
+    def _filenames(self):
+        return [f"loadtest-{i}.txt" for i in range(self.files)]
+
+    def _payload(self, rng):
+        return ''.join(generate_mailbox_lines(self.lines, rng)).encode()
+
+    def _request(self, connection, method, path, params, body=None):
+        url = f"{self.prefix}/{path}/?{urlencode(params)}"
+        start = time.perf_counter()
+        connection.request(method, url, body=body, headers={'Content-Type': 'application/octet-stream'})
+        response = connection.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+
+    def _build_request(self, name, rng):
+        filename = rng.choice(self._filenames())
+        if name == 'upload-file':
+            return 'PUT', 'upload-file/upload-file', {'filename': filename}, self._payload(rng)
+        if name == 'list-files':
+            return 'GET', 'list-files', {}, None
+        if name == 'max-min-size':
+            params = {'filename': filename}
+            if rng.random() < 0.5:
+                params['min'] = '1'
+            return 'GET', 'max-min-size', params, None
+        if name == 'order-by-username':
+            params = {'filename': filename}
+            if rng.random() < 0.5:
+                params['desc'] = '1'
+            return 'GET', 'order-by-username', params, None
+        low = rng.randint(0, 10000000)
+        return 'GET', 'between-msgs', {'filename': filename, 'low': low, 'high': low + 1000000}, None
+
+    def _next_slot(self, deadline):
+        with self._lock:
+            if self.requests is not None:
+                if self._issued >= self.requests:
+                    return False
+            elif time.monotonic() >= deadline:
+                return False
+            self._issued += 1
+            return True
+
+    def _worker(self, worker_id, deadline):
+        rng = random.Random(self.seed + worker_id)
+        names, weights = list(self.mix), list(self.mix.values())
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        try:
+            while self._next_slot(deadline):
+                name = rng.choices(names, weights)[0]
+                method, path, params, body = self._build_request(name, rng)
+                try:
+                    status_code, elapsed = self._request(connection, method, path, params, body)
+                    failed = status_code >= 400
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = http.client.HTTPConnection(self.host, self.port, timeout=300)
+                    status_code, elapsed, failed = None, None, True
+                with self._lock:
+                    if failed:
+                        self._errors[name] += 1
+                    else:
+                        self._latencies[name].append(elapsed)
+        finally:
+            connection.close()
+
+    def _sample_rss(self, stop):
+        while not stop.wait(0.5):
+            rss = read_rss(self.server_pid)
+            if rss is not None:
+                self._rss_samples.append(rss)
+
+    def setup(self):
+        """
+        Uploads the generated files used by the query endpoints.
+        """
+        rng = random.Random(self.seed)
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        try:
+            for filename in self._filenames():
+                status_code, _ = self._request(connection, 'PUT', 'upload-file/upload-file',
+                                               {'filename': filename}, self._payload(rng))
+                if status_code not in (201, 204):
+                    raise RuntimeError(f"Upload of {filename} failed with status {status_code}")
+        finally:
+            connection.close()
+
+    def teardown(self):
+        """
+        Removes the generated files, their rows and everything derived from them.
+
+        Works on the upload directory and the database of the current settings,
+        so it only cleans up after a server sharing them, once it has stopped.
+        """
+        stored_files = StoredFile.objects.filter(filename__in=self._filenames())
+        stored_files.delete()
+        for stored_file in stored_files:
+            purge_file_data(stored_file)
+        stored_files.hard_delete()
+
+    def run(self):
+        """
+        Runs the load test.
+
+        Returns:
+            dict: The report (see `build_report`).
+        """
+        self.setup()
+
+        stop = threading.Event()
+        sampler = None
+        if self.server_pid:
+            sampler = threading.Thread(target=self._sample_rss, args=(stop,), daemon=True)
+            sampler.start()
+
+        start = time.monotonic()
+        deadline = start + self.duration
+        threads = [threading.Thread(target=self._worker, args=(i, deadline)) for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        stop.set()
+        if sampler is not None:
+            sampler.join()
+        return self.build_report(elapsed)
+
+    def build_report(self, elapsed):
+        """
+        Summarizes the collected samples.
+
+        Returns:
+            dict: Totals plus, per endpoint, the request count, throughput,
+            error rate and p50/p95/p99 latencies in milliseconds.
+        """
+        endpoints = {}
+        total_requests = total_errors = 0
+        for name in self.mix:
+            latencies = sorted(self._latencies[name])
+            errors = self._errors[name]
+            count = len(latencies) + errors
+            total_requests += count
+            total_errors += errors
+            endpoints[name] = {
+                'requests': count,
+                'throughput': count / elapsed if elapsed else 0.0,
+                'error_rate': errors / count if count else 0.0,
+                'p50_ms': _ms(percentile(latencies, 50)),
+                'p95_ms': _ms(percentile(latencies, 95)),
+                'p99_ms': _ms(percentile(latencies, 99)),
+            }
+
+        return {
+            'duration_seconds': elapsed,
+            'requests': total_requests,
+            'throughput': total_requests / elapsed if elapsed else 0.0,
+            'error_rate': total_errors / total_requests if total_requests else 0.0,
+            'server_rss_peak_bytes': max(self._rss_samples) if self._rss_samples else None,
+            'server_rss_last_bytes': self._rss_samples[-1] if self._rss_samples else None,
+            'endpoints': endpoints,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def format_report(report):
+    """
+    Formats a report as a human-readable table.
+    """
+    lines = [
+        f"{'endpoint':<20}{'requests':>10}{'req/s':>10}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for name, stats in report['endpoints'].items():
+        lines.append(
+            f"{name:<20}{stats['requests']:>10}{stats['throughput']:>10.1f}{stats['error_rate']:>9.1%}"
+            f"{_fmt(stats['p50_ms']):>10}{_fmt(stats['p95_ms']):>10}{_fmt(stats['p99_ms']):>10}"
+        )
+    lines.append(
+        f"total: {report['requests']} requests in {report['duration_seconds']:.1f}s "
+        f"({report['throughput']:.1f} req/s, {report['error_rate']:.1%} errors)"
+    )
+    if report['server_rss_peak_bytes'] is not None:
+        lines.append(f"server RSS: peak {report['server_rss_peak_bytes'] / 2 ** 20:.1f} MiB, "
+                     f"last {report['server_rss_last_bytes'] / 2 ** 20:.1f} MiB")
+    return '\n'.join(lines)
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:.1f}"
+
+
+def dump_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return os.path.abspath(path)
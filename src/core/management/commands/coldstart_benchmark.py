@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.coldstart import measure_cold_start
+
+
+class Command(BaseCommand):
+    """
+    Measures the time to first successful list-files response of a fresh worker.
+    """
+    help = "Measures worker cold start and checks it against COLD_START_BUDGET_SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help="Number of fresh workers to measure")
+
+    def handle(self, *args, **options):
+        timings = []
+        for _ in range(options['runs']):
+            result = measure_cold_start()
+            if result['status'] != 200:
+                raise CommandError(f"list-files answered {result['status']}")
+            timings.append(result['seconds'])
+
+        best = min(timings)
+        self.stdout.write(
+            f"cold start: best {best:.3f}s, worst {max(timings):.3f}s "
+            f"(budget {settings.COLD_START_BUDGET_SECONDS:.3f}s)"
+        )
+        if best > settings.COLD_START_BUDGET_SECONDS:
+            raise CommandError("Cold start budget exceeded")
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.retention import collect_deleted_files
+
+
+class Command(BaseCommand):
+    """
+    Purges soft-deleted files and their derived data once the grace period is over.
+    """
+    help = "Removes files deleted for longer than DELETED_FILES_GRACE_SECONDS, with their indexes and rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-seconds', type=float, default=settings.DELETED_FILES_GRACE_SECONDS,
+                            help="Minimum time since the deletion, in seconds")
+        parser.add_argument('--batch-size', type=int, default=settings.DELETED_FILES_GC_BATCH_SIZE,
+                            help="Number of files purged per transaction")
+
+    def handle(self, *args, **options):
+        collected = collect_deleted_files(options['grace_seconds'], options['batch_size'])
+        self.stdout.write(f"{collected} deleted files collected")
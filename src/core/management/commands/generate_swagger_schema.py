@@ -0,0 +1,24 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from django_project.schema import generate_spec
+
+
+class Command(BaseCommand):
+    """
+    Precomputes the OpenAPI document, so workers never generate it at runtime.
+    """
+    help = "Writes the OpenAPI document to SWAGGER_SCHEMA_FILE."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.SWAGGER_SCHEMA_FILE, help="Destination file")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        tmp_path = f"{output}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(generate_spec())
+        os.replace(tmp_path, output)
+        self.stdout.write(self.style.SUCCESS(f"OpenAPI document written to {output}"))
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loadtest import DEFAULT_MIX, DevServer, LoadTest, dump_report, format_report, parse_mix
+
+
+class Command(BaseCommand):
+    """
+    Load-tests the API with a configurable traffic mix over generated files.
+    """
+    help = "Replays a traffic mix against the API and reports throughput, latency percentiles and errors."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server. A local runserver is started if omitted.")
+        parser.add_argument('--server-pid', type=int, help="PID of the server at --url, to sample its RSS")
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Weighted endpoints (default: {DEFAULT_MIX})")
+        parser.add_argument('--concurrency', type=int, default=8, help="Number of concurrent clients")
+        parser.add_argument('--duration', type=float, default=30.0, help="Duration of the test, in seconds")
+        parser.add_argument('--requests', type=int, help="Total number of requests (overrides --duration)")
+        parser.add_argument('--files', type=int, default=2, help="Number of generated files")
+        parser.add_argument('--lines', type=int, default=10000, help="Lines per generated file")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the traffic and the files")
+        parser.add_argument('--keep-files', action='store_true',
+                            help="Keep the generated files after a test against the local runserver")
+        parser.add_argument('--json', dest='json_path', help="Also write the report as JSON to this path")
+        parser.add_argument('--max-p99-ms', type=float, help="Fail if any endpoint p99 latency exceeds this value")
+        parser.add_argument('--max-error-rate', type=float, help="Fail if the overall error rate exceeds this value")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        def load_test_for(base_url, server_pid):
+            return LoadTest(
+                base_url, mix,
+                concurrency=options['concurrency'],
+                duration=options['duration'],
+                requests=options['requests'],
+                files=options['files'],
+                lines=options['lines'],
+                server_pid=server_pid,
+                seed=options['seed'],
+            )
+
+        if options['url']:
+            report = load_test_for(options['url'], options['server_pid']).run()
+        else:
+            load_test = None
+            try:
+                with DevServer() as server:
+                    load_test = load_test_for(server.url, server.process.pid)
+                    report = load_test.run()
+            finally:
+                # The local runserver shares these settings, so its files are
+                # removed here once it has stopped.
+                if load_test is not None and not options['keep_files']:
+                    load_test.teardown()
+
+        self.stdout.write(format_report(report))
+        if options['json_path']:
+            self.stdout.write(f"report written to {dump_report(report, options['json_path'])}")
+
+        failures = []
+        if options['max_error_rate'] is not None and report['error_rate'] > options['max_error_rate']:
+            failures.append(f"error rate {report['error_rate']:.2%} above {options['max_error_rate']:.2%}")
+        if options['max_p99_ms'] is not None:
+            for name, stats in report['endpoints'].items():
+                if stats['p99_ms'] is not None and stats['p99_ms'] > options['max_p99_ms']:
+                    failures.append(f"{name} p99 {stats['p99_ms']:.1f} ms above {options['max_p99_ms']:.1f} ms")
+        if failures:
+            raise CommandError("; ".join(failures))
@@ -0,0 +1,64 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Rows of every ingested file, partitioned by file. The table only exists on
+# PostgreSQL; it is read and written with raw SQL by core.sql_backend. The
+# whole line breaks the ties between rows of the same username, as in
+# order-by-username.sh.
+CREATE_MAILBOX_ROWS = """
+CREATE TABLE IF NOT EXISTS core_mailboxrow (
+    stored_file_id bigint NOT NULL,
+    line_no bigint NOT NULL,
+    username text NOT NULL,
+    folder text NOT NULL,
+    number_messages bigint NOT NULL,
+    size bigint NOT NULL,
+    line text NOT NULL
+) PARTITION BY LIST (stored_file_id);
+CREATE INDEX IF NOT EXISTS core_mailboxrow_username_idx ON core_mailboxrow (stored_file_id, username COLLATE "C", line COLLATE "C");
+CREATE INDEX IF NOT EXISTS core_mailboxrow_size_idx ON core_mailboxrow (stored_file_id, size, line_no);
+CREATE INDEX IF NOT EXISTS core_mailboxrow_messages_idx ON core_mailboxrow (stored_file_id, number_messages, line_no);
+"""
+
+DROP_MAILBOX_ROWS = "DROP TABLE IF EXISTS core_mailboxrow CASCADE;"
+
+
+def create_mailbox_rows(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_MAILBOX_ROWS)
+
+
+def drop_mailbox_rows(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_MAILBOX_ROWS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_fileindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileIngestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('loading', 'Loading'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('source_size', models.BigIntegerField(blank=True, null=True)),
+                ('source_mtime_ns', models.BigIntegerField(blank=True, null=True)),
+                ('rows', models.BigIntegerField(blank=True, null=True)),
+                ('ingested_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('stored_file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion', to='core.storedfile')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(create_mailbox_rows, drop_mailbox_rows),
+    ]
@@ -1,2 +1,2 @@
-from core.models.models import StoredFile
+from core.models.models import StoredFile, FileIndex, FileIngestion
 from core.models.models_base import SoftDeleteQuerySet, BaseModel
\ No newline at end of file
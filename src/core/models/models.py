@@ -15,3 +15,71 @@ class StoredFile(BaseModel):
 
     def __str__(self):
         return self.filename
+
+
+class FileIndex(BaseModel):
+    """
+    Model to track the background index build of a stored file.
+    Fields:
+        stored_file: File the index belongs to.
+        state: Build state (pending, building, ready or failed).
+        built_at: Date/time the last successful build finished.
+        build_seconds: Duration of the last build, in seconds.
+        size: Size of the index on disk, in bytes.
+        error: Error message of the last failed build.
+    """
+    PENDING = 'pending'
+    BUILDING = 'building'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATE_CHOICES = (
+        (PENDING, 'Pending'),
+        (BUILDING, 'Building'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
+
+    stored_file = models.OneToOneField(StoredFile, on_delete=models.CASCADE, related_name='index')
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=PENDING)
+    built_at = models.DateTimeField(null=True, blank=True)
+    build_seconds = models.FloatField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"{self.stored_file.filename} ({self.state})"
+
+
+class FileIngestion(BaseModel):
+    """
+    Model to track the bulk load of a stored file into the mailbox rows table.
+    Fields:
+        stored_file: File the rows belong to.
+        state: Ingestion state (pending, loading, ready or failed).
+        source_size: Size of the file when it was loaded, in bytes.
+        source_mtime_ns: Modification time of the file when it was loaded.
+        rows: Number of rows loaded.
+        ingested_at: Date/time the last successful load finished.
+        error: Error message of the last failed load.
+    """
+    PENDING = 'pending'
+    LOADING = 'loading'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATE_CHOICES = (
+        (PENDING, 'Pending'),
+        (LOADING, 'Loading'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
+
+    stored_file = models.OneToOneField(StoredFile, on_delete=models.CASCADE, related_name='ingestion')
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=PENDING)
+    source_size = models.BigIntegerField(null=True, blank=True)
+    source_mtime_ns = models.BigIntegerField(null=True, blank=True)
+    rows = models.BigIntegerField(null=True, blank=True)
+    ingested_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"{self.stored_file.filename} ({self.state})"
@@ -0,0 +1,342 @@
+import atexit
+import os
+import re
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+
+from core.deadlines import DeadlineExceeded
+from core.filters import compile_filter, filter_lines, parse_row
+from core.singleflight import coalesced, file_version
+from core.sketches import FileSummary
+
+
+_NUMBER_RE = re.compile(rb'^[+-]?\d+')
+
+# Scans look at the clock once every this many lines.
+_DEADLINE_CHECK_LINES = 4096
+
+# Extra time given to the scan workers to notice an expired deadline.
+_DEADLINE_GRACE_SECONDS = 1.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _awk_number(fields, position):
+    """
+    Converts a field the way awk does with `$N+0`: the leading integer, or 0.
+    """
+    if len(fields) <= position:
+        return 0
+    match = _NUMBER_RE.match(fields[position])
+    return int(match.group()) if match else 0
+
+
+class _RangeReader:
+    """
+    Iterates over the lines starting inside the byte range [start, end).
+
+    With a deadline (`expires_at`, a time.time() timestamp), the iteration
+    stops early once it passes, and `resume_at` tells where to resume.
+    """
+    def __init__(self, file_path, start, end, expires_at=None):
+        self.file_path = file_path
+        self.start = start
+        self.end = end
+        self.expires_at = expires_at
+        self.resume_at = None
+
+    def __iter__(self):
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.start)
+            offset = self.start
+            for count, raw in enumerate(f):
+                if offset >= self.end:
+                    break
+                if (self.expires_at is not None and count % _DEADLINE_CHECK_LINES == 0
+                        and time.time() >= self.expires_at):
+                    self.resume_at = offset
+                    break
+                yield raw
+                offset += len(raw)
+
+
+def _scan_max_min(file_path, start, end, smallest, expires_at=None):
+    best_size = 999999999999 if smallest else 0
+    best_line = None
+    reader = _RangeReader(file_path, start, end, expires_at)
+    for raw in reader:
+        size = _awk_number(raw.split(), 4)
+        if (size < best_size) if smallest else (size > best_size):
+            best_size, best_line = size, raw
+    return (best_size, best_line), reader.resume_at
+
+
+def _scan_between_msgs(file_path, start, end, low, high, expires_at=None):
+    reader = _RangeReader(file_path, start, end, expires_at)
+    return [raw for raw in reader if low <= _awk_number(raw.split(), 2) <= high], reader.resume_at
+
+
+def _scan_usernames(file_path, start, end, usernames, expires_at=None):
+    matches = []
+    reader = _RangeReader(file_path, start, end, expires_at)
+    for raw in reader:
+        # Only the parseable lines, which are the rows of the index.
+        row = parse_row(raw)
+        if row is not None and row[0] in usernames:
+            matches.append(raw)
+    return matches, reader.resume_at
+
+
+def _scan_filter(file_path, start, end, expression, limit, expires_at=None):
+    # The expression is compiled again in the worker, since compiled filters cannot be pickled.
+    reader = _RangeReader(file_path, start, end, expires_at)
+    return filter_lines(reader, compile_filter(expression), limit), reader.resume_at
+
+
+def _scan_summary(file_path, start, end, relative_accuracy, expires_at=None):
+    summary = FileSummary(relative_accuracy)
+    reader = _RangeReader(file_path, start, end, expires_at)
+    for raw in reader:
+        summary.add_line(raw)
+    return summary, reader.resume_at
+
+
+def _decode(raw):
+    return raw.decode('utf-8', errors='replace').rstrip('\r\n')
+
+
+def split_ranges(file_path, parts, start=0):
+    """
+    Splits a file, from byte `start` (a line start) to its end, into at most
+    `parts` byte ranges aligned on line boundaries.
+
+    Returns:
+        list: A list of (start, end) tuples covering the file from `start`, in file order.
+    """
+    size = os.path.getsize(file_path)
+    boundaries = [start]
+    with open(file_path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(max(start + (size - start) * i // parts, boundaries[-1]))
+            f.readline()
+            position = min(f.tell(), size)
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def should_scan_in_parallel(file_path):
+    """
+    Returns True if the file is large enough for a chunk-parallel scan to pay off.
+    """
+    if settings.PARALLEL_SCAN_WORKERS < 2:
+        return False
+    try:
+        return os.path.getsize(file_path) >= settings.PARALLEL_SCAN_THRESHOLD
+    except OSError:
+        return False
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Imported with the first scan, off the startup path of the workers.
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Spawned workers only need this module, not the Django process state.
+            _pool = ProcessPoolExecutor(max_workers=settings.PARALLEL_SCAN_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            # Shut down before the modules imported late are torn down at exit.
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def _map_ranges(func, file_path, *args, start=0, expires_at=None):
+    """
+    Runs a chunk scan over the ranges of the file in the worker processes.
+
+    Returns:
+        list: The (result, resume_at) pair of every range, in file order.
+
+    Raises:
+        DeadlineExceeded: If the workers do not report back in time.
+    """
+    ranges = split_ranges(file_path, settings.PARALLEL_SCAN_WORKERS * settings.PARALLEL_SCAN_CHUNKS_PER_WORKER,
+                          start)
+    pool = _get_pool()
+    futures = [pool.submit(func, file_path, range_start, end, *args, expires_at) for range_start, end in ranges]
+    try:
+        if expires_at is None:
+            return [future.result() for future in futures]
+        # Workers stop on their own once the deadline passes; the grace period
+        # only covers a range stuck on I/O.
+        return [future.result(timeout=max(expires_at - time.time(), 0) + _DEADLINE_GRACE_SECONDS)
+                for future in futures]
+    except FutureTimeoutError:
+        raise DeadlineExceeded(file_path)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _scan(func, file_path, *args, deadline=None, start=0):
+    """
+    Runs a chunk scan from byte `start` to the end of the file, in parallel on
+    large files, and keeps the results in file order up to the first range
+    cut short by the deadline.
+
+    Returns:
+        tuple: (list of range results, offset where to resume or None if complete)
+    """
+    expires_at = deadline.expires_at if deadline is not None else None
+    if should_scan_in_parallel(file_path):
+        chunks = _map_ranges(func, file_path, *args, start=start, expires_at=expires_at)
+    else:
+        chunks = [func(file_path, start, os.path.getsize(file_path), *args, expires_at)]
+
+    results = []
+    for result, resume_at in chunks:
+        results.append(result)
+        if resume_at is not None:
+            return results, resume_at
+    return results, None
+
+
+def parallel_max_min(file_path, smallest=False, deadline=None):
+    """
+    Chunk-parallel equivalent of max-min-size.sh.
+
+    Returns:
+        str: The line with the largest size (or smallest, if `smallest` is True),
+        or an empty string if there is none.
+
+    Raises:
+        DeadlineExceeded: If the scan does not finish before `deadline`.
+    """
+    key = ('parallel_max_min', file_path, file_version(file_path), smallest)
+    return _coalesced(key, lambda: _parallel_max_min(file_path, smallest, deadline), file_path, deadline)
+
+
+def _parallel_max_min(file_path, smallest, deadline):
+    expires_at = deadline.expires_at if deadline is not None else None
+    best_size = 999999999999 if smallest else 0
+    best_line = None
+    # Partials are reduced in file order with strict comparisons, so the first
+    # matching line wins exactly like in the sequential awk scan.
+    for (size, line), resume_at in _map_ranges(_scan_max_min, file_path, smallest, expires_at=expires_at):
+        if resume_at is not None:
+            raise DeadlineExceeded(file_path)
+        if line is not None and ((size < best_size) if smallest else (size > best_size)):
+            best_size, best_line = size, line
+    return _decode(best_line) if best_line is not None else ''
+
+
+def parallel_between_msgs(file_path, low, high, deadline=None):
+    """
+    Chunk-parallel equivalent of between-msgs.sh.
+
+    Returns:
+        list: The matching lines, in file order.
+
+    Raises:
+        DeadlineExceeded: If the scan does not finish before `deadline`.
+    """
+    key = ('parallel_between_msgs', file_path, file_version(file_path), low, high)
+
+    def run():
+        lines, resume_at = scan_between_msgs(file_path, low, high, deadline)
+        if resume_at is not None:
+            raise DeadlineExceeded(file_path)
+        return lines
+
+    return _coalesced(key, run, file_path, deadline)
+
+
+def _coalesced(key, func, file_path, deadline):
+    """
+    Coalesces identical scans. A caller waits for another one until its own
+    deadline, and runs the scan again if the deadline of the other one passed.
+    """
+    try:
+        return coalesced(key, func, timeout=deadline.remaining() if deadline is not None else None,
+                         private_errors=(DeadlineExceeded,))
+    except TimeoutError:
+        raise DeadlineExceeded(file_path)
+
+
+def scan_between_msgs(file_path, low, high, deadline=None, start=0):
+    """
+    Scan-path equivalent of between-msgs.sh from byte `start`, parallel on large
+    files, returning what was found so far when the deadline passes.
+
+    Returns:
+        tuple: (matching lines in file order, offset where to resume or None if complete)
+    """
+    chunks, resume_at = _scan(_scan_between_msgs, file_path, low, high, deadline=deadline, start=start)
+    return [_decode(raw) for lines in chunks for raw in lines], resume_at
+
+
+def scan_usernames(file_path, usernames, deadline=None, start=0):
+    """
+    Scan-path equivalent of `DerivedIndex.lookup_usernames` from byte `start`,
+    parallel on large files, returning what was found so far when the deadline passes.
+
+    Returns:
+        tuple: (dict of username to list of lines in file order,
+        offset where to resume or None if complete)
+    """
+    wanted = {username.encode(): username for username in usernames}
+    chunks, resume_at = _scan(_scan_usernames, file_path, frozenset(wanted), deadline=deadline, start=start)
+
+    result = {username: [] for username in usernames}
+    for lines in chunks:
+        for raw in lines:
+            # Keyed by the raw field that matched: decoding can change how the line splits.
+            result[wanted[raw.split(None, 1)[0]]].append(_decode(raw))
+    return result, resume_at
+
+
+def scan_filter(file_path, flt, limit=None, deadline=None):
+    """
+    Evaluates a filter over a whole file in a single pass, parallel on large
+    files. Without order, a `limit` stops each range as soon as it is reached.
+
+    Returns:
+        list: The parsed rows matching the filter, in file order, up to `limit`.
+
+    Raises:
+        DeadlineExceeded: If the scan does not finish before `deadline`.
+    """
+    chunks, resume_at = _scan(_scan_filter, file_path, flt.expression, limit, deadline=deadline)
+    if resume_at is not None:
+        raise DeadlineExceeded(file_path)
+    rows = [row for chunk in chunks for row in chunk]
+    return rows if limit is None else rows[:limit]
+
+
+def summarize_file(file_path, relative_accuracy, deadline=None):
+    """
+    Summarizes the numberMessages and size columns of a file in one pass,
+    parallel on large files; the chunk summaries are merged.
+
+    Returns:
+        FileSummary: The summary of the whole file.
+
+    Raises:
+        DeadlineExceeded: If the scan does not finish before `deadline`.
+    """
+    chunks, resume_at = _scan(_scan_summary, file_path, relative_accuracy, deadline=deadline)
+    if resume_at is not None:
+        raise DeadlineExceeded(file_path)
+    summary = FileSummary(relative_accuracy)
+    for chunk in chunks:
+        summary.merge(chunk)
+    return summary
@@ -0,0 +1,333 @@
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+
+PROFILE_HEADER = 'X-Memory-Profile'
+PROFILE_ID_HEADER = 'X-Memory-Profile-Id'
+
+# tracemalloc traces the whole process, so one request is profiled at a time.
+_profile_lock = threading.Lock()
+_local = threading.local()
+_report_ids = itertools.count(1)
+
+# tracemalloc is imported with the first profiled request, off the startup path.
+tracemalloc = None
+_trace_filters = None
+
+
+def _load_tracemalloc():
+    global tracemalloc, _trace_filters
+    if tracemalloc is None:
+        import tracemalloc as module
+
+        _trace_filters = (
+            module.Filter(False, module.__file__),
+            module.Filter(False, '<frozen importlib._bootstrap>'),
+            module.Filter(False, '<frozen importlib._bootstrap_external>'),
+            module.Filter(False, __file__),
+        )
+        tracemalloc = module
+
+
+class _Phase:
+    def __init__(self, name):
+        self.name = name
+        self.peak = 0
+        self.start_current = 0
+        self.start_snapshot = None
+
+
+class MemoryProfile:
+    """
+    Measures the memory of one request, phase by phase.
+
+    For every phase, it records the peak of traced memory above the memory
+    allocated when the phase started, the net memory it left allocated, and
+    the source lines that allocated the most during the phase (difference of
+    two tracemalloc snapshots). Phases can be nested: the peak of a nested
+    phase also counts in the peak of the enclosing ones.
+    """
+    def __init__(self, request):
+        self.method = request.method
+        self.path = request.path
+        self.started_at = time.time()
+        self.phases = []
+        self._stack = []
+        self._top = settings.MEMORY_PROFILE_TOP
+
+    @contextmanager
+    def phase(self, name):
+        self.start_phase(name)
+        try:
+            yield
+        finally:
+            self.end_phase()
+
+    def start_phase(self, name):
+        if self._stack:
+            # reset_peak is global: keeps the peak reached so far by the enclosing phase.
+            outer = self._stack[-1]
+            outer.peak = max(outer.peak, tracemalloc.get_traced_memory()[1])
+        phase = _Phase('.'.join([p.name for p in self._stack] + [name]))
+        phase.start_snapshot = tracemalloc.take_snapshot().filter_traces(_trace_filters)
+        tracemalloc.reset_peak()
+        phase.start_current = tracemalloc.get_traced_memory()[0]
+        self._stack.append(phase)
+
+    def end_phase(self):
+        current, peak = tracemalloc.get_traced_memory()
+        phase = self._stack.pop()
+        phase.peak = max(phase.peak, peak)
+        snapshot = tracemalloc.take_snapshot().filter_traces(_trace_filters)
+        top = [
+            {
+                "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+            }
+            for stat in snapshot.compare_to(phase.start_snapshot, 'lineno')[:self._top]
+            if stat.size_diff > 0
+        ]
+        self.phases.append({
+            "phase": phase.name,
+            "peak_bytes": max(phase.peak - phase.start_current, 0),
+            "net_bytes": current - phase.start_current,
+            "top": top,
+        })
+        if self._stack:
+            outer = self._stack[-1]
+            outer.peak = max(outer.peak, phase.peak)
+            tracemalloc.reset_peak()
+
+    def report(self, status_code):
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": status_code,
+            "started_at": self.started_at,
+            "duration_seconds": time.time() - self.started_at,
+            "peak_bytes": max((phase["peak_bytes"] for phase in self.phases), default=0),
+            "phases": self.phases,
+        }
+
+
+def profile_phase(name):
+    """
+    Returns a context manager measuring a phase of the request being
+    profiled in this thread, or doing nothing when it is not profiled.
+    """
+    profile = getattr(_local, 'profile', None)
+    return profile.phase(name) if profile is not None else nullcontext()
+
+
+def _should_profile(request):
+    if settings.MEMORY_PROFILE_ALLOW_HEADER and request.headers.get(PROFILE_HEADER):
+        return True
+    rate = settings.MEMORY_PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def save_report(report):
+    """
+    Writes a report to MEMORY_PROFILE_DIR, keeping the newest MEMORY_PROFILE_MAX_REPORTS.
+
+    Returns:
+        str: The id of the report.
+    """
+    report_id = f"{int(report['started_at'] * 1000)}-{os.getpid()}-{next(_report_ids)}"
+    report["id"] = report_id
+
+    directory = settings.MEMORY_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{report_id}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f)
+    os.replace(tmp_path, path)
+
+    reports = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    for name in reports[:max(len(reports) - settings.MEMORY_PROFILE_MAX_REPORTS, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    return report_id
+
+
+def load_reports(path=None):
+    """
+    Returns the saved reports, newest first, optionally only those of a request path.
+    """
+    directory = settings.MEMORY_PROFILE_DIR
+    try:
+        names = sorted((name for name in os.listdir(directory) if name.endswith('.json')), reverse=True)
+    except FileNotFoundError:
+        return []
+    reports = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name), 'r') as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if path is None or report.get("path") == path:
+            reports.append(report)
+    return reports
+
+
+def summarize_reports(reports, top=None):
+    """
+    Aggregates reports per request path: number of reports, peak memory
+    (max and mean), the report with the highest peak, the peak of every
+    phase and the allocation sites that allocated the most over all reports.
+    """
+    top = settings.MEMORY_PROFILE_TOP if top is None else top
+    paths = {}
+    for report in reports:
+        entry = paths.setdefault(report["path"], {"reports": 0, "peaks": [], "worst": None, "phases": {}, "sites": {}})
+        entry["reports"] += 1
+        entry["peaks"].append(report["peak_bytes"])
+        if entry["worst"] is None or report["peak_bytes"] > entry["worst"]["peak_bytes"]:
+            entry["worst"] = {"id": report["id"], "peak_bytes": report["peak_bytes"]}
+        for phase in report["phases"]:
+            entry["phases"][phase["phase"]] = max(entry["phases"].get(phase["phase"], 0), phase["peak_bytes"])
+            if '.' in phase["phase"]:
+                # Allocations of nested phases are already counted in the enclosing one.
+                continue
+            for site in phase["top"]:
+                entry["sites"][site["site"]] = entry["sites"].get(site["site"], 0) + site["size_diff"]
+
+    return [
+        {
+            "path": path,
+            "reports": entry["reports"],
+            "max_peak_bytes": max(entry["peaks"]),
+            "mean_peak_bytes": round(sum(entry["peaks"]) / len(entry["peaks"])),
+            "worst": entry["worst"],
+            "phase_peak_bytes": entry["phases"],
+            "top_sites": [
+                {"site": site, "size_diff": size}
+                for site, size in sorted(entry["sites"].items(), key=lambda item: -item[1])[:top]
+            ],
+        }
+        for path, entry in sorted(paths.items())
+    ]
+
+
+class MemoryProfilingMiddleware:
+    """
+    Profiles the memory of sampled requests with tracemalloc.
+
+    A request is profiled when it is sampled (MEMORY_PROFILE_SAMPLE_RATE) or
+    sent with an X-Memory-Profile header (if MEMORY_PROFILE_ALLOW_HEADER).
+    Its handling is split into phases: "request" (middlewares before the
+    view), "view", "render" (response rendering) and "stream" (streamed
+    content); views can mark nested phases with `profile_phase`. The report
+    is written to MEMORY_PROFILE_DIR and its id returned in the
+    X-Memory-Profile-Id header.
+
+    Tracing slows the request down, and only one request is profiled at a
+    time per process. Allocations of the other threads are traced too, so
+    reports are the most precise with one request thread per process.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _should_profile(request) or not _profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        _load_tracemalloc()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(settings.MEMORY_PROFILE_FRAMES)
+        profile = _local.profile = MemoryProfile(request)
+        streaming = False
+        try:
+            profile.start_phase('request')
+            response = self.get_response(request)
+            profile.end_phase()
+
+            if isinstance(response, StreamingHttpResponse):
+                # The content is produced after the middlewares return, so
+                # the profile is completed when the stream ends.
+                response.streaming_content = _ProfiledStream(profile, response, started_tracing)
+                streaming = True
+            else:
+                response[PROFILE_ID_HEADER] = save_report(profile.report(response.status_code))
+            return response
+        finally:
+            if streaming:
+                _local.profile = None
+            else:
+                _finish(started_tracing)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None:
+            profile.end_phase()
+            profile.start_phase('view')
+
+    def process_template_response(self, request, response):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None and profile._stack and profile._stack[-1].name == 'view':
+            # DRF responses are rendered right after this hook.
+            profile.end_phase()
+            profile.start_phase('render')
+        return response
+
+
+class _ProfiledStream:
+    """
+    Streamed content measured as the "stream" phase of a profile. The
+    profile is released when the stream is closed, even if never iterated.
+    """
+    def __init__(self, profile, response, started_tracing):
+        self.profile = profile
+        self.status_code = response.status_code
+        self.started_tracing = started_tracing
+        self._content = response.streaming_content
+        self._started = False
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        if not self._started:
+            self._started = True
+            _local.profile = self.profile
+            self.profile.start_phase('stream')
+        try:
+            return next(self._content)
+        except StopIteration:
+            self.profile.end_phase()
+            save_report(self.profile.report(self.status_code))
+            self.close()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        close = getattr(self._content, 'close', None)
+        if close is not None:
+            close()
+        _finish(self.started_tracing)
+
+
+def _finish(started_tracing):
+    _local.profile = None
+    if started_tracing:
+        tracemalloc.stop()
+    _profile_lock.release()
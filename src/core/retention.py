@@ -0,0 +1,177 @@
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core import sql_backend
+from core.indexing import discard_index
+from core.models import StoredFile
+
+
+logger = logging.getLogger(__name__)
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+class AliveFiles:
+    """
+    Cached registry of the names of the alive (not deleted) stored files,
+    used by the query views instead of querying the database on every
+    request.
+
+    The names are reloaded with one query once they are older than
+    ALIVE_FILES_TTL_SECONDS, or when a stored file is saved or deleted in
+    this process. A name missing from the cache is looked up in the
+    database, so files uploaded through other worker processes are found at
+    once; deletions made elsewhere are seen within the TTL.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = None
+        self._loaded_at = 0.0
+
+    def _current(self):
+        with self._lock:
+            if self._names is not None and time.monotonic() - self._loaded_at < settings.ALIVE_FILES_TTL_SECONDS:
+                return self._names
+        names = set(StoredFile.objects.alive().values_list('filename', flat=True))
+        with self._lock:
+            self._names, self._loaded_at = names, time.monotonic()
+        return names
+
+    def is_alive(self, filename):
+        """
+        Returns True if a stored file of this name exists and is not deleted.
+        """
+        if filename in self._current():
+            return True
+        if not StoredFile.objects.alive().filter(filename=filename).exists():
+            return False
+        with self._lock:
+            if self._names is not None:
+                self._names.add(filename)
+        return True
+
+    def invalidate(self):
+        with self._lock:
+            self._names = None
+
+
+alive_files = AliveFiles()
+
+
+@receiver(post_save, sender=StoredFile)
+@receiver(post_delete, sender=StoredFile)
+def _stored_file_changed(sender, **kwargs):
+    alive_files.invalidate()
+
+
+def resolve_file(filename):
+    """
+    Returns the path of an alive stored file, or None if there is no such file.
+
+    The upload directory is not checked: views answer 404 when opening the
+    file raises FileNotFoundError.
+    """
+    start_collector()
+    if not alive_files.is_alive(filename):
+        return None
+    return os.path.join(settings.UPLOAD_DIR, filename)
+
+
+def purge_file_data(stored_file):
+    """
+    Removes the content of a deleted file and everything derived from it:
+    index sidecar, cached and shared indexes and ingested rows.
+    """
+    file_path = os.path.join(settings.UPLOAD_DIR, stored_file.filename)
+    try:
+        # A file written after the deletion belongs to a new upload of the
+        # same name, which keeps its content and its index.
+        reuploaded = os.stat(file_path).st_mtime > stored_file.deleted_at.timestamp()
+        if not reuploaded:
+            os.remove(file_path)
+    except FileNotFoundError:
+        reuploaded = False
+
+    if not reuploaded:
+        discard_index(stored_file.filename)
+    if sql_backend.is_enabled():
+        sql_backend.drop_file(stored_file.pk)
+
+
+def collect_deleted_files(grace_seconds=None, batch_size=None):
+    """
+    Purges the files soft-deleted for longer than the grace period, then
+    hard-deletes their rows, one batch (and one transaction) at a time.
+
+    Rows are locked while they are purged, and rows locked by another
+    collector are skipped, so several processes can collect at once.
+
+    Args:
+        grace_seconds (float, optional): Defaults to DELETED_FILES_GRACE_SECONDS.
+        batch_size (int, optional): Defaults to DELETED_FILES_GC_BATCH_SIZE.
+
+    Returns:
+        int: Number of files collected.
+    """
+    if grace_seconds is None:
+        grace_seconds = settings.DELETED_FILES_GRACE_SECONDS
+    if batch_size is None:
+        batch_size = settings.DELETED_FILES_GC_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+
+    collected = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                StoredFile.objects.dead().filter(deleted_at__lte=cutoff, pk__gt=last_pk)
+                .order_by('pk').select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not batch:
+                break
+            for stored_file in batch:
+                purge_file_data(stored_file)
+            StoredFile.objects.filter(pk__in=[stored_file.pk for stored_file in batch]).hard_delete()
+        last_pk = batch[-1].pk
+        collected += len(batch)
+    return collected
+
+
+def _run_collector(interval):
+    while True:
+        time.sleep(interval)
+        close_old_connections()
+        try:
+            collected = collect_deleted_files()
+            if collected:
+                logger.info("Collected %d deleted files", collected)
+        except Exception:
+            logger.exception("Collection of deleted files failed")
+        finally:
+            close_old_connections()
+
+
+def start_collector():
+    """
+    Starts the periodic collection of deleted files in this process, once,
+    unless DELETED_FILES_GC_INTERVAL_SECONDS is 0.
+    """
+    global _collector
+    interval = settings.DELETED_FILES_GC_INTERVAL_SECONDS
+    if interval <= 0:
+        return
+    with _collector_lock:
+        if _collector is None:
+            _collector = threading.Thread(target=_run_collector, args=(interval,),
+                                          name='deleted-files-gc', daemon=True)
+            _collector.start()
@@ -0,0 +1,72 @@
+import threading
+
+
+# Swagger annotations of the views are recorded without importing drf_yasg,
+# which is only loaded with the first documentation request (see
+# django_project.schema). They are turned into drf_yasg annotations then.
+IN_QUERY = 'query'
+IN_HEADER = 'header'
+TYPE_STRING = 'string'
+TYPE_INTEGER = 'integer'
+TYPE_NUMBER = 'number'
+TYPE_ARRAY = 'array'
+
+_lock = threading.Lock()
+_annotated = []
+
+
+class _Deferred:
+    """
+    A drf_yasg.openapi object, built when the annotations are applied.
+    """
+    def __init__(self, name, args, kwargs):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+
+    def build(self):
+        from drf_yasg import openapi
+
+        return getattr(openapi, self.name)(*_resolve(self.args), **_resolve(self.kwargs))
+
+
+def Parameter(*args, **kwargs):
+    return _Deferred('Parameter', args, kwargs)
+
+
+def Items(*args, **kwargs):
+    return _Deferred('Items', args, kwargs)
+
+
+def _resolve(value):
+    if isinstance(value, _Deferred):
+        return value.build()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_resolve(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _resolve(item) for key, item in value.items()}
+    return value
+
+
+def swagger_auto_schema(**kwargs):
+    """
+    Records the arguments of `drf_yasg.utils.swagger_auto_schema` for a view
+    method; they are applied by `apply_annotations`.
+    """
+    def decorator(view_method):
+        _annotated.append((view_method, kwargs))
+        return view_method
+    return decorator
+
+
+def apply_annotations():
+    """
+    Applies the recorded annotations with drf_yasg. Called before a schema is
+    generated; only the first call does something.
+    """
+    from drf_yasg.utils import swagger_auto_schema as apply
+
+    with _lock:
+        while _annotated:
+            view_method, kwargs = _annotated.pop(0)
+            apply(**_resolve(kwargs))(view_method)
@@ -1,14 +1,27 @@
 import os
+import signal
 import subprocess
 
+from core.coprocess import get_pool
+from core.singleflight import coalesced, file_version
 
-def run_script(script_name, args):
+
+def run_script(script_name, args, timeout=None):
     """
     Executes a bash script with the provided arguments.
+
+    Identical concurrent calls (same script, same arguments and same version
+    of the input file) are coalesced: only one process runs and every caller
+    gets its output. A caller waits for it at most `timeout` seconds, and the
+    callers still in time run the script again if it timed out for another one.
+
+    When SCRIPT_COPROCESS_POOL_SIZE is set, the script runs in a resident
+    worker instead of a freshly started bash process.
     
     Args:
         script_name (str): The name of the script to execute.
         args (list): A list of arguments to pass to the script.
+        timeout (float, optional): Seconds after which the script is killed.
 
     Returns:
         tuple: A tuple containing:
@@ -17,6 +30,7 @@ def run_script(script_name, args):
 
     Raises:
         FileNotFoundError: If the script does not exist in the specified path.
+        subprocess.TimeoutExpired: If the script does not finish within `timeout`.
     """
     base_dir = os.getenv("SCRIPTS_DIR", os.path.join(os.path.dirname(__file__), '..', 'scripts'))
     script_path = os.path.join(base_dir, script_name)
@@ -24,12 +38,39 @@ def run_script(script_name, args):
     if not os.path.exists(script_path):
         raise FileNotFoundError(f"Script not found: {script_path}")
 
-    result = subprocess.run([script_path] + args, capture_output=True, text=True)
+    key = ('run_script', script_name, tuple(args), file_version(args[0]) if args else None)
+    try:
+        return coalesced(key, lambda: _execute(base_dir, script_name, args, timeout),
+                         timeout=timeout, private_errors=(subprocess.TimeoutExpired,))
+    except TimeoutError:
+        raise subprocess.TimeoutExpired(script_name, timeout)
+
 
-    if result.returncode != 0:
-        return None, result.stderr
+def _execute(base_dir, script_name, args, timeout):
+    pool = get_pool(os.path.abspath(base_dir))
+    if pool is not None:
+        returncode, stdout, stderr = pool.run(script_name, args, timeout=timeout)
+    else:
+        returncode, stdout, stderr = _spawn(os.path.join(base_dir, script_name), args, timeout)
 
-    return result.stdout.strip(), None
+    if returncode != 0:
+        return None, stderr
+
+    return stdout.strip(), None
+
+
+def _spawn(script_path, args, timeout):
+    # The script runs in its own session so that, on timeout, the awk/sort
+    # children are killed together with bash.
+    process = subprocess.Popen([script_path] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, start_new_session=True)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.communicate()
+        raise
+    return process.returncode, stdout, stderr
 
 
 def parse_line_to_dict(line):
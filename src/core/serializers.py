@@ -1,7 +1,7 @@
 from dateutil import parser
 from rest_framework import serializers
 
-from core.models import StoredFile
+from core.models import StoredFile, FileIndex
 
 
 class StoredFileSerializer(serializers.ModelSerializer):
@@ -31,3 +31,11 @@ class UserDataSerializer(serializers.Serializer):
     folder = serializers.CharField()
     numberMessages = serializers.IntegerField()
     size = serializers.IntegerField(min_value=0)
+
+
+class FileIndexSerializer(serializers.ModelSerializer):
+    filename = serializers.CharField(source='stored_file.filename')
+
+    class Meta:
+        model = FileIndex
+        fields = ['filename', 'state', 'built_at', 'build_seconds', 'size', 'error']
@@ -0,0 +1,264 @@
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+# Waiting marks older than this are left by crashed processes.
+_WAITER_EXPIRY_SECONDS = 3600
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share the same key: while one call is in
+    flight, identical calls wait for it and share its result (or exception).
+
+    Errors that only concern the caller which got them (its own timeout or
+    deadline) are not shared: the waiting callers run the call again instead.
+
+    When SINGLE_FLIGHT_LOCK_DIR is set, the leader of each process also takes
+    an exclusive file lock per key, so identical calls in other worker
+    processes wait for it too and read its result instead of recomputing it.
+    The result is only written, as JSON, when another process waits for it,
+    and is removed with the lock once nobody waits any more.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, timeout=None, private_errors=()):
+        """
+        Runs `func` unless an identical call is already in flight.
+
+        Args:
+            key (hashable): Identifies identical calls.
+            func (callable): Computes the result; called without arguments.
+            timeout (float, optional): Seconds this caller waits for another one.
+            private_errors (tuple, optional): Exception types that are not shared
+                with the waiting callers, which run `func` again instead.
+
+        Returns:
+            The result of `func`, possibly computed by another caller.
+
+        Raises:
+            TimeoutError: If the result of another caller is not ready within `timeout`.
+        """
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+
+            if not call.event.wait(_remaining(expires_at)):
+                raise TimeoutError(f"Timed out waiting for {key!r}")
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, private_errors):
+                raise call.error
+
+        try:
+            lock_dir = settings.SINGLE_FLIGHT_LOCK_DIR
+            call.result = self._do_shared(lock_dir, key, func, expires_at) if lock_dir else func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _do_shared(self, lock_dir, key, func, expires_at):
+        base = os.path.join(lock_dir, hashlib.sha256(repr(key).encode()).hexdigest())
+        result_path = f"{base}.result"
+        # Tells the leader of another process that someone waits for its result.
+        waiter_path = f"{base}.{os.getpid()}-{threading.get_ident()}.wait"
+        waiting_since = time.time()
+
+        os.makedirs(lock_dir, mode=0o700, exist_ok=True)
+        open(waiter_path, 'w').close()
+        try:
+            with _file_lock(f"{base}.lock", base, expires_at, key):
+                _remove(waiter_path)
+                # A result written while we were waiting comes from a call that
+                # was in flight when we arrived, so it can be shared.
+                try:
+                    if os.stat(result_path).st_mtime >= waiting_since:
+                        with open(result_path, 'r') as f:
+                            return json.load(f)
+                except (OSError, ValueError):
+                    pass
+
+                result = func()
+                if _waiters(base):
+                    _write_result(result_path, result)
+                return result
+        finally:
+            _remove(waiter_path)
+
+
+def _remaining(expires_at):
+    return max(expires_at - time.monotonic(), 0.0) if expires_at is not None else None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _waiters(base):
+    """
+    Returns True if a caller of another process waits for the key of `base`.
+    Marks left by crashed processes are removed after a while.
+    """
+    waiting = False
+    for path in glob.glob(f"{glob.escape(base)}.*.wait"):
+        try:
+            if os.stat(path).st_mtime < time.time() - _WAITER_EXPIRY_SECONDS:
+                _remove(path)
+            else:
+                waiting = True
+        except FileNotFoundError:
+            pass
+    return waiting
+
+
+class _ResultTooLarge(Exception):
+    pass
+
+
+class _BoundedWriter:
+    """
+    A file writer failing once more than `limit` characters were written.
+    """
+    def __init__(self, f, limit):
+        self.f = f
+        self.remaining = limit
+
+    def write(self, chunk):
+        self.remaining -= len(chunk)
+        if self.remaining < 0:
+            raise _ResultTooLarge()
+        self.f.write(chunk)
+
+
+def _min_size(result):
+    """
+    Returns a lower bound of the size of the JSON of a result, without encoding it.
+    """
+    if isinstance(result, str):
+        return len(result)
+    if isinstance(result, (list, tuple)):
+        return sum(_min_size(item) for item in result)
+    return 0
+
+
+def _write_result(result_path, result):
+    """
+    Writes a result as JSON, unless it is larger than SINGLE_FLIGHT_MAX_SHARED_BYTES.
+    The JSON is streamed to the file, so the result is not copied in memory.
+    """
+    limit = settings.SINGLE_FLIGHT_MAX_SHARED_BYTES
+    if _min_size(result) > limit:
+        return
+    tmp_path = f"{result_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'w', encoding='ascii') as f:
+            # ensure_ascii: one character per byte.
+            json.dump(result, _BoundedWriter(f, limit))
+    except (TypeError, ValueError, _ResultTooLarge):
+        _remove(tmp_path)
+        return
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    os.replace(tmp_path, result_path)
+
+
+@contextmanager
+def _file_lock(lock_path, base, expires_at, key):
+    """
+    Holds the exclusive lock of a key. The last holder, when nobody waits
+    any more, removes the lock and the shared result.
+    """
+    while True:
+        lock_file = open(lock_path, 'a')
+        try:
+            _flock(lock_file, expires_at, key)
+            try:
+                locked = os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino
+            except FileNotFoundError:
+                locked = False
+            if locked:
+                break
+            # The lock file was removed by the previous holder.
+            lock_file.close()
+        except BaseException:
+            lock_file.close()
+            raise
+
+    try:
+        yield
+    finally:
+        if not _waiters(base):
+            _remove(f"{base}.result")
+            _remove(lock_path)
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _flock(lock_file, expires_at, key):
+    if expires_at is None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            remaining = _remaining(expires_at)
+            if not remaining:
+                raise TimeoutError(f"Timed out waiting for {key!r}")
+            time.sleep(min(remaining, 0.01))
+
+
+_single_flight = SingleFlight()
+
+
+def file_version(file_path):
+    """
+    Returns a value that changes whenever the file is replaced or modified,
+    so results computed for an older content are never shared.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def coalesced(key, func, timeout=None, private_errors=()):
+    """
+    Runs `func` through the process-wide SingleFlight instance (see `SingleFlight.do`).
+    """
+    return _single_flight.do(key, func, timeout, private_errors)
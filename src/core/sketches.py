@@ -0,0 +1,243 @@
+import math
+import os
+import random
+import time
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy (DDSketch).
+
+    Values are counted in logarithmic buckets of ratio gamma = (1 + a) / (1 - a),
+    so any quantile is answered within a relative error `a` of the true value,
+    using memory that grows with the log of the value range, not with the
+    number of values. Sketches built with the same accuracy merge by adding
+    their bucket counts, so chunks and files can be summarized separately.
+    """
+    def __init__(self, relative_accuracy=0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def merge(self, other):
+        """
+        Adds the values of another sketch of the same accuracy.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches of different accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None or value < self.min else self.min
+                self.max = value if self.max is None or value > self.max else self.max
+
+    def quantile(self, q):
+        """
+        Returns the estimated q-quantile (0 <= q <= 1), or None if the sketch is empty.
+        """
+        if not self.count:
+            return None
+        # The extremes are tracked exactly.
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return min(max(0, self.min), self.max)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+class Histogram:
+    """
+    Mergeable histogram of non-negative integers in power-of-two buckets:
+    [0, 1), [1, 2), [2, 4), [4, 8), ...
+    """
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, value, count=1):
+        bucket = max(value, 0).bit_length()
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def as_list(self, scale=1.0):
+        """
+        Returns the buckets from the lowest to the highest non-empty one, each
+        with its bounds and count (multiplied by `scale` for sampled data).
+        """
+        if not self.counts:
+            return []
+        return [
+            {
+                "low": 0 if bucket == 0 else 2 ** (bucket - 1),
+                "high": 2 ** bucket,
+                "count": round(self.counts.get(bucket, 0) * scale),
+            }
+            for bucket in range(min(self.counts), max(self.counts) + 1)
+        ]
+
+
+class ColumnSummary:
+    """
+    Count, sum, min, max, quantile sketch and histogram of a numeric column.
+    """
+    def __init__(self, relative_accuracy):
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.histogram = Histogram()
+        self.total = 0
+
+    def add(self, value):
+        self.sketch.add(value)
+        self.histogram.add(value)
+        self.total += value
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        self.histogram.merge(other.histogram)
+        self.total += other.total
+
+    def set_extremes(self, ranges):
+        """
+        Replaces the min and max with exact ones, from the (min, max) of every
+        summarized file (e.g. when the values were sampled).
+        """
+        self.sketch.min = min((low for low, _ in ranges if low is not None), default=None)
+        self.sketch.max = max((high for _, high in ranges if high is not None), default=None)
+
+    def as_dict(self, quantiles, scale=1.0):
+        count = self.sketch.count
+        return {
+            "min": self.sketch.min,
+            "max": self.sketch.max,
+            "mean": self.total / count if count else None,
+            "quantiles": {_quantile_name(q): _round(self.sketch.quantile(q)) for q in quantiles},
+            "histogram": self.histogram.as_list(scale),
+        }
+
+
+class FileSummary:
+    """
+    Statistical summary of the numberMessages and size columns of stored files.
+    Summaries of chunks or files built with the same accuracy can be merged.
+    """
+    def __init__(self, relative_accuracy):
+        self.relative_accuracy = relative_accuracy
+        self.rows = 0
+        self.messages = ColumnSummary(relative_accuracy)
+        self.sizes = ColumnSummary(relative_accuracy)
+
+    def add_line(self, raw):
+        """
+        Adds a raw line; lines that cannot be parsed are ignored.
+
+        Returns:
+            bool: True if the line was parsed.
+        """
+        parts = raw.split()
+        try:
+            number_messages, size = int(parts[2]), int(parts[4])
+        except (ValueError, IndexError):
+            return False
+        self.rows += 1
+        self.messages.add(number_messages)
+        self.sizes.add(size)
+        return True
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.messages.merge(other.messages)
+        self.sizes.merge(other.sizes)
+        return self
+
+    def as_dict(self, quantiles, scale=1.0):
+        return {
+            "rows": round(self.rows * scale),
+            "numberMessages": self.messages.as_dict(quantiles, scale),
+            "size": self.sizes.as_dict(quantiles, scale),
+        }
+
+
+def _quantile_name(q):
+    return f"p{q * 100:g}"
+
+
+def _round(value):
+    return None if value is None else round(value)
+
+
+def rank_error(samples, confidence):
+    """
+    Bound on the rank error of quantiles estimated from `samples` uniform
+    samples, holding with probability `confidence` for every quantile at
+    once (Dvoretzky-Kiefer-Wolfowitz inequality).
+    """
+    if not samples:
+        return 1.0
+    return min(math.sqrt(math.log(2 / (1 - confidence)) / (2 * samples)), 1.0)
+
+
+def sample_file(file_path, summary, budget_seconds, max_samples, rng=None):
+    """
+    Adds random lines of a file to `summary` until the time budget or the
+    sample count runs out.
+
+    Lines are picked by seeking to a random byte and taking the next line,
+    which is uniform when lines have similar lengths, as in the mailbox reports.
+
+    Returns:
+        tuple: (lines sampled, bytes of the sampled lines)
+    """
+    rng = rng or random.Random()
+    file_size = os.path.getsize(file_path)
+    samples = sampled_bytes = 0
+    if not file_size:
+        return samples, sampled_bytes
+
+    expires_at = time.monotonic() + budget_seconds
+    with open(file_path, 'rb') as f:
+        while samples < max_samples and time.monotonic() < expires_at:
+            offset = rng.randrange(file_size)
+            if offset:
+                # Skips to the first line starting at or after the offset.
+                f.seek(offset - 1)
+                f.readline()
+            else:
+                f.seek(0)
+            raw = f.readline()
+            if not raw:
+                f.seek(0)
+                raw = f.readline()
+            samples += 1
+            sampled_bytes += len(raw)
+            summary.add_line(raw)
+    return samples, sampled_bytes
@@ -0,0 +1,258 @@
+import os
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from core.deadlines import DeadlineExceeded
+from core.models import FileIngestion, StoredFile
+
+
+_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+_COLUMNS = 'username, folder, number_messages, size'
+
+# SQLSTATE of a statement cancelled by statement_timeout.
+_QUERY_CANCELED = '57014'
+
+
+def is_enabled():
+    """
+    Returns True if uploaded rows are ingested into PostgreSQL.
+    """
+    return settings.INGESTION_BACKEND == 'postgres' and connection.vendor == 'postgresql'
+
+
+class CopySource:
+    """
+    File-like object feeding `COPY ... FROM STDIN` from a stored file.
+
+    It converts lines to tab-separated rows on demand, so memory stays bounded
+    by the size of the chunks requested by the driver, whatever the file size.
+    """
+    def __init__(self, f, stored_file_id):
+        self.f = f
+        self.prefix = f"{stored_file_id}\t"
+        self.line_no = 0
+        self.rows = 0
+        self._buffer = b''
+
+    def _next_row(self):
+        for raw in self.f:
+            self.line_no += 1
+            parts = raw.split()
+            try:
+                number_messages, size = int(parts[2]), int(parts[4])
+            except (ValueError, IndexError):
+                continue
+            self.rows += 1
+            username = parts[0].decode('utf-8', errors='replace').translate(_ESCAPES)
+            folder = parts[1].decode('utf-8', errors='replace').translate(_ESCAPES)
+            line = raw.rstrip(b'\n').decode('utf-8', errors='replace').translate(_ESCAPES)
+            return f"{self.prefix}{self.line_no}\t{username}\t{folder}\t{number_messages}\t{size}\t{line}\n".encode()
+        return b''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size is None or size < 0 or length < size:
+            row = self._next_row()
+            if not row:
+                break
+            chunks.append(row)
+            length += len(row)
+        data = b''.join(chunks)
+        if size is None or size < 0:
+            self._buffer = b''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def _partition(stored_file_id):
+    return f"core_mailboxrow_{int(stored_file_id)}"
+
+
+def load_file(stored_file):
+    """
+    Bulk-loads the rows of a stored file with COPY into its own partition.
+
+    The rows go into a standalone table first, which is then swapped in for
+    the previous partition of the file within one transaction, so queries
+    never see a partially loaded file.
+
+    Returns:
+        tuple: (rows loaded, os.stat_result of the loaded file)
+    """
+    partition = _partition(stored_file.pk)
+    staging = f"{partition}_load"
+    file_path = os.path.join(settings.UPLOAD_DIR, stored_file.filename)
+
+    with open(file_path, 'rb') as f, transaction.atomic(), connection.cursor() as cursor:
+        stat = os.fstat(f.fileno())
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(f"CREATE TABLE {staging} (LIKE core_mailboxrow INCLUDING DEFAULTS)")
+        source = CopySource(f, stored_file.pk)
+        cursor.copy_expert(
+            f"COPY {staging} (stored_file_id, line_no, {_COLUMNS}, line) FROM STDIN",
+            source,
+            size=settings.INGESTION_COPY_CHUNK_BYTES,
+        )
+        # The check constraint lets ATTACH PARTITION skip its validation scan.
+        cursor.execute(
+            f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_file CHECK (stored_file_id = %s)",
+            [stored_file.pk],
+        )
+        cursor.execute(f"DROP TABLE IF EXISTS {partition}")
+        cursor.execute(f"ALTER TABLE {staging} RENAME TO {partition}")
+        cursor.execute(f"ALTER TABLE core_mailboxrow ATTACH PARTITION {partition} FOR VALUES IN ({int(stored_file.pk)})")
+        cursor.execute(f"ANALYZE {partition}")
+    return source.rows, stat
+
+
+def drop_file(stored_file_id):
+    """
+    Drops the ingested rows of a file.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {_partition(stored_file_id)}")
+
+
+def ingest_file(stored_file_id):
+    """
+    Loads a stored file, recording the ingestion state. Runs in the background workers.
+    """
+    close_old_connections()
+    try:
+        try:
+            stored_file = StoredFile.objects.alive().get(pk=stored_file_id)
+        except StoredFile.DoesNotExist:
+            return
+
+        ingestion, _ = FileIngestion.objects.get_or_create(stored_file=stored_file)
+        ingestion.state = FileIngestion.LOADING
+        ingestion.error = ''
+        ingestion.save(update_fields=['state', 'error', 'updated_at'])
+
+        try:
+            rows, stat = load_file(stored_file)
+        except Exception as e:
+            ingestion.state = FileIngestion.FAILED
+            ingestion.error = str(e)
+            ingestion.save(update_fields=['state', 'error', 'updated_at'])
+            return
+
+        ingestion.state = FileIngestion.READY
+        ingestion.rows = rows
+        ingestion.source_size = stat.st_size
+        ingestion.source_mtime_ns = stat.st_mtime_ns
+        ingestion.ingested_at = timezone.now()
+        ingestion.save(update_fields=['state', 'rows', 'source_size', 'source_mtime_ns', 'ingested_at', 'updated_at'])
+    finally:
+        close_old_connections()
+
+
+def get_ingested_file_id(filename, file_path):
+    """
+    Returns the id of the stored file if its rows are loaded and match the
+    current file content, or None so the caller falls back to the other paths.
+    """
+    if not is_enabled():
+        return None
+
+    ingestion = (FileIngestion.objects
+                 .filter(stored_file__filename=filename, stored_file__deleted_at__isnull=True,
+                         state=FileIngestion.READY)
+                 .only('stored_file_id', 'source_size', 'source_mtime_ns')
+                 .first())
+    if ingestion is None:
+        return None
+
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    if stat.st_size != ingestion.source_size or stat.st_mtime_ns != ingestion.source_mtime_ns:
+        return None
+    return ingestion.stored_file_id
+
+
+def _rows(sql, params, deadline=None):
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            if deadline is not None:
+                deadline.check()
+                cursor.execute("SET LOCAL statement_timeout = %s", [max(int(deadline.remaining() * 1000), 1)])
+            cursor.execute(sql, params)
+            return [
+                {"username": username, "folder": folder, "numberMessages": number_messages, "size": size}
+                for username, folder, number_messages, size in cursor.fetchall()
+            ]
+    except OperationalError as e:
+        if getattr(e.__cause__, 'pgcode', None) == _QUERY_CANCELED:
+            raise DeadlineExceeded(str(e)) from e
+        raise
+
+
+def max_min(stored_file_id, smallest=False, deadline=None):
+    """
+    SQL equivalent of max-min-size.sh: the first row with the largest (or smallest) size.
+
+    Returns:
+        dict: The row, or None if there is none.
+
+    Raises:
+        DeadlineExceeded: If the query is cancelled by the deadline (as for the other queries).
+    """
+    if smallest:
+        condition, order = "size < 999999999999", "size ASC"
+    else:
+        condition, order = "size > 0", "size DESC"
+    rows = _rows(
+        f"SELECT {_COLUMNS} FROM core_mailboxrow WHERE stored_file_id = %s AND {condition} "
+        f"ORDER BY {order}, line_no LIMIT 1",
+        [stored_file_id],
+        deadline,
+    )
+    return rows[0] if rows else None
+
+
+def ordered_by_username(stored_file_id, desc=False, username=None, limit=None, deadline=None):
+    """
+    SQL equivalent of order-by-username.sh, with the username substring filter
+    and the limit pushed down into the query.
+
+    Rows with the same username are ordered by their whole line, in the same
+    direction as the usernames, as `sort` breaks the ties of its key.
+    """
+    sql = f"SELECT {_COLUMNS} FROM core_mailboxrow WHERE stored_file_id = %s"
+    params = [stored_file_id]
+    if username:
+        sql += " AND strpos(username, %s) > 0"
+        params.append(username)
+    direction = "DESC" if desc else "ASC"
+    sql += f' ORDER BY username COLLATE "C" {direction}, line COLLATE "C" {direction}, line_no'
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return _rows(sql, params, deadline)
+
+
+def between_msgs(stored_file_id, low, high, username=None, limit=None, deadline=None):
+    """
+    SQL equivalent of between-msgs.sh, in file order, with the username
+    substring filter and the limit pushed down into the query.
+    """
+    sql = f"SELECT {_COLUMNS} FROM core_mailboxrow WHERE stored_file_id = %s AND number_messages BETWEEN %s AND %s"
+    params = [stored_file_id, low, high]
+    if username:
+        sql += " AND strpos(username, %s) > 0"
+        params.append(username)
+    sql += " ORDER BY line_no"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return _rows(sql, params, deadline)
@@ -0,0 +1,146 @@
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.indexing import schedule_index_builds
+from core.models import StoredFile
+
+
+FILENAME_RE = re.compile(r'^[A-Za-z0-9._-]+$')
+
+CREATED = 'created'
+REPLACED = 'replaced'
+REJECTED = 'rejected'
+
+# Read once: os.umask can only be read by setting it, which is not thread-safe.
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def is_valid_filename(filename):
+    """
+    Returns True if the name can be used for a stored file.
+    """
+    return bool(FILENAME_RE.match(filename)) and filename not in ('.', '..')
+
+
+def write_file(src, file_path):
+    """
+    Copies a file-like object to `file_path` in chunks.
+
+    The content is written aside and renamed, so queries reading the previous
+    content never see a partially written file. The file gets the mode of
+    FILE_UPLOAD_PERMISSIONS (or 0666 minus the umask when it is None) instead
+    of the private mode of temp files, so a web server serving the downloads
+    (DOWNLOAD_SENDFILE_HEADER) can read it.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix='.upload-')
+    try:
+        mode = settings.FILE_UPLOAD_PERMISSIONS
+        os.fchmod(fd, 0o666 & ~_UMASK if mode is None else mode)
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(src, f, settings.BULK_UPLOAD_CHUNK_BYTES)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def iter_tar_entries(stream):
+    """
+    Reads a tar archive (plain, gzip, bz2 or xz) sequentially from a stream.
+
+    Directory entries are skipped. Each entry must be consumed before the
+    next one is read, since the archive is never seeked nor buffered.
+
+    Yields:
+        tuple: (entry name, file-like object), the object being None for
+        entries that are not regular files.
+
+    Raises:
+        tarfile.TarError: If the stream is not a valid archive.
+    """
+    import tarfile
+
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if member.isdir():
+                continue
+            name = member.name[2:] if member.name.startswith('./') else member.name
+            yield name, archive.extractfile(member) if member.isfile() else None
+
+
+def save_entries(entries):
+    """
+    Writes uploaded entries to UPLOAD_DIR and records them in one transaction.
+
+    Args:
+        entries (iterable): (filename, file-like object or None) pairs, as
+            yielded by `iter_tar_entries`.
+
+    Returns:
+        list: One status dict per entry, in order, with the filename, the
+        status (created, replaced or rejected) and a detail for rejected entries.
+
+    Raises:
+        tarfile.TarError: If the entries come from an invalid or truncated archive.
+    """
+    results = []
+    saved = {}
+    try:
+        for filename, src in entries:
+            if src is None:
+                results.append({"filename": filename, "status": REJECTED, "detail": "Not a regular file"})
+                continue
+            if not is_valid_filename(filename):
+                results.append({"filename": filename, "status": REJECTED,
+                                "detail": "Invalid filename. Allowed chars: A-Z, a-z, 0-9, -, _, ."})
+                continue
+            write_file(src, os.path.join(settings.UPLOAD_DIR, filename))
+            result = {"filename": filename, "status": None}
+            results.append(result)
+            saved.setdefault(filename, []).append(result)
+    finally:
+        # Files already written are recorded even if the stream breaks midway.
+        statuses = record_files(list(saved))
+    for filename, file_results in saved.items():
+        for result in file_results:
+            result["status"] = statuses[filename]
+    return results
+
+
+def record_files(filenames):
+    """
+    Records stored files in bulk: missing rows are created with a single
+    `bulk_create`, and existing ones (deleted ones included, which are
+    restored) are updated with a single query.
+
+    Returns:
+        dict: Filename to status (created or replaced).
+    """
+    if not filenames:
+        return {}
+
+    with transaction.atomic():
+        existing = list(StoredFile.objects.filter(filename__in=filenames).select_for_update())
+        existing_names = {stored_file.filename for stored_file in existing}
+        if existing:
+            StoredFile.objects.filter(pk__in=[stored_file.pk for stored_file in existing]).update(
+                deleted_at=None, updated_at=timezone.now())
+
+        created = StoredFile.objects.bulk_create(
+            [StoredFile(filename=filename) for filename in filenames if filename not in existing_names])
+        if created and created[0].pk is None:
+            created = list(StoredFile.objects.filter(filename__in=[f.filename for f in created]))
+
+        schedule_index_builds(existing + created)
+
+    return {filename: REPLACED if filename in existing_names else CREATED for filename in filenames}
@@ -4,18 +4,32 @@ from rest_framework.routers import DefaultRouter
 
 from core.views import (
     UploadFileViewSet,
+    DownloadFileViewSet,
     ListFilesViewSet,
     MaxMinSizeViewSet,
     OrderByUsernameViewSet,
     BetweenMsgsViewSet,
+    LookupUsernameViewSet,
+    DiffFilesViewSet,
+    SummaryViewSet,
+    QueryViewSet,
+    MemoryProfilesViewSet,
+    IndexStatusViewSet,
 )
 
 router = DefaultRouter()
 router.register(r'upload-file', UploadFileViewSet, basename='upload-file')
+router.register(r'download-file', DownloadFileViewSet, basename='download-file')
 router.register(r'list-files', ListFilesViewSet, basename='list-files')
 router.register(r'max-min-size', MaxMinSizeViewSet, basename='max-min-size')
 router.register(r'order-by-username', OrderByUsernameViewSet, basename='order-by-username')
 router.register(r'between-msgs', BetweenMsgsViewSet, basename='between-msgs')
+router.register(r'lookup-username', LookupUsernameViewSet, basename='lookup-username')
+router.register(r'diff-files', DiffFilesViewSet, basename='diff-files')
+router.register(r'summary', SummaryViewSet, basename='summary')
+router.register(r'query', QueryViewSet, basename='query')
+router.register(r'memory-profiles', MemoryProfilesViewSet, basename='memory-profiles')
+router.register(r'index-status', IndexStatusViewSet, basename='index-status')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,17 +1,35 @@
+import io
+import itertools
+import json
 import os
-import re
+import subprocess
 
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
 
-from drf_yasg import openapi
-from drf_yasg.utils import swagger_auto_schema
-
-from core.models import StoredFile
+from core.deadlines import Deadline, DeadlineExceeded, decode_cursor, encode_cursor
+from core.diff import diff_files
+from core.downloads import build_download_response
+from core.external_sort import external_sort, should_sort_externally
+from core.filters import FilterError, compile_filter, parse_fields, parse_order, shape_rows
+from core.indexing import query_index
+from core.models import StoredFile, FileIndex
+from core.parallel_scan import (
+    should_scan_in_parallel, parallel_max_min, parallel_between_msgs, scan_between_msgs, scan_filter,
+    scan_usernames, summarize_file,
+)
+from core.profiling import load_reports, profile_phase, summarize_reports
+from core import sql_backend
+from core.retention import resolve_file
+from core import schema as openapi
+from core.schema import swagger_auto_schema
 from core.scripts_runner import run_script, parse_line_to_dict
-from core.serializers import StoredFileSerializer, UserDataSerializer
+from core.uploads import is_valid_filename, iter_tar_entries, record_files, save_entries, write_file
+from core.sketches import FileSummary, rank_error, sample_file
+from core.serializers import StoredFileSerializer, UserDataSerializer, FileIndexSerializer
 
 
 class UploadFileViewSet(viewsets.ViewSet):
@@ -39,7 +57,7 @@ class UploadFileViewSet(viewsets.ViewSet):
         if not filename:
             return Response({"detail": "filename query param is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not re.match(r'^[A-Za-z0-9._-]+$', filename):
+        if not is_valid_filename(filename):
             return Response({"detail": "Invalid filename. Allowed chars: A-Z, a-z, 0-9, -, _, ."},
                             status=status.HTTP_400_BAD_REQUEST)
 
@@ -48,15 +66,83 @@ class UploadFileViewSet(viewsets.ViewSet):
 
         file_exists = os.path.exists(file_path)
 
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
+        write_file(io.BytesIO(file_content), file_path)
 
+        # Also restores the row of a deleted file of the same name.
+        record_files([filename])
         if not file_exists:
-            StoredFile.objects.create(filename=filename)
             return Response({"detail": "File created"}, status=status.HTTP_201_CREATED)
         else:
             return Response({"detail": "File replaced"}, status=status.HTTP_204_NO_CONTENT)
 
+    @swagger_auto_schema(
+        methods=['put', 'post'],
+        operation_summary="Upload (or replace) several files at once",
+        operation_description="Body: a tar archive (optionally gzip, bz2 or xz compressed), "
+                              "or a multipart/form-data request with one or more files.",
+        responses={
+            200: "Status of each file (created, replaced or rejected)",
+            400: "Empty body or invalid archive"
+        }
+    )
+    @action(detail=False, methods=['put', 'post'], url_path='bulk-upload')
+    def bulk_upload(self, request):
+        """
+        Upload or replace several files in one request.
+        Entries are written to disk as they are read, and recorded in one transaction.
+        """
+        # Imported here, off the startup path of the workers.
+        import tarfile
+
+        if request.content_type.startswith('multipart/form-data'):
+            entries = [(upload.name, upload) for _, uploads in request.FILES.lists() for upload in uploads]
+            if not entries:
+                return Response({"detail": "No files sent"}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            if request.stream is None:
+                return Response({"detail": "Request body is empty"}, status=status.HTTP_400_BAD_REQUEST)
+            entries = iter_tar_entries(request.stream)
+
+        try:
+            results = save_entries(entries)
+        except tarfile.TarError:
+            return Response({"detail": "Invalid or truncated archive"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(results, status=status.HTTP_200_OK)
+
+
+class DownloadFileViewSet(viewsets.ViewSet):
+    """
+    ViewSet for downloading stored files.
+    """
+    @swagger_auto_schema(
+        operation_summary="Download a stored file",
+        manual_parameters=[
+            openapi.Parameter('filename', openapi.IN_QUERY, description="Name of the stored file to download", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('Range', openapi.IN_HEADER, description="Byte range to download (e.g. bytes=0-1023)", type=openapi.TYPE_STRING, required=False),
+        ],
+        responses={
+            200: "File content",
+            206: "Partial file content",
+            304: "Not modified",
+            404: "File not found",
+            416: "Range not satisfiable"
+        }
+    )
+    def list(self, request):
+        """
+        Streams a stored file, with support for Range and conditional requests.
+        """
+        filename = request.query_params.get('filename', None)
+        if not filename:
+            return Response({"detail": "filename query param is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_path = resolve_file(filename)
+        if file_path is None or not os.path.exists(file_path):
+            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        return build_download_response(request, file_path, filename)
+
 
 class ListFilesViewSet(viewsets.ViewSet):
     """
@@ -75,6 +161,66 @@ class ListFilesViewSet(viewsets.ViewSet):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+_TIMEOUT_PARAM = openapi.Parameter('timeout', openapi.IN_QUERY, description="Deadline of the query, in seconds (default: QUERY_TIMEOUT_SECONDS)", type=openapi.TYPE_NUMBER, required=False)
+_PARTIAL_PARAM = openapi.Parameter('partial', openapi.IN_QUERY, description="On deadline, return the rows found so far with a continuation cursor instead of 504 (any value)", type=openapi.TYPE_STRING, required=False)
+_CURSOR_PARAM = openapi.Parameter('cursor', openapi.IN_QUERY, description="Continuation cursor of a truncated partial result", type=openapi.TYPE_STRING, required=False)
+
+
+def _parse_deadline(request):
+    """
+    Returns the deadline of a query from the optional 'timeout' query param,
+    in seconds, defaulting to QUERY_TIMEOUT_SECONDS and capped at QUERY_MAX_TIMEOUT_SECONDS.
+
+    Raises:
+        ValueError: If the param is not a positive number.
+    """
+    timeout = request.query_params.get('timeout', None)
+    seconds = settings.QUERY_TIMEOUT_SECONDS if timeout is None else float(timeout)
+    if not 0 < seconds < float('inf'):
+        raise ValueError("timeout must be positive")
+    return Deadline(min(seconds, settings.QUERY_MAX_TIMEOUT_SECONDS))
+
+
+def _parse_cursor(request, file_path):
+    """
+    Returns the byte offset of the optional 'cursor' query param, or None.
+
+    Raises:
+        ValueError: If the cursor is malformed or was issued for another version of the file.
+    """
+    cursor = request.query_params.get('cursor', None)
+    return None if cursor is None else decode_cursor(cursor, file_path)
+
+
+def _deadline_exceeded():
+    return Response({"detail": "Query deadline exceeded"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+def _file_not_found():
+    return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+def _script_failed(file_path):
+    """
+    Answers a failed script: 404 when the file is missing from the upload
+    directory (only checked then), 500 otherwise.
+    """
+    if not os.path.isfile(file_path):
+        return _file_not_found()
+    return Response({"detail": "Error running script"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _partial_response(results, file_path, resume_at):
+    """
+    Wraps the results of a partial query, with the cursor to resume it when truncated.
+    """
+    return Response({
+        "results": results,
+        "truncated": resume_at is not None,
+        "cursor": encode_cursor(file_path, resume_at) if resume_at is not None else None,
+    }, status=status.HTTP_200_OK)
+
+
 class MaxMinSizeViewSet(viewsets.ViewSet):
     """
     ViewSet to get user with larger or smaller size.
@@ -84,8 +230,9 @@ class MaxMinSizeViewSet(viewsets.ViewSet):
         manual_parameters=[
             openapi.Parameter('filename', openapi.IN_QUERY, description="Name of the stored file to process", type=openapi.TYPE_STRING, required=True),
             openapi.Parameter('min', openapi.IN_QUERY, description="Defines whether to get the smallest size (any value)", type=openapi.TYPE_STRING, required=False),
+            _TIMEOUT_PARAM,
         ],
-        responses={200: UserDataSerializer()}
+        responses={200: UserDataSerializer(), 504: "Query deadline exceeded"}
     )
     def list(self, request):
         """
@@ -97,22 +244,111 @@ class MaxMinSizeViewSet(viewsets.ViewSet):
         if not filename:
             return Response({"detail": "filename query param is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        file_path = os.path.join(settings.UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
-            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            deadline = _parse_deadline(request)
+        except ValueError:
+            return Response({"detail": "timeout must be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
 
-        args = [file_path]
-        if min_param is not None:
-            args.append('-min')
+        file_path = resolve_file(filename)
+        if file_path is None:
+            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        output, error = run_script('max-min-size.sh', args)
-        if error or not output:
-            return Response({"detail": "Error running script"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        try:
+            stored_file_id = sql_backend.get_ingested_file_id(filename, file_path)
+            if stored_file_id is not None:
+                data = sql_backend.max_min(stored_file_id, smallest=min_param is not None, deadline=deadline)
+                if data is None:
+                    return Response({"detail": "Error running script"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                return Response(data, status=status.HTTP_200_OK)
+
+            output = query_index(filename, file_path,
+                                 lambda index: index.max_min(file_path, smallest=min_param is not None),
+                                 deadline)
+            if output is None and should_scan_in_parallel(file_path):
+                output = parallel_max_min(file_path, smallest=min_param is not None, deadline=deadline)
+            if output is None:
+                args = [file_path]
+                if min_param is not None:
+                    args.append('-min')
+
+                output, error = run_script('max-min-size.sh', args, timeout=deadline.remaining())
+                if error:
+                    return _script_failed(file_path)
+        except (DeadlineExceeded, subprocess.TimeoutExpired):
+            return _deadline_exceeded()
+        except FileNotFoundError as e:
+            if e.filename != file_path:
+                raise
+            return _file_not_found()
+
+        if not output:
+            return _script_failed(file_path)
 
         data = parse_line_to_dict(output)
         return Response(data, status=status.HTTP_200_OK)
 
 
+def _parse_limit(request):
+    """
+    Returns the optional 'limit' query param as a positive integer.
+
+    Raises:
+        ValueError: If the param is not a positive integer.
+    """
+    limit = request.query_params.get('limit', None)
+    if limit is None:
+        return None
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return limit
+
+
+def _parse_lines(lines):
+    """
+    Parses lines into rows, skipping the lines that cannot be parsed.
+    """
+    rows = []
+    for line in lines:
+        try:
+            rows.append(parse_line_to_dict(line))
+        except ValueError:
+            continue
+    return rows
+
+
+def _started(lines):
+    """
+    Reads the first line of a lazy iterator, so what precedes it (opening the
+    file, sorting the runs) runs now, then returns an iterator over all the lines.
+    """
+    first = next(lines, None)
+    return itertools.chain([first] if first is not None else [], lines)
+
+
+def _stream_rows(lines, filter_username=None, limit=None):
+    """
+    Renders raw lines as a JSON array, one row at a time, so the response
+    never holds the whole result in memory. Lines that cannot be parsed are skipped.
+    """
+    yield '['
+    first = True
+    count = 0
+    for raw in lines:
+        if limit is not None and count >= limit:
+            break
+        try:
+            data = parse_line_to_dict(raw.decode('utf-8', errors='replace'))
+        except ValueError:
+            continue
+        if filter_username and filter_username not in data['username']:
+            continue
+        yield json.dumps(data) if first else ',' + json.dumps(data)
+        first = False
+        count += 1
+    yield ']'
+
+
 class OrderByUsernameViewSet(viewsets.ViewSet):
     """
     ViewSet to get the list of users ordered by username.
@@ -123,13 +359,15 @@ class OrderByUsernameViewSet(viewsets.ViewSet):
             openapi.Parameter('filename', openapi.IN_QUERY, description="Name of the stored file to process", type=openapi.TYPE_STRING, required=True),
             openapi.Parameter('desc', openapi.IN_QUERY, description="Sort descending (any value)", type=openapi.TYPE_STRING, required=False),
             openapi.Parameter('username', openapi.IN_QUERY, description="Filter by substring in username", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Maximum number of rows to return", type=openapi.TYPE_INTEGER, required=False),
+            _TIMEOUT_PARAM,
         ],
-        responses={200: UserDataSerializer(many=True)}
+        responses={200: UserDataSerializer(many=True), 504: "Query deadline exceeded"}
     )
     def list(self, request):
         """
         Returns the list of users ordered by username (asc or desc),
-        with option to filter by username.
+        with option to filter by username and to limit the number of rows.
         """
         filename = request.query_params.get('filename', None)
         desc = request.query_params.get('desc', None)
@@ -138,24 +376,71 @@ class OrderByUsernameViewSet(viewsets.ViewSet):
         if not filename:
             return Response({"detail": "filename query param is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        file_path = os.path.join(settings.UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
-            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            limit = _parse_limit(request)
+        except ValueError:
+            return Response({"detail": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
 
-        args = [file_path]
-        if desc is not None:
-            args.append('-desc')
+        try:
+            deadline = _parse_deadline(request)
+        except ValueError:
+            return Response({"detail": "timeout must be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
 
-        output, error = run_script('order-by-username.sh', args)
-        if error or not output:
-            return Response({"detail": "Error running script"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        file_path = resolve_file(filename)
+        if file_path is None:
+            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        lines = output.split('\n')
-        data_list = [parse_line_to_dict(line) for line in lines if line.strip()]
+        try:
+            stored_file_id = sql_backend.get_ingested_file_id(filename, file_path)
+            if stored_file_id is not None:
+                data_list = sql_backend.ordered_by_username(stored_file_id, desc=desc is not None,
+                                                            username=filter_username, limit=limit, deadline=deadline)
+                return Response(data_list, status=status.HTTP_200_OK)
+
+            if should_sort_externally(file_path):
+                # A ready index already holds the order: its lines are streamed
+                # from the file. The first one is read here, so a stale index
+                # still falls back.
+                lines = query_index(filename, file_path,
+                                    lambda index: _started(index.iter_ordered_by_username(file_path, desc=desc is not None)),
+                                    deadline)
+                if lines is None:
+                    # The runs are sorted before the response starts, so the deadline can still give a 504.
+                    lines = _started(external_sort(file_path, desc=desc is not None, deadline=deadline))
+                rows = _stream_rows(lines, filter_username, limit)
+                return StreamingHttpResponse(rows, content_type='application/json')
+
+            lines = query_index(filename, file_path,
+                                lambda index: index.ordered_by_username(file_path, desc=desc is not None, deadline=deadline),
+                                deadline)
+            if lines is None:
+                args = [file_path]
+                if desc is not None:
+                    args.append('-desc')
+
+                with profile_phase('script'):
+                    output, error = run_script('order-by-username.sh', args, timeout=deadline.remaining())
+                if error or not output:
+                    return _script_failed(file_path)
+
+                with profile_phase('split'):
+                    lines = output.split('\n')
+        except (DeadlineExceeded, subprocess.TimeoutExpired):
+            return _deadline_exceeded()
+        except FileNotFoundError as e:
+            if e.filename != file_path:
+                raise
+            return _file_not_found()
+
+        with profile_phase('parse'):
+            data_list = [parse_line_to_dict(line) for line in lines if line.strip()]
 
         if filter_username:
             data_list = [d for d in data_list if filter_username in d['username']]
 
+        if limit is not None:
+            data_list = data_list[:limit]
+
         return Response(data_list, status=status.HTTP_200_OK)
 
 
@@ -170,18 +455,26 @@ class BetweenMsgsViewSet(viewsets.ViewSet):
             openapi.Parameter('low', openapi.IN_QUERY, description="Lower limit", type=openapi.TYPE_INTEGER, required=True),
             openapi.Parameter('high', openapi.IN_QUERY, description="Upper limit", type=openapi.TYPE_INTEGER, required=True),
             openapi.Parameter('username', openapi.IN_QUERY, description="Filter by substring in username", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Maximum number of rows to return", type=openapi.TYPE_INTEGER, required=False),
+            _TIMEOUT_PARAM,
+            _PARTIAL_PARAM,
+            _CURSOR_PARAM,
         ],
-        responses={200: UserDataSerializer(many=True)}
+        responses={200: UserDataSerializer(many=True), 504: "Query deadline exceeded"}
     )
     def list(self, request):
         """
         Returns the list of users whose number of messages (INBOX) is between 'low' and 'high'.
-        You can filter by username substring.
+        You can filter by username substring and limit the number of rows.
+
+        With 'partial' (or 'cursor'), the rows are wrapped in an object telling
+        whether the deadline truncated them, with the cursor to resume the scan.
         """
         filename = request.query_params.get('filename', None)
         low = request.query_params.get('low', None)
         high = request.query_params.get('high', None)
         filter_username = request.query_params.get('username', None)
+        partial = 'partial' in request.query_params or 'cursor' in request.query_params
 
         if not filename or low is None or high is None:
             return Response({"detail": "filename, low and high query params are required"}, 
@@ -193,22 +486,462 @@ class BetweenMsgsViewSet(viewsets.ViewSet):
         except ValueError:
             return Response({"detail": "low and high must be integers"}, status=status.HTTP_400_BAD_REQUEST)
 
-        file_path = os.path.join(settings.UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
+        try:
+            limit = _parse_limit(request)
+        except ValueError:
+            return Response({"detail": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            deadline = _parse_deadline(request)
+        except ValueError:
+            return Response({"detail": "timeout must be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_path = resolve_file(filename)
+        if file_path is None:
             return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        args = [file_path, str(low_val), str(high_val)]
-        output, error = run_script('between-msgs.sh', args)
-        if error:
-            return Response({"detail": "Error running script"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        try:
+            start = _parse_cursor(request, file_path)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def finish(lines):
+            with profile_phase('parse'):
+                data_list = [parse_line_to_dict(line) for line in lines if line.strip()]
+            if filter_username:
+                data_list = [d for d in data_list if filter_username in d['username']]
+            if limit is not None:
+                data_list = data_list[:limit]
+            return data_list
+
+        try:
+            if partial:
+                lines = None
+                if start is None:
+                    lines = query_index(filename, file_path,
+                                        lambda index: index.between_msgs(file_path, low_val, high_val, deadline=deadline),
+                                        deadline)
+                resume_at = None
+                if lines is None:
+                    lines, resume_at = scan_between_msgs(file_path, low_val, high_val, deadline, start or 0)
+                return _partial_response(finish(lines), file_path, resume_at)
+
+            stored_file_id = sql_backend.get_ingested_file_id(filename, file_path)
+            if stored_file_id is not None:
+                data_list = sql_backend.between_msgs(stored_file_id, low_val, high_val,
+                                                     username=filter_username, limit=limit, deadline=deadline)
+                return Response(data_list, status=status.HTTP_200_OK)
+
+            lines = query_index(filename, file_path,
+                                lambda index: index.between_msgs(file_path, low_val, high_val, deadline=deadline),
+                                deadline)
+            if lines is None and should_scan_in_parallel(file_path):
+                lines = parallel_between_msgs(file_path, low_val, high_val, deadline=deadline)
+            if lines is None:
+                args = [file_path, str(low_val), str(high_val)]
+                with profile_phase('script'):
+                    output, error = run_script('between-msgs.sh', args, timeout=deadline.remaining())
+                if error or output is None:
+                    return _script_failed(file_path)
+
+                if not output.strip():
+                    return Response([], status=status.HTTP_200_OK)
+
+                with profile_phase('split'):
+                    lines = output.strip().split('\n')
+        except (DeadlineExceeded, subprocess.TimeoutExpired):
+            return _deadline_exceeded()
+        except FileNotFoundError as e:
+            if e.filename != file_path:
+                raise
+            return _file_not_found()
+
+        return Response(finish(lines), status=status.HTTP_200_OK)
+
+
+class LookupUsernameViewSet(viewsets.ViewSet):
+    """
+    ViewSet to get every row of one or more users (exact username match).
+    """
+    @swagger_auto_schema(
+        operation_summary="Get the rows of one or more usernames",
+        manual_parameters=[
+            openapi.Parameter('filename', openapi.IN_QUERY, description="Name of the stored file to process", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('username', openapi.IN_QUERY, description="Exact username (repeat the param to look up several)", type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_STRING), collection_format='multi', required=True),
+            _TIMEOUT_PARAM,
+            _PARTIAL_PARAM,
+            _CURSOR_PARAM,
+        ],
+        responses={200: "Rows of each username", 504: "Query deadline exceeded"}
+    )
+    def list(self, request):
+        """
+        Returns, for each requested username, the list of its rows in file order.
+        Uses the username hash index of the file when it is ready.
+
+        With 'partial' (or 'cursor'), the rows are wrapped in an object telling
+        whether the deadline truncated them, with the cursor to resume the scan.
+        """
+        filename = request.query_params.get('filename', None)
+        usernames = list(dict.fromkeys(u for u in request.query_params.getlist('username') if u))
+        partial = 'partial' in request.query_params or 'cursor' in request.query_params
 
-        if not output.strip():
-            return Response([], status=status.HTTP_200_OK)
+        if not filename or not usernames:
+            return Response({"detail": "filename and username query params are required"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        lines = output.strip().split('\n')
-        data_list = [parse_line_to_dict(line) for line in lines if line.strip()]
+        if len(usernames) > settings.LOOKUP_MAX_USERNAMES:
+            return Response({"detail": f"At most {settings.LOOKUP_MAX_USERNAMES} usernames per request"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        if filter_username:
-            data_list = [d for d in data_list if filter_username in d['username']]
+        try:
+            deadline = _parse_deadline(request)
+        except ValueError:
+            return Response({"detail": "timeout must be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(data_list, status=status.HTTP_200_OK)
\ No newline at end of file
+        file_path = resolve_file(filename)
+        if file_path is None:
+            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            start = _parse_cursor(request, file_path)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        lines, resume_at = None, None
+        try:
+            if start is None:
+                lines = query_index(filename, file_path,
+                                    lambda index: index.lookup_usernames(file_path, usernames, deadline=deadline),
+                                    deadline)
+            if lines is None:
+                lines, resume_at = scan_usernames(file_path, usernames, deadline, start or 0)
+        except DeadlineExceeded:
+            return _deadline_exceeded()
+        except FileNotFoundError as e:
+            if e.filename != file_path:
+                raise
+            return _file_not_found()
+        if resume_at is not None and not partial:
+            return _deadline_exceeded()
+
+        data = {username: _parse_lines(user_lines) for username, user_lines in lines.items()}
+        if partial:
+            return _partial_response(data, file_path, resume_at)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class DiffFilesViewSet(viewsets.ViewSet):
+    """
+    ViewSet to compare two snapshots of the mailbox report.
+    """
+    @swagger_auto_schema(
+        operation_summary="Get users added, removed or changed between two stored files",
+        manual_parameters=[
+            openapi.Parameter('old', openapi.IN_QUERY, description="Name of the older stored file", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('new', openapi.IN_QUERY, description="Name of the newer stored file", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('min_messages_change', openapi.IN_QUERY, description="Minimum absolute change of numberMessages to report (default 1)", type=openapi.TYPE_INTEGER, required=False),
+            openapi.Parameter('min_size_change', openapi.IN_QUERY, description="Minimum absolute change of size to report (default 1)", type=openapi.TYPE_INTEGER, required=False),
+            _TIMEOUT_PARAM,
+        ],
+        responses={200: "Added, removed and changed rows", 504: "Query deadline exceeded"}
+    )
+    def list(self, request):
+        """
+        Returns the rows added, removed and changed between 'old' and 'new',
+        keyed by (username, folder). A row is changed when numberMessages or
+        size moved by at least the given thresholds.
+        """
+        old = request.query_params.get('old', None)
+        new = request.query_params.get('new', None)
+
+        if not old or not new:
+            return Response({"detail": "old and new query params are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            min_messages_change = int(request.query_params.get('min_messages_change', 1))
+            min_size_change = int(request.query_params.get('min_size_change', 1))
+        except ValueError:
+            return Response({"detail": "min_messages_change and min_size_change must be integers"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            deadline = _parse_deadline(request)
+        except ValueError:
+            return Response({"detail": "timeout must be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        old_path = resolve_file(old)
+        new_path = resolve_file(new)
+        if old_path is None or new_path is None:
+            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # The indexes tell, without reading the files, whether both are
+        # already ordered by username and can be merge-joined.
+        sorted_inputs = all(
+            query_index(filename, file_path, lambda index: index.is_sorted_by_username())
+            for filename, file_path in ((old, old_path), (new, new_path))
+        )
+
+        try:
+            data = diff_files(old_path, new_path, min_messages_change, min_size_change,
+                              sorted_inputs=sorted_inputs, deadline=deadline)
+        except DeadlineExceeded:
+            return _deadline_exceeded()
+        except FileNotFoundError as e:
+            if e.filename not in (old_path, new_path):
+                raise
+            return _file_not_found()
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
+def _parse_quantiles(request):
+    """
+    Returns the quantiles of the optional 'quantiles' query param
+    (comma-separated, e.g. "0.5,0.9,0.99"), defaulting to SUMMARY_QUANTILES.
+
+    Raises:
+        ValueError: If a quantile is not a number between 0 and 1.
+    """
+    quantiles = [float(q) for q in request.query_params.get('quantiles', settings.SUMMARY_QUANTILES).split(',')]
+    if not quantiles or not all(0 <= q <= 1 for q in quantiles):
+        raise ValueError("quantiles must be between 0 and 1")
+    return quantiles
+
+
+class SummaryViewSet(viewsets.ViewSet):
+    """
+    ViewSet to get statistical summaries of one or more stored files.
+    """
+    @swagger_auto_schema(
+        operation_summary="Get quantiles and histograms of numberMessages and size",
+        manual_parameters=[
+            openapi.Parameter('filename', openapi.IN_QUERY, description="Name of a stored file (repeat the param to summarize several together)", type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_STRING), collection_format='multi', required=True),
+            openapi.Parameter('quantiles', openapi.IN_QUERY, description="Comma-separated quantiles between 0 and 1 (default: SUMMARY_QUANTILES)", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('approximate', openapi.IN_QUERY, description="Answer from a random sample within a time budget (any value)", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('budget', openapi.IN_QUERY, description="Time budget of the approximate mode, in seconds (default: SUMMARY_APPROX_BUDGET_SECONDS)", type=openapi.TYPE_NUMBER, required=False),
+            _TIMEOUT_PARAM,
+        ],
+        responses={200: "Summary of the files", 504: "Query deadline exceeded"}
+    )
+    def list(self, request):
+        """
+        Returns the row count and, for numberMessages and size, the min, max,
+        mean, quantiles and a power-of-two histogram over all the given files.
+
+        Quantiles come from mergeable sketches with a relative error of
+        SUMMARY_RELATIVE_ACCURACY. With 'approximate', the files are sampled
+        for at most 'budget' seconds instead of read entirely, and the
+        response states the rank error of the quantiles at SUMMARY_APPROX_CONFIDENCE.
+        The min and max are then exact only if every file has a ready index
+        ('exactMinMax' in the accuracy); otherwise they are those of the sample.
+        """
+        filenames = list(dict.fromkeys(f for f in request.query_params.getlist('filename') if f))
+        approximate = request.query_params.get('approximate', None) is not None
+
+        if not filenames:
+            return Response({"detail": "filename query param is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            quantiles = _parse_quantiles(request)
+        except ValueError:
+            return Response({"detail": "quantiles must be comma-separated numbers between 0 and 1"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            deadline = _parse_deadline(request)
+            budget = float(request.query_params.get('budget', settings.SUMMARY_APPROX_BUDGET_SECONDS))
+            if not 0 < budget < float('inf'):
+                raise ValueError("budget must be positive")
+        except ValueError:
+            return Response({"detail": "timeout and budget must be positive numbers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_paths = [resolve_file(filename) for filename in filenames]
+        if None in file_paths:
+            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        relative_accuracy = settings.SUMMARY_RELATIVE_ACCURACY
+        summary = FileSummary(relative_accuracy)
+        accuracy = {"relativeError": relative_accuracy}
+        scale = 1.0
+
+        try:
+            if approximate:
+                # Budget and samples are split in proportion to the file sizes, so
+                # every file is sampled at about the same rate.
+                budget = min(budget, deadline.seconds)
+                sizes = [os.path.getsize(file_path) for file_path in file_paths]
+                total_size = sum(sizes) or 1
+                samples = estimated_rows = 0
+                for file_path, size in zip(file_paths, sizes):
+                    file_summary = FileSummary(relative_accuracy)
+                    file_samples, sampled_bytes = sample_file(
+                        file_path, file_summary, budget * size / total_size,
+                        max(int(settings.SUMMARY_APPROX_MAX_SAMPLES * size / total_size), 1),
+                    )
+                    if sampled_bytes:
+                        estimated_rows += size / sampled_bytes * file_summary.rows
+                    samples += file_samples
+                    summary.merge(file_summary)
+                scale = estimated_rows / summary.rows if summary.rows else 0.0
+                # The min and max of a sample only bound the real ones: the
+                # exact ones are read from the indexes when every file has one.
+                extremes = [query_index(filename, file_path, lambda index: index.extremes())
+                            for filename, file_path in zip(filenames, file_paths)]
+                exact_extremes = None not in extremes
+                if exact_extremes:
+                    summary.messages.set_extremes([messages for messages, _ in extremes])
+                    summary.sizes.set_extremes([sizes for _, sizes in extremes])
+                accuracy.update({
+                    "samples": samples,
+                    "confidence": settings.SUMMARY_APPROX_CONFIDENCE,
+                    "rankError": rank_error(summary.rows, settings.SUMMARY_APPROX_CONFIDENCE),
+                    "exactMinMax": exact_extremes,
+                })
+            else:
+                for file_path in file_paths:
+                    summary.merge(summarize_file(file_path, relative_accuracy, deadline))
+        except DeadlineExceeded:
+            return _deadline_exceeded()
+        except FileNotFoundError as e:
+            if e.filename not in file_paths:
+                raise
+            return _file_not_found()
+
+        data = {"files": filenames, "approximate": approximate, "accuracy": accuracy}
+        data.update(summary.as_dict(quantiles, scale))
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class QueryViewSet(viewsets.ViewSet):
+    """
+    ViewSet to filter, project, order and limit the rows of a stored file.
+    """
+    @swagger_auto_schema(
+        operation_summary="Get the rows matching a filter expression",
+        operation_description="Filter example: size > 1000 AND (username = \"user1\" OR folder contains \"sent\"). "
+                              "Fields: username, folder (=, != or contains a quoted string), "
+                              "numberMessages, size (=, !=, <, <=, >, >= an integer), combined with AND, OR and parentheses.",
+        manual_parameters=[
+            openapi.Parameter('filename', openapi.IN_QUERY, description="Name of the stored file", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('where', openapi.IN_QUERY, description="Filter expression (default: all rows)", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('fields', openapi.IN_QUERY, description="Comma-separated fields to return (default: all)", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('order', openapi.IN_QUERY, description="Field to order by, prefixed with '-' for descending order (default: file order)", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Maximum number of rows to return", type=openapi.TYPE_INTEGER, required=False),
+            _TIMEOUT_PARAM,
+        ],
+        responses={200: "Matching rows", 400: "Invalid expression or params", 404: "File not found", 504: "Query deadline exceeded"}
+    )
+    def list(self, request):
+        """
+        Evaluates the filter in one pass over the file, or over its index
+        when it is ready, and returns only the requested rows and fields.
+        """
+        filename = request.query_params.get('filename', None)
+        if not filename:
+            return Response({"detail": "filename query param is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            flt = compile_filter(request.query_params.get('where', ''))
+            fields = parse_fields(request.query_params.get('fields', None))
+            order, descending = parse_order(request.query_params.get('order', None))
+        except FilterError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = _parse_limit(request)
+        except ValueError:
+            return Response({"detail": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            deadline = _parse_deadline(request)
+        except ValueError:
+            return Response({"detail": "timeout must be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_path = resolve_file(filename)
+        if file_path is None:
+            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Without an order, the scan stops as soon as `limit` rows matched.
+        scan_limit = limit if order is None else None
+        try:
+            rows = query_index(filename, file_path,
+                               lambda index: index.filter_rows(file_path, flt, scan_limit, deadline=deadline),
+                               deadline)
+            if rows is None:
+                rows = scan_filter(file_path, flt, scan_limit, deadline)
+        except DeadlineExceeded:
+            return _deadline_exceeded()
+        except FileNotFoundError as e:
+            if e.filename != file_path:
+                raise
+            return _file_not_found()
+
+        return Response(shape_rows(rows, fields, order, descending, limit), status=status.HTTP_200_OK)
+
+
+class MemoryProfilesViewSet(viewsets.ViewSet):
+    """
+    ViewSet to inspect the memory profiles of sampled requests.
+    """
+    @swagger_auto_schema(
+        operation_summary="Get a summary of the memory profiles per request path",
+        manual_parameters=[
+            openapi.Parameter('path', openapi.IN_QUERY, description="Only the profiles of this request path (e.g. /api/between-msgs/)", type=openapi.TYPE_STRING, required=False),
+        ],
+        responses={200: "Peak memory, phase peaks and top allocation sites per request path"}
+    )
+    def list(self, request):
+        """
+        Summarizes the reports in MEMORY_PROFILE_DIR per request path, with
+        the ids of the latest reports.
+        """
+        reports = load_reports(request.query_params.get('path', None))
+        return Response({
+            "paths": summarize_reports(reports),
+            "latest": [report["id"] for report in reports[:settings.MEMORY_PROFILE_TOP]],
+        }, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_summary="Get a memory profile",
+        responses={200: "Peak and net memory and top allocation sites of every phase", 404: "Profile not found"}
+    )
+    def retrieve(self, request, pk=None):
+        """
+        Returns one report, by the id given in its X-Memory-Profile-Id header.
+        """
+        for report in load_reports():
+            if report["id"] == pk:
+                return Response(report, status=status.HTTP_200_OK)
+        return Response({"detail": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class IndexStatusViewSet(viewsets.ViewSet):
+    """
+    ViewSet to get the index build status of a stored file.
+    """
+    @swagger_auto_schema(
+        operation_summary="Get index build status of a stored file",
+        manual_parameters=[
+            openapi.Parameter('filename', openapi.IN_QUERY, description="Name of the stored file", type=openapi.TYPE_STRING, required=True),
+        ],
+        responses={200: FileIndexSerializer()}
+    )
+    def list(self, request):
+        """
+        Returns the state, build time and size of the index of a stored file.
+        """
+        filename = request.query_params.get('filename', None)
+        if not filename:
+            return Response({"detail": "filename query param is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        stored_file = StoredFile.objects.alive().filter(filename=filename).first()
+        if stored_file is None:
+            return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        file_index = FileIndex.objects.filter(stored_file=stored_file).first()
+        if file_index is None:
+            return Response({"detail": "Index not scheduled"}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = FileIndexSerializer(file_index)
+        return Response(serializer.data, status=status.HTTP_200_OK)
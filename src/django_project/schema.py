@@ -0,0 +1,74 @@
+import os
+import threading
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+
+from core.schema import apply_annotations
+
+
+# drf_yasg and its OpenAPI machinery are imported on the first documentation
+# request only, so they stay off the import path of every worker. The
+# annotations recorded on the views are applied then too.
+_lock = threading.Lock()
+_swagger_ui_view = None
+_spec = None
+
+
+def _info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="API de Teste",
+        default_version='v1',
+        description="Documentação da API",
+        terms_of_service="",
+        contact=openapi.Contact(email="contato@example.com"),
+        license=openapi.License(name="MIT License"),
+    )
+
+
+def generate_spec():
+    """
+    Generates the OpenAPI document of the API.
+
+    Returns:
+        bytes: The document encoded as JSON.
+    """
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    apply_annotations()
+    schema = OpenAPISchemaGenerator(info=_info()).get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[], pretty=True).encode(schema)
+
+
+def swagger_spec_view(request):
+    """
+    Serves the OpenAPI document: the file precomputed at build time when it
+    exists, otherwise a document generated once and cached in the process.
+    """
+    global _spec
+    if os.path.exists(settings.SWAGGER_SCHEMA_FILE):
+        return FileResponse(open(settings.SWAGGER_SCHEMA_FILE, 'rb'), content_type='application/json')
+
+    with _lock:
+        if _spec is None:
+            _spec = generate_spec()
+    return HttpResponse(_spec, content_type='application/json')
+
+
+def swagger_ui_view(request, *args, **kwargs):
+    """
+    Serves the Swagger UI, which loads the document from `swagger_spec_view`.
+    """
+    global _swagger_ui_view
+    with _lock:
+        if _swagger_ui_view is None:
+            from drf_yasg.views import get_schema_view
+            from rest_framework.permissions import AllowAny
+
+            apply_annotations()
+            schema_view = get_schema_view(_info(), public=True, permission_classes=(AllowAny,))
+            _swagger_ui_view = schema_view.with_ui('swagger', cache_timeout=0)
+    return _swagger_ui_view(request, *args, **kwargs)
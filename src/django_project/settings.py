@@ -1,3 +1,4 @@
+import importlib.util
 import os
 from pathlib import Path
 from datetime import timedelta
@@ -14,6 +15,92 @@ UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(BASE_DIR, "uploaded_files"))
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Background index build of uploaded files
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(BASE_DIR, "file_indexes"))
+if not os.path.exists(INDEX_DIR):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+INDEX_BUILD_WORKERS = int(os.getenv("INDEX_BUILD_WORKERS", "2"))
+# Files from this size are indexed in a separate process, off the GIL and memory of the workers
+INDEX_BUILD_PROCESS_THRESHOLD = int(os.getenv("INDEX_BUILD_PROCESS_THRESHOLD", str(64 * 1024 * 1024)))
+# Builds pending or running for longer than this are considered lost (e.g. with a
+# restarted process) and scheduled again
+INDEX_BUILD_STALE_SECONDS = float(os.getenv("INDEX_BUILD_STALE_SECONDS", "900"))
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", "8"))
+# Maximum usernames in one batched lookup-username request
+LOOKUP_MAX_USERNAMES = int(os.getenv("LOOKUP_MAX_USERNAMES", "100"))
+
+# Deadline of the query endpoints, in seconds (clients can lower it with ?timeout=)
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "30"))
+QUERY_MAX_TIMEOUT_SECONDS = float(os.getenv("QUERY_MAX_TIMEOUT_SECONDS", "300"))
+
+# Statistical summaries: sketch accuracy, default quantiles and approximate (sampled) mode
+SUMMARY_RELATIVE_ACCURACY = float(os.getenv("SUMMARY_RELATIVE_ACCURACY", "0.01"))
+SUMMARY_QUANTILES = os.getenv("SUMMARY_QUANTILES", "0.5,0.9,0.99")
+SUMMARY_APPROX_BUDGET_SECONDS = float(os.getenv("SUMMARY_APPROX_BUDGET_SECONDS", "1"))
+SUMMARY_APPROX_MAX_SAMPLES = int(os.getenv("SUMMARY_APPROX_MAX_SAMPLES", "100000"))
+SUMMARY_APPROX_CONFIDENCE = float(os.getenv("SUMMARY_APPROX_CONFIDENCE", "0.95"))
+
+# Chunk-parallel scanning of large files
+PARALLEL_SCAN_THRESHOLD = int(os.getenv("PARALLEL_SCAN_THRESHOLD", str(256 * 1024 * 1024)))
+PARALLEL_SCAN_WORKERS = int(os.getenv("PARALLEL_SCAN_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_SCAN_CHUNKS_PER_WORKER = int(os.getenv("PARALLEL_SCAN_CHUNKS_PER_WORKER", "4"))
+
+# File downloads: "" streams from Django, "X-Sendfile" or "X-Accel-Redirect"
+# delegate the transfer to the front-end web server.
+DOWNLOAD_SENDFILE_HEADER = os.getenv("DOWNLOAD_SENDFILE_HEADER", "")
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = os.getenv("DOWNLOAD_ACCEL_REDIRECT_PREFIX", "/protected-uploads/")
+
+# Coalescing of identical concurrent queries. When the lock directory is set,
+# results are also shared across worker processes through file locks.
+SINGLE_FLIGHT_LOCK_DIR = os.getenv("SINGLE_FLIGHT_LOCK_DIR", "")
+SINGLE_FLIGHT_MAX_SHARED_BYTES = int(os.getenv("SINGLE_FLIGHT_MAX_SHARED_BYTES", str(64 * 1024 * 1024)))
+
+# Number of resident bash workers used to run the scripts (0 starts a new
+# bash process per request)
+SCRIPT_COPROCESS_POOL_SIZE = int(os.getenv("SCRIPT_COPROCESS_POOL_SIZE", "0"))
+
+# Optional ingestion of the uploaded rows into PostgreSQL ("postgres" to enable)
+INGESTION_BACKEND = os.getenv("INGESTION_BACKEND", "")
+INGESTION_COPY_CHUNK_BYTES = int(os.getenv("INGESTION_COPY_CHUNK_BYTES", str(1024 * 1024)))
+
+# Chunk size used to copy the entries of bulk uploads to disk
+BULK_UPLOAD_CHUNK_BYTES = int(os.getenv("BULK_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+# Collection of soft-deleted files: files deleted for longer than the grace
+# period are removed with their indexes, every interval (0 disables the
+# periodic task; manage.py collect_deleted_files runs it on demand)
+DELETED_FILES_GRACE_SECONDS = float(os.getenv("DELETED_FILES_GRACE_SECONDS", str(7 * 24 * 3600)))
+DELETED_FILES_GC_INTERVAL_SECONDS = float(os.getenv("DELETED_FILES_GC_INTERVAL_SECONDS", "3600"))
+DELETED_FILES_GC_BATCH_SIZE = int(os.getenv("DELETED_FILES_GC_BATCH_SIZE", "500"))
+# Lifetime of the cached names of the alive files used by the query endpoints
+ALIVE_FILES_TTL_SECONDS = float(os.getenv("ALIVE_FILES_TTL_SECONDS", "5"))
+
+# Memory profiling of requests with tracemalloc: the sampled fraction of the
+# requests (0 disables sampling) and, when allowed, requests sent with an
+# X-Memory-Profile header; reports are written to MEMORY_PROFILE_DIR
+MEMORY_PROFILE_SAMPLE_RATE = float(os.getenv("MEMORY_PROFILE_SAMPLE_RATE", "0"))
+MEMORY_PROFILE_ALLOW_HEADER = os.getenv("MEMORY_PROFILE_ALLOW_HEADER", "").lower() in ("1", "true", "yes")
+MEMORY_PROFILE_DIR = os.getenv("MEMORY_PROFILE_DIR", os.path.join(BASE_DIR, "memory_profiles"))
+MEMORY_PROFILE_MAX_REPORTS = int(os.getenv("MEMORY_PROFILE_MAX_REPORTS", "500"))
+MEMORY_PROFILE_TOP = int(os.getenv("MEMORY_PROFILE_TOP", "10"))
+MEMORY_PROFILE_FRAMES = int(os.getenv("MEMORY_PROFILE_FRAMES", "1"))
+
+# External merge sort used to order files too large to sort in memory
+EXTERNAL_SORT_THRESHOLD = int(os.getenv("EXTERNAL_SORT_THRESHOLD", str(512 * 1024 * 1024)))
+EXTERNAL_SORT_RUN_BYTES = int(os.getenv("EXTERNAL_SORT_RUN_BYTES", str(64 * 1024 * 1024)))
+EXTERNAL_SORT_MAX_MERGE = int(os.getenv("EXTERNAL_SORT_MAX_MERGE", "64"))
+EXTERNAL_SORT_TMP_DIR = os.getenv("EXTERNAL_SORT_TMP_DIR", "")
+
+# OpenAPI document precomputed at build time (manage.py generate_swagger_schema).
+# When missing, it is generated on the first request and cached in the process.
+SWAGGER_SCHEMA_FILE = os.getenv("SWAGGER_SCHEMA_FILE", os.path.join(BASE_DIR, "swagger.json"))
+SWAGGER_SETTINGS = {
+    'SPEC_URL': 'schema-json',
+}
+
+# Maximum time, in seconds, for a fresh worker to answer its first list-files request
+COLD_START_BUDGET_SECONDS = float(os.getenv("COLD_START_BUDGET_SECONDS", "3"))
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get("SECRET_KEY")
 
@@ -34,10 +121,14 @@ INSTALLED_APPS = [
 
     # Apps
     'core',
-    'drf_yasg'
 ]
 
+# drf_yasg is not an installed app, so it is only imported with the first
+# documentation request; its templates and static files are found by path.
+DRF_YASG_DIR = os.path.dirname(importlib.util.find_spec('drf_yasg').origin)
+
 MIDDLEWARE = [
+    'core.profiling.MemoryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,7 +143,7 @@ ROOT_URLCONF = 'django_project.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        'DIRS': [os.path.join(DRF_YASG_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -118,6 +209,7 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
 STATIC_URL = 'static/'
+STATICFILES_DIRS = [os.path.join(DRF_YASG_DIR, 'static')]
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -1,27 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from django_project.schema import swagger_spec_view, swagger_ui_view
 
-from rest_framework.permissions import AllowAny
-
-
-schema_view = get_schema_view(
-   openapi.Info(
-      title="API de Teste",
-      default_version='v1',
-      description="Documentação da API",
-      terms_of_service="",
-      contact=openapi.Contact(email="contato@example.com"),
-      license=openapi.License(name="MIT License"),
-   ),
-   public=True,
-   permission_classes=(AllowAny,),
-)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('core.urls')),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('swagger.json', swagger_spec_view, name='schema-json'),
+    path('swagger/', swagger_ui_view, name='schema-swagger-ui'),
 ]
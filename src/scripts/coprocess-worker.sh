@@ -0,0 +1,25 @@
+#!/usr/bin/env bash
+
+# Worker residente: executa os scripts deste diretório sem iniciar um novo bash por requisição.
+#
+# Requisição (stdin), campos separados por NUL:
+#   QUANTIDADE_DE_CAMPOS SCRIPT ARQUIVO_STDOUT ARQUIVO_STDERR ARG1 ARG2 ...
+# Resposta (stdout): uma linha com o código de saída do script.
+
+SCRIPTS_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+while IFS= read -r -d '' count; do
+    fields=()
+    for ((i = 0; i < count; i++)); do
+        IFS= read -r -d '' field || exit 0
+        fields+=("$field")
+    done
+
+    script="${fields[0]}"
+    out_file="${fields[1]}"
+    err_file="${fields[2]}"
+
+    # O subshell isola "exit" e variáveis do script; o fork é bem mais barato que um novo bash.
+    ( set -- "${fields[@]:3}"; source "$SCRIPTS_DIR/$script" ) >"$out_file" 2>"$err_file" </dev/null
+    echo "$?"
+done
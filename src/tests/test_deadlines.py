@@ -0,0 +1,140 @@
+import os
+import subprocess
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.deadlines import Deadline, DeadlineExceeded, decode_cursor, encode_cursor
+from core.indexing import build_index, discard_index
+from core.models import StoredFile
+from core.parallel_scan import parallel_between_msgs, scan_between_msgs
+
+
+class CursorTestCase(TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("user1 inbox 000000001 size 000000001\n")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(self.file_path, 37), self.file_path), 37)
+
+    def test_stale_cursor(self):
+        cursor = encode_cursor(self.file_path, 37)
+        with open(self.file_path, "a") as f:
+            f.write("user2 inbox 000000002 size 000000002\n")
+        with self.assertRaises(ValueError):
+            decode_cursor(cursor, self.file_path)
+
+    def test_malformed_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor("not-a-cursor", self.file_path)
+
+
+def expired_deadline():
+    deadline = Deadline(1)
+    deadline.expires_at = 0
+    return deadline
+
+
+class ScanDeadlineTestCase(TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            for i in range(50):
+                f.write(f"user{i:02d} inbox {i % 7:09d} size {i:09d}\n")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_scan_resumes_where_it_stopped(self):
+        lines, resume_at = scan_between_msgs(self.file_path, 2, 3, expired_deadline())
+        self.assertEqual((lines, resume_at), ([], 0))
+
+        lines, resume_at = scan_between_msgs(self.file_path, 2, 3, Deadline(60), start=resume_at)
+        self.assertIsNone(resume_at)
+        self.assertEqual([line.split()[0] for line in lines], [f"user{i:02d}" for i in range(50) if 2 <= i % 7 <= 3])
+
+    @override_settings(PARALLEL_SCAN_WORKERS=2, PARALLEL_SCAN_CHUNKS_PER_WORKER=2, PARALLEL_SCAN_THRESHOLD=1)
+    def test_parallel_scan_stops_at_deadline(self):
+        with self.assertRaises(DeadlineExceeded):
+            parallel_between_msgs(self.file_path, 2, 3, expired_deadline())
+
+
+class QueryDeadlineViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "w") as f:
+            f.write("user2 inbox 000000100 size 000002000\n")
+            f.write("user1 inbox 000000050 size 000001000\n")
+            f.write("user3 inbox 000000200 size 000000500\n")
+        self.stored_file = StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        discard_index("test_file.txt")
+        os.remove(self.file_path)
+
+    @patch('core.views.run_script', side_effect=subprocess.TimeoutExpired('max-min-size.sh', 1))
+    def test_script_timeout_returns_504(self, mock_run_script):
+        response = self.client.get(reverse('max-min-size-list'), {"filename": "test_file.txt", "timeout": "1"})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertLessEqual(mock_run_script.call_args.kwargs["timeout"], 1)
+
+    def test_invalid_timeout(self):
+        for timeout in ("0", "-1", "abc", "nan"):
+            response = self.client.get(reverse('order-by-username-list'), {"filename": "test_file.txt", "timeout": timeout})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('core.views.Deadline', side_effect=lambda seconds: expired_deadline())
+    def test_partial_result_and_cursor(self, mock_deadline):
+        url = reverse('between-msgs-list')
+        response = self.client.get(url, {"filename": "test_file.txt", "low": "0", "high": "150", "partial": "1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["truncated"])
+
+        mock_deadline.side_effect = Deadline
+        response = self.client.get(url, {"filename": "test_file.txt", "low": "0", "high": "150",
+                                         "cursor": response.data["cursor"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data["truncated"])
+        self.assertIsNone(response.data["cursor"])
+        self.assertEqual([d["username"] for d in response.data["results"]], ["user2", "user1"])
+
+    @patch('core.views.Deadline', side_effect=lambda seconds: expired_deadline())
+    def test_lookup_without_partial_returns_504(self, mock_deadline):
+        response = self.client.get(reverse('lookup-username-list'), {"filename": "test_file.txt", "username": "user1"})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def test_stale_cursor(self):
+        response = self.client.get(reverse('between-msgs-list'), {"filename": "test_file.txt", "low": "0", "high": "1",
+                                                                 "cursor": "bogus"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('core.views.run_script')
+    def test_index_paths_stop_at_deadline(self, mock_run_script):
+        build_index(self.stored_file.pk)
+        requests = [
+            ('order-by-username-list', {}),
+            ('between-msgs-list', {"low": "0", "high": "150"}),
+            ('lookup-username-list', {"username": "user1"}),
+            ('query-list', {"where": "size > 0"}),
+        ]
+        with patch('core.views.Deadline', side_effect=lambda seconds: expired_deadline()):
+            for name, params in requests:
+                response = self.client.get(reverse(name), {"filename": "test_file.txt", **params})
+                self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT, name)
+        mock_run_script.assert_not_called()
+
+        response = self.client.get(reverse('order-by-username-list'), {"filename": "test_file.txt"})
+        self.assertEqual([d["username"] for d in response.data], ["user1", "user2", "user3"])
@@ -0,0 +1,128 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.diff import HASH_JOIN, MERGE_JOIN, diff_files
+from core.indexing import build_index
+from core.models import StoredFile
+
+
+OLD = [
+    "alice inbox 000000010 size 000001000",
+    "alice sent 000000005 size 000000500",
+    "bob inbox 000000020 size 000002000",
+    "carol inbox 000000030 size 000003000",
+]
+
+NEW = [
+    "alice inbox 000000012 size 000001000",
+    "bob inbox 000000020 size 000009000",
+    "bob sent 000000001 size 000000100",
+    "carol inbox 000000030 size 000003000",
+    "dave inbox 000000001 size 000000001",
+]
+
+
+class DiffFilesTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, lines):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w") as f:
+            f.write("".join(line + "\n" for line in lines))
+        return path
+
+    def summary(self, data):
+        return (
+            [(r["username"], r["folder"]) for r in data["added"]],
+            [(r["username"], r["folder"]) for r in data["removed"]],
+            [(r["username"], r["folder"], r["deltaMessages"], r["deltaSize"]) for r in data["changed"]],
+        )
+
+    def test_hash_join(self):
+        data = diff_files(self.write("old", OLD), self.write("new", NEW))
+        self.assertEqual(data["strategy"], HASH_JOIN)
+        self.assertEqual(self.summary(data), (
+            [("bob", "sent"), ("dave", "inbox")],
+            [("alice", "sent")],
+            [("alice", "inbox", 2, 0), ("bob", "inbox", 0, 7000)],
+        ))
+        self.assertEqual(data["summary"], {"added": 2, "removed": 1, "changed": 2, "unchanged": 1})
+
+    def test_either_file_can_be_hashed(self):
+        old_path, new_path = self.write("old", OLD), self.write("new", NEW)
+        larger_old_path = self.write("old_larger", OLD + ["zed junk line"] * 100)
+        self.assertLess(os.path.getsize(old_path), os.path.getsize(new_path))
+        self.assertGreater(os.path.getsize(larger_old_path), os.path.getsize(new_path))
+        self.assertEqual(self.summary(diff_files(old_path, new_path)),
+                         self.summary(diff_files(larger_old_path, new_path)))
+
+    def test_merge_join_matches_hash_join(self):
+        old_path, new_path = self.write("old", OLD), self.write("new", NEW)
+        merged = diff_files(old_path, new_path, sorted_inputs=True)
+        self.assertEqual(merged["strategy"], MERGE_JOIN)
+        self.assertEqual(merged["changed"], diff_files(old_path, new_path)["changed"])
+        self.assertEqual(self.summary(merged), self.summary(diff_files(old_path, new_path)))
+
+    def test_merge_join_falls_back_on_unsorted_files(self):
+        old_path, new_path = self.write("old", OLD), self.write("new", list(reversed(NEW)))
+        data = diff_files(old_path, new_path, sorted_inputs=True)
+        self.assertEqual(data["strategy"], HASH_JOIN)
+        self.assertEqual(self.summary(data), self.summary(diff_files(old_path, self.write("new2", NEW))))
+
+    def test_thresholds(self):
+        data = diff_files(self.write("old", OLD), self.write("new", NEW), min_messages_change=5, min_size_change=5000)
+        self.assertEqual([r["username"] for r in data["changed"]], ["bob"])
+        self.assertEqual(data["summary"]["unchanged"], 2)
+
+
+class DiffFilesViewSetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(INDEX_DIR=self.index_dir.name)
+        self.override.enable()
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        for name, lines in (("old.txt", OLD), ("new.txt", NEW)):
+            with open(os.path.join(settings.UPLOAD_DIR, name), "w") as f:
+                f.write("".join(line + "\n" for line in lines))
+        self.stored_files = [StoredFile.objects.create(filename=name) for name in ("old.txt", "new.txt")]
+
+    def tearDown(self):
+        for name in ("old.txt", "new.txt"):
+            os.remove(os.path.join(settings.UPLOAD_DIR, name))
+        self.override.disable()
+        self.index_dir.cleanup()
+
+    def diff(self, **params):
+        return self.client.get(reverse('diff-files-list'), {"old": "old.txt", "new": "new.txt", **params})
+
+    def test_diff(self):
+        response = self.diff()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["strategy"], HASH_JOIN)
+        self.assertEqual(response.data["summary"]["changed"], 2)
+
+    def test_sorted_files_are_merge_joined(self):
+        for stored_file in self.stored_files:
+            build_index(stored_file.pk)
+        response = self.diff()
+        self.assertEqual(response.data["strategy"], MERGE_JOIN)
+        self.assertEqual(response.data["summary"]["changed"], 2)
+
+    def test_missing_file(self):
+        response = self.client.get(reverse('diff-files-list'), {"old": "old.txt", "new": "missing.txt"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_threshold(self):
+        self.assertEqual(self.diff(min_size_change="big").status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,129 @@
+import json
+import os
+import random
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.external_sort import external_sort
+from core.indexing import build_index
+from core.models import StoredFile
+from core.scripts_runner import run_script
+
+
+class ExternalSortTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        rng = random.Random(3)
+        self.lines = [
+            f"user{rng.randint(0, 30):02d} folder{i} {i:09d} size {rng.randint(0, 999):09d}\n".encode()
+            for i in range(200)
+        ]
+        self.file_path = os.path.join(self.tmp_dir.name, "input")
+        with open(self.file_path, "wb") as f:
+            f.writelines(self.lines)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def sort(self, desc):
+        return list(external_sort(self.file_path, desc=desc, run_bytes=256, tmp_dir=self.tmp_dir.name, max_merge=3))
+
+    def test_matches_in_memory_sort(self):
+        key = lambda line: (line.split()[0], line)
+        self.assertEqual(self.sort(desc=False), sorted(self.lines, key=key))
+        self.assertEqual(self.sort(desc=True), sorted(self.lines, key=key, reverse=True))
+
+    def test_runs_are_removed(self):
+        self.sort(desc=False)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["input"])
+
+    def test_runs_are_removed_when_abandoned(self):
+        rows = external_sort(self.file_path, run_bytes=256, tmp_dir=self.tmp_dir.name, max_merge=3)
+        next(rows)
+        rows.close()
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["input"])
+
+
+@override_settings(EXTERNAL_SORT_THRESHOLD=1, EXTERNAL_SORT_RUN_BYTES=40)
+class OrderByUsernameStreamingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "w") as f:
+            f.write("user3 inbox 000000010 size 000000500\n")
+            f.write("user1 inbox 000000050 size 000001000\n")
+            f.write("user2 inbox 000000020 size 000000700\n")
+        StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def get(self, params):
+        response = self.client.get(reverse('order-by-username-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_streamed_order(self):
+        usernames = [row["username"] for row in self.get({"filename": "test_file.txt", "desc": "1"})]
+        self.assertEqual(usernames, ["user3", "user2", "user1"])
+
+    def test_streamed_filter(self):
+        rows = self.get({"filename": "test_file.txt", "username": "1"})
+        self.assertEqual(rows, [{"username": "user1", "folder": "inbox", "numberMessages": 50, "size": 1000}])
+
+
+class UsernameTiesTestCase(TestCase):
+    """
+    Rows with the same username are ordered the same way by every path.
+    """
+    def setUp(self):
+        self.client = APIClient()
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(INDEX_DIR=self.index_dir.name)
+        self.override.enable()
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "w") as f:
+            f.write("user2 inbox 000000100 size 000002000\n")
+            f.write("user1 sent 000000007 size 000002000\n")
+            f.write("user1 inbox 000000050 size 000001000\n")
+            f.write("user1 archive 000000001 size 000000010\n")
+        self.stored_file = StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+        self.override.disable()
+        self.index_dir.cleanup()
+
+    def folders(self, params):
+        response = self.client.get(reverse('order-by-username-list'), {"filename": "test_file.txt", **params})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(b"".join(response.streaming_content)) if response.streaming else response.data
+        return [row["folder"] for row in data]
+
+    def test_every_path_breaks_ties_like_the_script(self):
+        expected = {}
+        for args in ([], ["-desc"]):
+            output, _ = run_script('order-by-username.sh', [self.file_path] + args)
+            expected[bool(args)] = [line.split()[1] for line in output.split("\n")]
+        self.assertEqual(expected[True], ["inbox", "sent", "inbox", "archive"])
+
+        def check(path):
+            self.assertEqual(self.folders({}), expected[False], path)
+            self.assertEqual(self.folders({"desc": "1"}), expected[True], path)
+
+        check("script")
+        with override_settings(EXTERNAL_SORT_THRESHOLD=1, EXTERNAL_SORT_RUN_BYTES=40):
+            check("external sort")
+        build_index(self.stored_file.pk)
+        check("index")
+        with override_settings(EXTERNAL_SORT_THRESHOLD=1), patch('core.views.external_sort') as mock_external_sort:
+            check("streamed index")
+        mock_external_sort.assert_not_called()
@@ -0,0 +1,134 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.filters import Filter, FilterError, filter_lines, parse_order, shape_rows
+from core.indexing import DerivedIndex, build_index
+from core.models import StoredFile
+from core.parallel_scan import scan_filter
+
+
+LINES = [
+    b"user2 inbox 000000100 size 000002000\n",
+    b"user1 inbox 000000050 size 000001000\n",
+    b"user3 sent 000000200 size 000000500\n",
+    b"user1 sent 000000007 size 000003000\n",
+    b"broken line\n",
+]
+
+
+class FilterTestCase(SimpleTestCase):
+    def usernames(self, expression, limit=None):
+        return [row[0] for row in filter_lines(LINES, Filter(expression), limit)]
+
+    def test_expressions(self):
+        self.assertEqual(self.usernames('size > 1000'), [b"user2", b"user1"])
+        self.assertEqual(self.usernames('numberMessages >= 50 AND numberMessages <= 100'), [b"user2", b"user1"])
+        self.assertEqual(self.usernames('username = "user1" AND folder contains "se"'), [b"user1"])
+        self.assertEqual(self.usernames('folder = "sent" or size = 1000'), [b"user1", b"user3", b"user1"])
+        self.assertEqual(self.usernames('(size < 600 OR size > 2500) AND username != "user3"'), [b"user1"])
+        self.assertEqual(self.usernames(''), [b"user2", b"user1", b"user3", b"user1"])
+        self.assertEqual(self.usernames('size > 0', limit=2), [b"user2", b"user1"])
+
+    def test_invalid_expressions(self):
+        for expression in ('size >', 'size > "1"', 'username > "a"', 'color = "red"', '(size > 1',
+                           'size > 1 size', 'size ~ 1', 'username = user1'):
+            with self.assertRaises(FilterError, msg=expression):
+                Filter(expression)
+
+    def test_analysis(self):
+        flt = Filter('username = "user1" AND numberMessages > 10 AND numberMessages <= 20')
+        self.assertEqual(flt.usernames, {"user1"})
+        self.assertEqual(flt.messages_bounds, (11, 20))
+        self.assertFalse(flt.is_numeric)
+
+        flt = Filter('numberMessages < 5 OR numberMessages = 9')
+        self.assertIsNone(flt.usernames)
+        self.assertEqual(flt.messages_bounds, (None, 9))
+        self.assertTrue(flt.is_numeric)
+
+        self.assertIsNone(Filter('numberMessages < 5 OR size = 9').messages_bounds)
+        self.assertEqual(Filter('username = "a" OR username = "b"').usernames, {"a", "b"})
+
+    def test_shape_rows(self):
+        rows = filter_lines(LINES, Filter())
+        self.assertEqual(shape_rows(rows, ["username", "size"], *parse_order("-size"), limit=2), [
+            {"username": "user1", "size": 3000},
+            {"username": "user2", "size": 2000},
+        ])
+        self.assertEqual([row["numberMessages"] for row in shape_rows(rows, ["numberMessages"], "numberMessages")],
+                         [7, 50, 100, 200])
+        with self.assertRaises(FilterError):
+            parse_order("color")
+
+
+class FilterPushdownTestCase(TestCase):
+    def setUp(self):
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "wb") as f:
+            f.write(b"".join(LINES))
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_index_and_scan_agree(self):
+        index = DerivedIndex.build(self.file_path)
+        for expression in ('size > 1000', 'numberMessages > 10 AND numberMessages < 150', 'username = "user1"',
+                           'username = "user1" AND size < 2000', 'folder contains "in" OR size = 500', ''):
+            flt = Filter(expression)
+            for limit in (None, 1):
+                self.assertEqual(index.filter_rows(self.file_path, flt, limit),
+                                 scan_filter(self.file_path, flt, limit), expression)
+
+
+class QueryViewSetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.query_url = reverse('query-list')
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(INDEX_DIR=self.index_dir.name)
+        self.override.enable()
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "wb") as f:
+            f.write(b"".join(LINES))
+        self.stored_file = StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+        self.override.disable()
+        self.index_dir.cleanup()
+
+    def query(self, **params):
+        return self.client.get(self.query_url, {"filename": "test_file.txt", **params})
+
+    def test_query(self):
+        params = {"where": 'size >= 1000 AND folder = "inbox" OR username = "user3"',
+                  "fields": "username,size", "order": "-size", "limit": "2"}
+        response = self.query(**params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{"username": "user2", "size": 2000}, {"username": "user1", "size": 1000}])
+
+        build_index(self.stored_file.pk)
+        self.assertEqual(self.query(**params).data, response.data)
+
+    def test_query_in_file_order(self):
+        response = self.query(where='numberMessages < 100', limit=1)
+        self.assertEqual(response.data, [{"username": "user1", "folder": "inbox", "numberMessages": 50, "size": 1000}])
+
+    def test_invalid_params(self):
+        for params in ({"where": "size >"}, {"fields": "color"}, {"order": "-color"}, {"limit": "0"}):
+            response = self.query(**params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        self.assertIn("detail", self.query(where="size >").data)
+
+    def test_unknown_file(self):
+        response = self.client.get(self.query_url, {"filename": "missing.txt"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,243 @@
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.urls import reverse
+from django.test import TestCase, override_settings
+from django.conf import settings
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.indexing import DerivedIndex, PackedIndex, build_index, get_ready_index, index_path_for, load_index
+from core.models import StoredFile, FileIndex
+
+
+class IndexTestMixin:
+    def setUp(self):
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(INDEX_DIR=self.index_dir.name)
+        self.override.enable()
+
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "w") as f:
+            f.write("user2 inbox 000000100 size 000002000\n")
+            f.write("user1 inbox 000000050 size 000001000\n")
+            f.write("user3 inbox 000000200 size 000000500\n")
+        self.stored_file = StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+        self.override.disable()
+        self.index_dir.cleanup()
+
+
+class DerivedIndexTestCase(IndexTestMixin, TestCase):
+    def test_queries(self):
+        index = DerivedIndex.build(self.file_path)
+        self.assertEqual(index.max_min(self.file_path), "user2 inbox 000000100 size 000002000")
+        self.assertEqual(index.max_min(self.file_path, smallest=True), "user3 inbox 000000200 size 000000500")
+        self.assertEqual(
+            [line.split()[0] for line in index.ordered_by_username(self.file_path)],
+            ["user1", "user2", "user3"]
+        )
+        self.assertEqual(
+            [line.split()[0] for line in index.ordered_by_username(self.file_path, desc=True)],
+            ["user3", "user2", "user1"]
+        )
+        self.assertEqual(
+            [line.split()[0] for line in index.between_msgs(self.file_path, 50, 150)],
+            ["user2", "user1"]
+        )
+
+    def test_stale_index_is_ignored(self):
+        DerivedIndex.build(self.file_path).save(index_path_for("test_file.txt"))
+        self.assertIsNotNone(get_ready_index("test_file.txt", self.file_path))
+
+        with open(self.file_path, "a") as f:
+            f.write("user4 inbox 000000001 size 000000001\n")
+        self.assertIsNone(get_ready_index("test_file.txt", self.file_path))
+
+    def test_stale_index_is_rebuilt(self):
+        DerivedIndex.build(self.file_path).save(index_path_for("test_file.txt"))
+        with open(self.file_path, "a") as f:
+            f.write("user4 inbox 000000001 size 000000001\n")
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertIsNone(get_ready_index("test_file.txt", self.file_path))
+            self.assertIsNone(get_ready_index("test_file.txt", self.file_path))
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(FileIndex.objects.get(stored_file=self.stored_file).state, FileIndex.PENDING)
+
+        build_index(self.stored_file.pk)
+        index = get_ready_index("test_file.txt", self.file_path)
+        self.assertEqual(index.max_min(self.file_path, smallest=True), "user4 inbox 000000001 size 000000001")
+
+    @patch.dict('core.indexing._rebuilds', clear=True)
+    def test_lost_pending_build_is_scheduled_again(self):
+        FileIndex.objects.create(stored_file=self.stored_file, state=FileIndex.PENDING)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertIsNone(get_ready_index("test_file.txt", self.file_path))
+        self.assertEqual(len(callbacks), 0)
+
+        # The process that queued the build is gone: the row is never updated
+        # again, and a new process has not looked at the file yet.
+        FileIndex.objects.update(updated_at=timezone.now() - timedelta(seconds=settings.INDEX_BUILD_STALE_SECONDS + 1))
+        with patch.dict('core.indexing._rebuilds', clear=True), self.captureOnCommitCallbacks() as callbacks:
+            self.assertIsNone(get_ready_index("test_file.txt", self.file_path))
+        self.assertEqual(len(callbacks), 1)
+
+        build_index(self.stored_file.pk)
+        self.assertIsNotNone(get_ready_index("test_file.txt", self.file_path))
+
+    def test_build_index_records_status(self):
+        build_index(self.stored_file.pk)
+        file_index = FileIndex.objects.get(stored_file=self.stored_file)
+        self.assertEqual(file_index.state, FileIndex.READY)
+        self.assertIsNotNone(file_index.built_at)
+        self.assertEqual(file_index.size, os.path.getsize(index_path_for("test_file.txt")))
+
+    @override_settings(INDEX_BUILD_PROCESS_THRESHOLD=1)
+    def test_build_index_in_a_separate_process(self):
+        build_index(self.stored_file.pk)
+        self.assertEqual(FileIndex.objects.get(stored_file=self.stored_file).state, FileIndex.READY)
+        index = load_index(index_path_for("test_file.txt"))
+        self.assertEqual(index.ordered_by_username(self.file_path, desc=True),
+                         DerivedIndex.build(self.file_path).ordered_by_username(self.file_path, desc=True))
+
+
+class PackedIndexTestCase(IndexTestMixin, TestCase):
+    def test_same_results_as_derived_index(self):
+        with open(self.file_path, "a") as f:
+            f.write("user1 sent 000000007 size 000000070\n")
+        index = DerivedIndex.build(self.file_path)
+        buffer = io.BytesIO()
+        index.write_packed(buffer)
+        packed = PackedIndex(buffer.getvalue())
+
+        self.assertTrue(packed.is_fresh(self.file_path))
+        for smallest in (False, True):
+            self.assertEqual(packed.max_min(self.file_path, smallest), index.max_min(self.file_path, smallest))
+        for desc in (False, True):
+            self.assertEqual(packed.ordered_by_username(self.file_path, desc),
+                             index.ordered_by_username(self.file_path, desc))
+        self.assertEqual(packed.between_msgs(self.file_path, 50, 150), index.between_msgs(self.file_path, 50, 150))
+        usernames = ["user1", "user3", "user0", "user9"]
+        self.assertEqual(packed.lookup_usernames(self.file_path, usernames),
+                         index.lookup_usernames(self.file_path, usernames))
+
+    def test_sidecar_round_trip(self):
+        index = DerivedIndex.build(self.file_path)
+        index.save(index_path_for("test_file.txt"))
+        packed = load_index(index_path_for("test_file.txt"))
+        self.assertIsInstance(packed, PackedIndex)
+        self.assertEqual(packed.source_digest, index.source_digest)
+        self.assertEqual(packed.ordered_by_username(self.file_path), index.ordered_by_username(self.file_path))
+
+    def test_corrupted_sidecar_is_rejected(self):
+        buffer = io.BytesIO()
+        DerivedIndex.build(self.file_path).write_packed(buffer)
+        data = bytearray(buffer.getvalue())
+        with self.assertRaises(ValueError):
+            PackedIndex(bytes(data[:-1]))
+        data[20] ^= 0xff
+        with self.assertRaises(ValueError):
+            PackedIndex(bytes(data))
+
+    def test_empty_file(self):
+        open(self.file_path, "w").close()
+        buffer = io.BytesIO()
+        DerivedIndex.build(self.file_path).write_packed(buffer)
+        packed = PackedIndex(buffer.getvalue())
+        self.assertEqual(packed.max_min(self.file_path), '')
+        self.assertEqual(packed.lookup_usernames(self.file_path, ["user1"]), {"user1": []})
+
+    def test_index_maps_the_sidecar(self):
+        build_index(self.stored_file.pk)
+        index = get_ready_index("test_file.txt", self.file_path)
+        self.assertIsInstance(index, PackedIndex)
+        self.assertIs(get_ready_index("test_file.txt", self.file_path), index)
+        self.assertEqual(index.max_min(self.file_path, smallest=True), "user3 inbox 000000200 size 000000500")
+        with open("/proc/self/maps") as f:
+            self.assertIn(os.path.realpath(index_path_for("test_file.txt")), f.read())
+
+        # A rebuilt sidecar is mapped again.
+        os.utime(index_path_for("test_file.txt"), ns=(0, 0))
+        self.assertIsNot(get_ready_index("test_file.txt", self.file_path), index)
+
+
+class IndexStatusViewSetTestCase(IndexTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.status_url = reverse('index-status-list')
+
+    def test_index_status(self):
+        build_index(self.stored_file.pk)
+        response = self.client.get(self.status_url, {"filename": "test_file.txt"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["state"], FileIndex.READY)
+
+    def test_index_status_unknown_file(self):
+        response = self.client.get(self.status_url, {"filename": "missing.txt"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_query_uses_ready_index(self):
+        build_index(self.stored_file.pk)
+        response = self.client.get(reverse('max-min-size-list'), {"filename": "test_file.txt", "min": "true"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["username"], "user3")
+
+
+class LookupUsernameViewSetTestCase(IndexTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        with open(self.file_path, "a") as f:
+            f.write("user1 sent 000000007 size 000000070\n")
+        self.client = APIClient()
+        self.lookup_url = reverse('lookup-username-list')
+
+    def lookup(self, usernames):
+        response = self.client.get(self.lookup_url, {"filename": "test_file.txt", "username": usernames})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def assert_lookup(self):
+        data = self.lookup(["user1", "user3", "nobody"])
+        self.assertEqual([row["folder"] for row in data["user1"]], ["inbox", "sent"])
+        self.assertEqual(data["user3"][0]["numberMessages"], 200)
+        self.assertEqual(data["nobody"], [])
+
+    def test_lookup_with_index(self):
+        build_index(self.stored_file.pk)
+        self.assertIsNotNone(get_ready_index("test_file.txt", self.file_path))
+        self.assert_lookup()
+
+    def test_lookup_without_index(self):
+        self.assert_lookup()
+
+    def test_exact_match_only(self):
+        self.assertEqual(self.lookup(["user"]), {"user": []})
+
+    def test_unicode_whitespace_and_unparseable_rows(self):
+        with open(self.file_path, "ab") as f:
+            f.write("us\u00a0er inbox 000000001 size 000000001\n".encode())
+            f.write("us\u0085er inbox 000000002 size 000000002\n".encode())
+            f.write(b"user1 broken\n")
+        usernames = ["us\u00a0er", "us\u0085er", "user1"]
+        expected = self.lookup(usernames)
+        self.assertEqual(sorted(expected), sorted(usernames))
+        self.assertEqual([row["folder"] for row in expected["user1"]], ["inbox", "sent"])
+
+        build_index(self.stored_file.pk)
+        self.assertEqual(self.lookup(usernames), expected)
+
+    @override_settings(LOOKUP_MAX_USERNAMES=1)
+    def test_too_many_usernames(self):
+        response = self.client.get(self.lookup_url, {"filename": "test_file.txt", "username": ["user1", "user2"]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
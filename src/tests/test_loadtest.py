@@ -0,0 +1,68 @@
+import os
+import random
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+
+from core.loadtest import LoadTest, generate_mailbox_lines, parse_mix, percentile
+from core.models import StoredFile
+from core.scripts_runner import parse_line_to_dict
+
+
+class LoadTestHelpersTestCase(SimpleTestCase):
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("list-files=4,max-min-size"), {"list-files": 4.0, "max-min-size": 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix("unknown=1")
+        with self.assertRaises(ValueError):
+            parse_mix("list-files=0")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_generated_lines_are_parseable(self):
+        for line in generate_mailbox_lines(20, random.Random(1)):
+            data = parse_line_to_dict(line)
+            self.assertEqual(data["folder"], "inbox")
+
+    def test_build_report(self):
+        load_test = LoadTest("http://127.0.0.1:8000", {"list-files": 1, "between-msgs": 1})
+        load_test._latencies["list-files"] = [0.010, 0.020, 0.030, 0.040]
+        load_test._errors["between-msgs"] = 2
+        report = load_test.build_report(2.0)
+
+        self.assertEqual(report["requests"], 6)
+        self.assertEqual(report["throughput"], 3.0)
+        self.assertAlmostEqual(report["error_rate"], 2 / 6)
+        self.assertEqual(report["endpoints"]["list-files"]["p50_ms"], 20.0)
+        self.assertEqual(report["endpoints"]["between-msgs"]["error_rate"], 1.0)
+        self.assertIsNone(report["endpoints"]["between-msgs"]["p99_ms"])
+
+
+class LoadTestTeardownTestCase(TestCase):
+    def setUp(self):
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        self.filenames = ["loadtest-0.txt", "loadtest-1.txt", "other.txt"]
+        for filename in self.filenames:
+            with open(os.path.join(settings.UPLOAD_DIR, filename), "w") as f:
+                f.write("user1 inbox 000000001 size 000000001\n")
+            StoredFile.objects.create(filename=filename)
+
+    def tearDown(self):
+        for filename in self.filenames:
+            try:
+                os.remove(os.path.join(settings.UPLOAD_DIR, filename))
+            except FileNotFoundError:
+                pass
+
+    def test_teardown_removes_the_generated_files(self):
+        LoadTest("http://127.0.0.1:8000", {"list-files": 1}, files=2).teardown()
+
+        self.assertEqual(list(StoredFile.objects.values_list("filename", flat=True)), ["other.txt"])
+        remaining = [filename for filename in self.filenames
+                     if os.path.exists(os.path.join(settings.UPLOAD_DIR, filename))]
+        self.assertEqual(remaining, ["other.txt"])
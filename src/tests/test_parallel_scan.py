@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from core.parallel_scan import split_ranges, parallel_max_min, parallel_between_msgs, should_scan_in_parallel
+
+
+@override_settings(PARALLEL_SCAN_WORKERS=2, PARALLEL_SCAN_CHUNKS_PER_WORKER=2, PARALLEL_SCAN_THRESHOLD=1)
+class ParallelScanTestCase(TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            for i in range(50):
+                f.write(f"user{i:02d} inbox {i % 7:09d} size {(i * 37) % 101:09d}\n")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_split_ranges_are_line_aligned(self):
+        with open(self.file_path, "rb") as f:
+            content = f.read()
+        ranges = split_ranges(self.file_path, 4)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(content))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(content[start - 1:start], b"\n")
+
+    def test_max_min_matches_sequential_scan(self):
+        sizes = [(i * 37) % 101 for i in range(50)]
+        self.assertEqual(parallel_max_min(self.file_path).split()[0], f"user{sizes.index(max(sizes)):02d}")
+        self.assertEqual(parallel_max_min(self.file_path, smallest=True).split()[0], f"user{sizes.index(min(sizes)):02d}")
+
+    def test_between_msgs_keeps_file_order(self):
+        lines = parallel_between_msgs(self.file_path, 2, 3)
+        self.assertEqual([line.split()[0] for line in lines], [f"user{i:02d}" for i in range(50) if 2 <= i % 7 <= 3])
+
+    def test_threshold(self):
+        self.assertTrue(should_scan_in_parallel(self.file_path))
+        with override_settings(PARALLEL_SCAN_THRESHOLD=10 ** 12):
+            self.assertFalse(should_scan_in_parallel(self.file_path))
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import tracemalloc
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import StoredFile
+from core.profiling import PROFILE_ID_HEADER, load_reports, summarize_reports
+
+
+class MemoryProfilingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEMORY_PROFILE_DIR=self.profile_dir.name, MEMORY_PROFILE_ALLOW_HEADER=True)
+        self.override.enable()
+
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "w") as f:
+            f.write("user2 inbox 000000100 size 000002000\n")
+            f.write("user1 inbox 000000050 size 000001000\n")
+        StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+        self.override.disable()
+        self.profile_dir.cleanup()
+
+    def test_profiled_request(self):
+        response = self.client.get(reverse('between-msgs-list'), {"filename": "test_file.txt", "low": 0, "high": 100},
+                                   HTTP_X_MEMORY_PROFILE="1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        report_id = response[PROFILE_ID_HEADER]
+        report = self.client.get(reverse('memory-profiles-detail', args=[report_id])).data
+        self.assertEqual(report["path"], "/api/between-msgs/")
+        phases = [phase["phase"] for phase in report["phases"]]
+        self.assertEqual(phases[0], "request")
+        self.assertEqual(phases[-2:], ["view", "render"])
+        self.assertIn("view.script", phases)
+        self.assertIn("view.parse", phases)
+        self.assertGreaterEqual(report["peak_bytes"], max(phase["peak_bytes"] for phase in report["phases"]))
+
+        summary = self.client.get(reverse('memory-profiles-list'), {"path": "/api/between-msgs/"}).data
+        self.assertEqual(summary["latest"], [report_id])
+        self.assertEqual(summary["paths"][0]["reports"], 1)
+        self.assertEqual(summary["paths"][0]["worst"]["id"], report_id)
+
+    @override_settings(EXTERNAL_SORT_THRESHOLD=1)
+    def test_profiled_stream(self):
+        response = self.client.get(reverse('order-by-username-list'), {"filename": "test_file.txt"},
+                                   HTTP_X_MEMORY_PROFILE="1")
+        b"".join(response.streaming_content)
+        response.close()
+        self.assertFalse(tracemalloc.is_tracing())
+        reports = load_reports("/api/order-by-username/")
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]["phases"][-1]["phase"], "stream")
+
+    def test_requests_are_not_profiled_by_default(self):
+        with override_settings(MEMORY_PROFILE_ALLOW_HEADER=False):
+            response = self.client.get(reverse('list-files-list'), HTTP_X_MEMORY_PROFILE="1")
+        self.assertNotIn(PROFILE_ID_HEADER, response)
+        self.assertEqual(load_reports(), [])
+
+    @override_settings(MEMORY_PROFILE_MAX_REPORTS=2)
+    def test_old_reports_are_removed(self):
+        for _ in range(3):
+            self.client.get(reverse('list-files-list'), HTTP_X_MEMORY_PROFILE="1")
+        self.assertEqual(len(load_reports()), 2)
+
+    def test_unknown_profile(self):
+        response = self.client.get(reverse('memory-profiles-detail', args=["missing"]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_summary_does_not_count_nested_sites_twice(self):
+        site = {"site": "views.py:1", "size_diff": 100, "count_diff": 1}
+        reports = [{"id": "1", "path": "/p/", "peak_bytes": 100, "phases": [
+            {"phase": "view.parse", "peak_bytes": 100, "top": [site]},
+            {"phase": "view", "peak_bytes": 100, "top": [site]},
+        ]}]
+        summary = summarize_reports(reports)[0]
+        self.assertEqual(summary["top_sites"], [{"site": "views.py:1", "size_diff": 100}])
+        self.assertEqual(summary["phase_peak_bytes"], {"view.parse": 100, "view": 100})
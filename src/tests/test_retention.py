@@ -0,0 +1,108 @@
+import io
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.indexing import build_index, index_path_for
+from core.models import StoredFile, FileIndex
+from core.retention import collect_deleted_files, resolve_file
+
+
+class CollectDeletedFilesTestCase(TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(INDEX_DIR=self.index_dir.name)
+        self.override.enable()
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+
+        self.stored_files = {}
+        for name in ("old.txt", "recent.txt", "alive.txt"):
+            with open(os.path.join(settings.UPLOAD_DIR, name), "w") as f:
+                f.write("user1 inbox 000000050 size 000001000\n")
+            self.stored_files[name] = StoredFile.objects.create(filename=name)
+            build_index(self.stored_files[name].pk)
+
+        now = timezone.now()
+        written_at = (now - timedelta(days=31)).timestamp()
+        os.utime(os.path.join(settings.UPLOAD_DIR, "old.txt"), (written_at, written_at))
+        StoredFile.objects.filter(filename="old.txt").update(deleted_at=now - timedelta(days=30))
+        StoredFile.objects.filter(filename="recent.txt").update(deleted_at=now)
+
+    def tearDown(self):
+        for name in ("old.txt", "recent.txt", "alive.txt"):
+            path = os.path.join(settings.UPLOAD_DIR, name)
+            if os.path.exists(path):
+                os.remove(path)
+        self.override.disable()
+        self.index_dir.cleanup()
+
+    def test_collects_files_past_the_grace_period(self):
+        self.assertEqual(collect_deleted_files(grace_seconds=24 * 3600, batch_size=1), 1)
+
+        self.assertFalse(StoredFile.objects.filter(filename="old.txt").exists())
+        self.assertFalse(FileIndex.objects.filter(stored_file_id=self.stored_files["old.txt"].pk).exists())
+        self.assertFalse(os.path.exists(os.path.join(settings.UPLOAD_DIR, "old.txt")))
+        self.assertFalse(os.path.exists(index_path_for("old.txt")))
+
+        for name in ("recent.txt", "alive.txt"):
+            self.assertTrue(StoredFile.objects.filter(filename=name).exists())
+            self.assertTrue(os.path.exists(os.path.join(settings.UPLOAD_DIR, name)))
+            self.assertTrue(os.path.exists(index_path_for(name)))
+
+    def test_keeps_content_uploaded_after_the_deletion(self):
+        os.utime(os.path.join(settings.UPLOAD_DIR, "old.txt"))
+
+        self.assertEqual(collect_deleted_files(grace_seconds=24 * 3600), 1)
+        self.assertTrue(os.path.exists(os.path.join(settings.UPLOAD_DIR, "old.txt")))
+        self.assertTrue(os.path.exists(index_path_for("old.txt")))
+
+    def test_management_command(self):
+        out = io.StringIO()
+        call_command('collect_deleted_files', '--grace-seconds', '0', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "2 deleted files collected")
+        self.assertEqual(list(StoredFile.objects.values_list('filename', flat=True)), ["alive.txt"])
+
+    def test_deleted_files_are_not_queried(self):
+        self.assertIsNone(resolve_file("recent.txt"))
+        self.assertEqual(resolve_file("alive.txt"), os.path.join(settings.UPLOAD_DIR, "alive.txt"))
+
+        client = APIClient()
+        response = client.get(reverse('max-min-size-list'), {"filename": "recent.txt"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.stored_files["alive.txt"].delete()
+        response = client.get(reverse('max-min-size-list'), {"filename": "alive.txt"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_content_is_not_found(self):
+        os.remove(os.path.join(settings.UPLOAD_DIR, "alive.txt"))
+        # The registry does not look at the upload directory: the views do, when they open the file.
+        self.assertIsNotNone(resolve_file("alive.txt"))
+
+        client = APIClient()
+        for name, params in (('summary-list', {"filename": "alive.txt"}),
+                             ('summary-list', {"filename": "alive.txt", "approximate": "1"}),
+                             ('diff-files-list', {"old": "alive.txt", "new": "alive.txt"}),
+                             ('max-min-size-list', {"filename": "alive.txt"}),
+                             ('order-by-username-list', {"filename": "alive.txt"}),
+                             ('between-msgs-list', {"filename": "alive.txt", "low": "0", "high": "10"}),
+                             ('lookup-username-list', {"filename": "alive.txt", "username": "user1"}),
+                             ('query-list', {"filename": "alive.txt"})):
+            self.assertEqual(client.get(reverse(name), params).status_code, status.HTTP_404_NOT_FOUND, (name, params))
+
+    def test_upload_restores_deleted_file(self):
+        client = APIClient()
+        response = client.put(f"{reverse('upload-file-upload-file')}?filename=recent.txt",
+                              data=b"user2 inbox 000000001 size 000000001\n", content_type='text/plain')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(StoredFile.objects.get(filename="recent.txt").deleted_at)
+        self.assertIsNotNone(resolve_file("recent.txt"))
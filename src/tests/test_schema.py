@@ -0,0 +1,61 @@
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from core.coldstart import measure_cold_start
+
+
+class SwaggerSchemaTestCase(TestCase):
+    def test_spec_is_generated(self):
+        with override_settings(SWAGGER_SCHEMA_FILE="/nonexistent/swagger.json"):
+            response = self.client.get('/swagger.json')
+        self.assertEqual(response.status_code, 200)
+        spec = json.loads(response.content)
+        self.assertIn('/list-files/', spec['paths'])
+
+    def test_precomputed_spec_is_served(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as f:
+            f.write(b'{"swagger": "2.0"}')
+            f.flush()
+            with override_settings(SWAGGER_SCHEMA_FILE=f.name):
+                response = self.client.get('/swagger.json')
+                self.assertEqual(b"".join(response.streaming_content), b'{"swagger": "2.0"}')
+
+    def test_swagger_ui(self):
+        response = self.client.get('/swagger/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_spec_has_the_view_annotations(self):
+        response = self.client.get('/swagger.json')
+        operation = json.loads(response.content)['paths']['/lookup-username/']['get']
+        self.assertEqual(operation['summary'], "Get the rows of one or more usernames")
+        username = next(p for p in operation['parameters'] if p['name'] == 'username')
+        self.assertEqual(username['type'], 'array')
+
+    def test_optional_modules_are_not_imported_by_urls(self):
+        modules = ('drf_yasg', 'tarfile', 'tracemalloc', 'concurrent.futures.process')
+        code = (
+            "import sys, django; django.setup(); "
+            "import django_project.urls; "
+            f"print([name for name in {modules!r} if name in sys.modules])"
+        )
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+class ColdStartTestCase(TestCase):
+    @unittest.skipIf(
+        connection.vendor == 'sqlite' and 'memory' in str(connection.settings_dict['TEST'].get('NAME') or ':memory:'),
+        "A fresh process cannot reach an in-memory test database"
+    )
+    def test_cold_start_within_budget(self):
+        result = measure_cold_start(env={'DB_NAME': connection.settings_dict['NAME']})
+        self.assertEqual(result['status'], 200)
+        self.assertLessEqual(result['seconds'], settings.COLD_START_BUDGET_SECONDS)
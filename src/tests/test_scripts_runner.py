@@ -0,0 +1,88 @@
+import os
+import subprocess
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from core.coprocess import CoprocessPool
+from core.scripts_runner import run_script
+
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+
+class RunScriptTestCase(SimpleTestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("user2 inbox 000000010 size 000000500\n")
+            f.write("user1 inbox 000000050 size 000001000\n")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_run_script(self):
+        output, error = run_script('max-min-size.sh', [self.file_path])
+        self.assertIsNone(error)
+        self.assertEqual(output, "user1 inbox 000000050 size 000001000")
+
+    def test_run_script_error(self):
+        output, error = run_script('max-min-size.sh', ['/nonexistent/file'])
+        self.assertIsNone(output)
+        self.assertIsNotNone(error)
+
+    @override_settings(SCRIPT_COPROCESS_POOL_SIZE=1)
+    def test_run_script_in_coprocess(self):
+        output, error = run_script('order-by-username.sh', [self.file_path, '-desc'])
+        self.assertIsNone(error)
+        self.assertEqual(output.split('\n')[0].split()[0], "user2")
+
+        output, error = run_script('max-min-size.sh', [self.file_path, '-min'])
+        self.assertEqual(output, "user2 inbox 000000010 size 000000500")
+
+        output, error = run_script('max-min-size.sh', ['/nonexistent/file'])
+        self.assertIsNone(output)
+
+
+class CoprocessPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.pool = CoprocessPool(SCRIPTS_DIR, 1)
+        fd, self.file_path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("user1 inbox 000000050 size 000001000\n")
+
+    def tearDown(self):
+        self.pool.close()
+        os.remove(self.file_path)
+
+    def test_worker_is_reused(self):
+        self.pool.run('max-min-size.sh', [self.file_path])
+        worker = self.pool._idle.queue[0]
+        self.pool.run('max-min-size.sh', [self.file_path])
+        self.assertIs(self.pool._idle.queue[0], worker)
+
+    def test_output_is_not_kept_on_disk(self):
+        self.pool.run('max-min-size.sh', [self.file_path])
+        worker = self.pool._idle.queue[0]
+        self.assertEqual(os.path.getsize(worker.out_path), 0)
+        self.assertEqual(os.path.getsize(worker.err_path), 0)
+
+        self.pool.close()
+        self.assertFalse(os.path.exists(worker.tmp_dir))
+
+    def test_worker_restarts_after_crash(self):
+        self.pool.run('max-min-size.sh', [self.file_path])
+        self.pool._idle.queue[0].process.kill()
+        returncode, stdout, _ = self.pool.run('max-min-size.sh', [self.file_path])
+        self.assertEqual(returncode, 0)
+        self.assertIn("user1", stdout)
+
+    def test_timeout_kills_worker(self):
+        with tempfile.TemporaryDirectory() as scripts_dir:
+            os.symlink(os.path.join(SCRIPTS_DIR, 'coprocess-worker.sh'), os.path.join(scripts_dir, 'coprocess-worker.sh'))
+            with open(os.path.join(scripts_dir, 'slow.sh'), "w") as f:
+                f.write("sleep 10\n")
+            pool = CoprocessPool(scripts_dir, 1)
+            with self.assertRaises(subprocess.TimeoutExpired):
+                pool.run('slow.sh', [], timeout=0.2)
+            self.assertTrue(pool._idle.empty())
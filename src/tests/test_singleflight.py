@@ -0,0 +1,153 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from core.singleflight import SingleFlight, _write_result
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def run_concurrently(self, flights, key, func):
+        results, errors = [], []
+
+        def worker(flight):
+            try:
+                results.append(flight.do(key, func))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(flight,)) for flight in flights]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_identical_calls_share_one_computation(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "output"
+
+        threads, results, errors = self.run_concurrently([flight] * 5, "key", compute)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["output"] * 5)
+        self.assertEqual(errors, [])
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            raise RuntimeError("boom")
+
+        threads, results, errors = self.run_concurrently([flight] * 3, "key", compute)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(all(isinstance(e, RuntimeError) for e in errors))
+
+    def test_sequential_calls_recompute(self):
+        flight = SingleFlight()
+        calls = []
+        flight.do("key", lambda: calls.append(1))
+        flight.do("key", lambda: calls.append(1))
+        self.assertEqual(len(calls), 2)
+
+    def test_calls_are_shared_across_instances_with_lock_dir(self):
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "output"
+
+        with tempfile.TemporaryDirectory() as lock_dir, override_settings(SINGLE_FLIGHT_LOCK_DIR=lock_dir):
+            # Each instance stands for a different worker process.
+            threads, results, errors = self.run_concurrently([SingleFlight(), SingleFlight()], "key", compute)
+            # Let the second caller block on the lock before the first one finishes.
+            time.sleep(0.2)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(os.listdir(lock_dir), [])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["output", "output"])
+
+    def test_result_is_not_written_without_waiters(self):
+        with tempfile.TemporaryDirectory() as lock_dir, override_settings(SINGLE_FLIGHT_LOCK_DIR=lock_dir):
+            self.assertEqual(SingleFlight().do("key", lambda: ("output", None)), ("output", None))
+            self.assertEqual(os.listdir(lock_dir), [])
+
+    @override_settings(SINGLE_FLIGHT_MAX_SHARED_BYTES=20)
+    def test_large_results_are_not_written(self):
+        with tempfile.TemporaryDirectory() as lock_dir:
+            result_path = os.path.join(lock_dir, "key.result")
+            _write_result(result_path, ["x" * 21])
+            _write_result(result_path, [["x" * 5] * 2] * 2)
+            self.assertEqual(os.listdir(lock_dir), [])
+
+            _write_result(result_path, ["x" * 5, None])
+            self.assertEqual(os.listdir(lock_dir), ["key.result"])
+            with open(result_path) as f:
+                self.assertEqual(json.load(f), ["xxxxx", None])
+
+    def test_followers_wait_at_most_their_timeout(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(target=flight.do, args=("key", lambda: release.wait(5)))
+        leader.start()
+        time.sleep(0.05)
+        try:
+            with self.assertRaises(TimeoutError):
+                flight.do("key", lambda: "output", timeout=0.05)
+        finally:
+            release.set()
+            leader.join()
+
+    def test_private_errors_are_not_shared(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results, errors = [], []
+
+        def compute():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(5)
+                raise LookupError("deadline of the first caller")
+            time.sleep(0.1)
+            return "output"
+
+        def worker():
+            try:
+                results.append(flight.do("key", compute, private_errors=(LookupError,)))
+            except LookupError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(results, ["output", "output"])
+        self.assertEqual(len(calls), 2)
@@ -0,0 +1,149 @@
+import os
+import random
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.indexing import build_index
+from core.models import StoredFile
+from core.parallel_scan import summarize_file
+from core.sketches import FileSummary, Histogram, QuantileSketch, rank_error, sample_file
+
+
+class QuantileSketchTestCase(TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        self.values = [int(rng.lognormvariate(10, 2)) for _ in range(5000)] + [0] * 50
+
+    def assert_accurate(self, sketch, values, accuracy):
+        ordered = sorted(values)
+        for q in (0, 0.01, 0.25, 0.5, 0.9, 0.99, 1):
+            expected = ordered[int(q * (len(ordered) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - expected), accuracy * expected + 1e-9, q)
+
+    def test_relative_accuracy(self):
+        sketch = QuantileSketch(0.01)
+        for value in self.values:
+            sketch.add(value)
+        self.assertEqual((sketch.min, sketch.max), (min(self.values), max(self.values)))
+        self.assert_accurate(sketch, self.values, 0.01)
+
+    def test_merge(self):
+        left, right = QuantileSketch(0.02), QuantileSketch(0.02)
+        for i, value in enumerate(self.values):
+            (left if i % 3 else right).add(value)
+        left.merge(right)
+        self.assertEqual(left.count, len(self.values))
+        self.assert_accurate(left, self.values, 0.02)
+
+        with self.assertRaises(ValueError):
+            left.merge(QuantileSketch(0.05))
+
+    def test_empty(self):
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in (0, 1, 3, 3, 9):
+            histogram.add(value)
+        self.assertEqual(
+            [(b["low"], b["high"], b["count"]) for b in histogram.as_list()],
+            [(0, 1, 1), (1, 2, 1), (2, 4, 2), (4, 8, 0), (8, 16, 1)]
+        )
+
+    def test_rank_error_shrinks_with_samples(self):
+        self.assertGreater(rank_error(100, 0.95), rank_error(10000, 0.95))
+        self.assertAlmostEqual(rank_error(10000, 0.95), 0.0136, places=3)
+
+
+class FileSummaryTestCase(TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            for i in range(1000):
+                f.write(f"user{i:04d} inbox {i % 100:09d} size {i * 10:09d}\n")
+            f.write("malformed line\n")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_parallel_summary_matches_sequential(self):
+        sequential = summarize_file(self.file_path, 0.01)
+        with override_settings(PARALLEL_SCAN_WORKERS=2, PARALLEL_SCAN_CHUNKS_PER_WORKER=2, PARALLEL_SCAN_THRESHOLD=1):
+            parallel = summarize_file(self.file_path, 0.01)
+        quantiles = [0.5, 0.9, 0.99]
+        self.assertEqual(sequential.rows, 1000)
+        self.assertEqual(parallel.as_dict(quantiles), sequential.as_dict(quantiles))
+
+    def test_sample_file(self):
+        summary = FileSummary(0.01)
+        samples, sampled_bytes = sample_file(self.file_path, summary, 5, 500, random.Random(1))
+        self.assertEqual(samples, 500)
+        self.assertGreater(summary.rows, 450)
+        self.assertLess(abs(summary.sizes.sketch.quantile(0.5) - 5000), 1000)
+
+
+class SummaryViewSetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.summary_url = reverse('summary-list')
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        for name, offset in (("a.txt", 0), ("b.txt", 100)):
+            with open(os.path.join(settings.UPLOAD_DIR, name), "w") as f:
+                for i in range(100):
+                    f.write(f"user{i:03d} inbox {i + offset:09d} size {(i + offset) * 100:09d}\n")
+            StoredFile.objects.create(filename=name)
+
+    def tearDown(self):
+        for name in ("a.txt", "b.txt"):
+            os.remove(os.path.join(settings.UPLOAD_DIR, name))
+
+    def test_exact_summary_of_several_files(self):
+        response = self.client.get(self.summary_url, {"filename": ["a.txt", "b.txt"], "quantiles": "0,0.5,1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data["approximate"])
+        self.assertEqual(response.data["rows"], 200)
+        messages = response.data["numberMessages"]
+        self.assertEqual((messages["min"], messages["max"], messages["mean"]), (0, 199, 99.5))
+        self.assertEqual(messages["quantiles"]["p0"], 0)
+        self.assertEqual(messages["quantiles"]["p100"], 199)
+        self.assertLessEqual(abs(messages["quantiles"]["p50"] - 99), 2)
+        self.assertEqual(sum(b["count"] for b in response.data["size"]["histogram"]), 200)
+
+    def test_approximate_summary(self):
+        response = self.client.get(self.summary_url, {"filename": "a.txt", "approximate": "1", "budget": "0.5"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["approximate"])
+        accuracy = response.data["accuracy"]
+        self.assertGreater(accuracy["samples"], 0)
+        self.assertEqual(accuracy["confidence"], settings.SUMMARY_APPROX_CONFIDENCE)
+        self.assertLess(accuracy["rankError"], 1)
+        self.assertEqual(response.data["rows"], 100)
+
+    def test_approximate_min_max(self):
+        params = {"filename": ["a.txt", "b.txt"], "approximate": "1", "budget": "0.5"}
+        with tempfile.TemporaryDirectory() as index_dir, override_settings(INDEX_DIR=index_dir):
+            response = self.client.get(self.summary_url, params)
+            self.assertFalse(response.data["accuracy"]["exactMinMax"])
+
+            for stored_file in StoredFile.objects.all():
+                build_index(stored_file.pk)
+            with patch('core.views.sample_file', side_effect=lambda path, summary, *args: (0, 0)):
+                response = self.client.get(self.summary_url, params)
+        self.assertTrue(response.data["accuracy"]["exactMinMax"])
+        self.assertEqual((response.data["numberMessages"]["min"], response.data["numberMessages"]["max"]), (0, 199))
+        self.assertEqual((response.data["size"]["min"], response.data["size"]["max"]), (0, 19900))
+
+    def test_invalid_quantiles(self):
+        response = self.client.get(self.summary_url, {"filename": "a.txt", "quantiles": "0.5,2"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_missing_file(self):
+        response = self.client.get(self.summary_url, {"filename": ["a.txt", "missing.txt"]})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
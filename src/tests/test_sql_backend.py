@@ -0,0 +1,133 @@
+import io
+import os
+import unittest
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import sql_backend
+from core.models import FileIngestion, StoredFile
+
+
+class CopySourceTestCase(TestCase):
+    def test_rows_are_tab_separated(self):
+        f = io.BytesIO(
+            b"user2 inbox 000000100 size 000002000\n"
+            b"garbage\n"
+            b"us\\er1 inbox 000000050 size 000001000\n"
+        )
+        source = sql_backend.CopySource(f, 7)
+        self.assertEqual(
+            source.read(),
+            b"7\t1\tuser2\tinbox\t100\t2000\tuser2 inbox 000000100 size 000002000\n"
+            b"7\t3\tus\\\\er1\tinbox\t50\t1000\tus\\\\er1 inbox 000000050 size 000001000\n"
+        )
+        self.assertEqual(source.rows, 2)
+
+    def test_read_in_small_chunks(self):
+        data = b"".join(f"user{i} inbox {i:09d} size {i:09d}\n".encode() for i in range(100))
+        expected = sql_backend.CopySource(io.BytesIO(data), 1).read()
+
+        source = sql_backend.CopySource(io.BytesIO(data), 1)
+        chunks = []
+        while True:
+            chunk = source.read(7)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 7)
+            chunks.append(chunk)
+        self.assertEqual(b"".join(chunks), expected)
+
+    def test_disabled_without_postgres(self):
+        self.assertIsNone(sql_backend.get_ingested_file_id("test_file.txt", "/nonexistent"))
+
+
+class LimitParamTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "w") as f:
+            f.write("user2 inbox 000000100 size 000002000\n")
+            f.write("user1 inbox 000000050 size 000001000\n")
+            f.write("user3 inbox 000000200 size 000000500\n")
+        StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_order_by_username_limit(self):
+        response = self.client.get(reverse('order-by-username-list'), {"filename": "test_file.txt", "limit": "2"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([d["username"] for d in response.data], ["user1", "user2"])
+
+    def test_between_msgs_limit(self):
+        response = self.client.get(reverse('between-msgs-list'),
+                                   {"filename": "test_file.txt", "low": "0", "high": "1000", "limit": "1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([d["username"] for d in response.data], ["user2"])
+
+    def test_invalid_limit(self):
+        response = self.client.get(reverse('order-by-username-list'), {"filename": "test_file.txt", "limit": "0"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "requires PostgreSQL")
+@override_settings(INGESTION_BACKEND='postgres')
+class PostgresIngestionTestCase(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "w") as f:
+            f.write("user2 inbox 000000100 size 000002000\n")
+            f.write("user1 inbox 000000050 size 000001000\n")
+            f.write("user3 inbox 000000200 size 000000500\n")
+            f.write("user1 sent 000000007 size 000002000\n")
+        self.stored_file = StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        sql_backend.drop_file(self.stored_file.pk)
+        os.remove(self.file_path)
+
+    def test_ingest_and_query(self):
+        sql_backend.ingest_file(self.stored_file.pk)
+        ingestion = FileIngestion.objects.get(stored_file=self.stored_file)
+        self.assertEqual(ingestion.state, FileIngestion.READY)
+        self.assertEqual(ingestion.rows, 4)
+        self.assertEqual(sql_backend.get_ingested_file_id("test_file.txt", self.file_path), self.stored_file.pk)
+
+        pk = self.stored_file.pk
+        self.assertEqual(sql_backend.max_min(pk)["username"], "user2")
+        self.assertEqual(sql_backend.max_min(pk, smallest=True)["username"], "user3")
+        self.assertEqual(
+            [(d["username"], d["folder"]) for d in sql_backend.ordered_by_username(pk)],
+            [("user1", "inbox"), ("user1", "sent"), ("user2", "inbox"), ("user3", "inbox")]
+        )
+        self.assertEqual(
+            [(d["username"], d["folder"]) for d in sql_backend.ordered_by_username(pk, desc=True)],
+            [("user3", "inbox"), ("user2", "inbox"), ("user1", "sent"), ("user1", "inbox")]
+        )
+        self.assertEqual(
+            [d["username"] for d in sql_backend.between_msgs(pk, 10, 150, limit=1)],
+            ["user2"]
+        )
+
+    def test_matches_script_results(self):
+        sql_backend.ingest_file(self.stored_file.pk)
+        for params in ({"desc": "1"}, {"username": "1"}):
+            with override_settings(INGESTION_BACKEND=''):
+                expected = self.client.get(reverse('order-by-username-list'), {"filename": "test_file.txt", **params})
+            response = self.client.get(reverse('order-by-username-list'), {"filename": "test_file.txt", **params})
+            self.assertEqual(response.data, expected.data)
+
+    def test_modified_file_is_not_used(self):
+        sql_backend.ingest_file(self.stored_file.pk)
+        with open(self.file_path, "a") as f:
+            f.write("user4 inbox 000000001 size 000000001\n")
+        self.assertIsNone(sql_backend.get_ingested_file_id("test_file.txt", self.file_path))
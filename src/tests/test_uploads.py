@@ -0,0 +1,138 @@
+import io
+import os
+import tarfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import StoredFile, FileIndex
+from core.uploads import write_file
+
+
+def make_tar(files, mode='w:gz'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, content in files:
+            info = tarfile.TarInfo(name)
+            if content is None:
+                info.type = tarfile.SYMTYPE
+                info.linkname = 'elsewhere'
+                archive.addfile(info)
+            else:
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class BulkUploadTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.bulk_url = reverse('upload-file-bulk-upload')
+        self.test_dir = settings.UPLOAD_DIR
+        os.makedirs(self.test_dir, exist_ok=True)
+
+    def tearDown(self):
+        for filename in os.listdir(self.test_dir):
+            os.remove(os.path.join(self.test_dir, filename))
+
+    def put_tar(self, files, mode='w:gz'):
+        return self.client.put(self.bulk_url, data=make_tar(files, mode), content_type='application/x-tar')
+
+    def read(self, filename):
+        with open(os.path.join(self.test_dir, filename), 'rb') as f:
+            return f.read()
+
+    def test_tar_upload(self):
+        with open(os.path.join(self.test_dir, "old.txt"), "w") as f:
+            f.write("Old content")
+        StoredFile.objects.create(filename="old.txt").delete()
+
+        response = self.put_tar([
+            ("./new.txt", b"New file"),
+            ("old.txt", b"New content"),
+            ("dir/evil.txt", b"x"),
+            ("..", b"x"),
+            ("link.txt", None),
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(r["filename"], r["status"]) for r in response.data],
+            [("new.txt", "created"), ("old.txt", "replaced"), ("dir/evil.txt", "rejected"),
+             ("..", "rejected"), ("link.txt", "rejected")]
+        )
+        self.assertEqual(self.read("new.txt"), b"New file")
+        self.assertEqual(self.read("old.txt"), b"New content")
+        self.assertEqual(
+            sorted(StoredFile.objects.alive().values_list('filename', flat=True)),
+            ["new.txt", "old.txt"]
+        )
+        self.assertEqual(FileIndex.objects.filter(state=FileIndex.PENDING).count(), 2)
+
+    def test_uncompressed_tar(self):
+        response = self.put_tar([("a.txt", b"A")], mode='w')
+        self.assertEqual(response.data, [{"filename": "a.txt", "status": "created"}])
+
+    def test_multipart_upload(self):
+        response = self.client.post(self.bulk_url, {
+            "files": [SimpleUploadedFile("a.txt", b"A"), SimpleUploadedFile("b.txt", b"B")],
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["status"] for r in response.data], ["created", "created"])
+        self.assertEqual(self.read("b.txt"), b"B")
+
+    def test_queries_do_not_grow_with_files(self):
+        def count_queries(prefix, n):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.put_tar([(f"{prefix}{i}.txt", b"x") for i in range(n)])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        self.assertEqual(count_queries("few", 2), count_queries("many", 50))
+
+    def test_invalid_archive(self):
+        response = self.client.put(self.bulk_url, data=b"not a tar archive", content_type='application/x-tar')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_truncated_archive_keeps_written_files(self):
+        data = make_tar([("a.txt", b"A"), ("b.txt", b"B" * 100000)], mode='w')
+        response = self.client.put(self.bulk_url, data=data[:2048], content_type='application/x-tar')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(StoredFile.objects.filter(filename="a.txt").exists())
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "b.txt")))
+
+
+class _FailingReader:
+    def read(self, size=-1):
+        raise OSError("disk full")
+
+
+class WriteFileTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.test_dir = settings.UPLOAD_DIR
+        os.makedirs(self.test_dir, exist_ok=True)
+
+    def tearDown(self):
+        for filename in os.listdir(self.test_dir):
+            os.remove(os.path.join(self.test_dir, filename))
+
+    @override_settings(FILE_UPLOAD_PERMISSIONS=0o644)
+    def test_uploaded_files_are_readable_by_the_web_server(self):
+        self.client.put(f"{reverse('upload-file-upload-file')}?filename=single.txt",
+                        data=b"content", content_type='text/plain')
+        self.client.put(reverse('upload-file-bulk-upload'), data=make_tar([("bulk.txt", b"content")]),
+                        content_type='application/x-tar')
+        for filename in ("single.txt", "bulk.txt"):
+            self.assertEqual(os.stat(os.path.join(self.test_dir, filename)).st_mode & 0o777, 0o644, filename)
+
+    def test_temp_file_is_removed_when_the_write_fails(self):
+        with self.assertRaises(OSError):
+            write_file(_FailingReader(), os.path.join(self.test_dir, "failed.txt"))
+        self.assertEqual(os.listdir(self.test_dir), [])
@@ -1,7 +1,7 @@
 import os
 
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.conf import settings
 
 from rest_framework import status
@@ -177,4 +177,64 @@ class BetweenMsgsViewSetTestCase(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         usernames = [user["username"] for user in response.data]
-        self.assertEqual(usernames, ["user1", "user2"])
\ No newline at end of file
+        self.assertEqual(usernames, ["user1", "user2"])
+
+
+class DownloadFileViewSetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.download_url = reverse('download-file-list')
+
+        self.file_path = os.path.join(settings.UPLOAD_DIR, "test_file.txt")
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        with open(self.file_path, "wb") as f:
+            f.write(b"0123456789")
+        StoredFile.objects.create(filename="test_file.txt")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_download_file(self):
+        response = self.client.get(self.download_url, {"filename": "test_file.txt"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("ETag", response)
+
+    def test_download_range(self):
+        response = self.client.get(self.download_url, {"filename": "test_file.txt"}, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), b"2345")
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(response["Content-Length"], "4")
+
+    def test_download_suffix_range(self):
+        response = self.client.get(self.download_url, {"filename": "test_file.txt"}, HTTP_RANGE="bytes=-3")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+
+    def test_download_unsatisfiable_range(self):
+        response = self.client.get(self.download_url, {"filename": "test_file.txt"}, HTTP_RANGE="bytes=20-30")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_download_suffix_range_of_empty_file(self):
+        open(self.file_path, "wb").close()
+        response = self.client.get(self.download_url, {"filename": "test_file.txt"}, HTTP_RANGE="bytes=-10")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], "bytes */0")
+
+    def test_download_not_modified(self):
+        etag = self.client.get(self.download_url, {"filename": "test_file.txt"})["ETag"]
+        response = self.client.get(self.download_url, {"filename": "test_file.txt"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_download_deleted_file(self):
+        StoredFile.objects.filter(filename="test_file.txt").delete()
+        response = self.client.get(self.download_url, {"filename": "test_file.txt"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(DOWNLOAD_SENDFILE_HEADER="X-Accel-Redirect")
+    def test_download_accel_redirect(self):
+        response = self.client.get(self.download_url, {"filename": "test_file.txt"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-uploads/test_file.txt")